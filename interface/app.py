@@ -3,13 +3,62 @@ import websockets
 from transitions import Machine
 from gpioConstants import *
 import RPi.GPIO as GPIO
-from time import sleep
-import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import subprocess
-import random
 import time
 import os
+import json
+import socket
+import tempfile
+import threading
+import glob
+from urllib.parse import quote
+from latency import LatencyTracker
+from scheduler import AutoRingScheduler, LoopClock
+from capture import Recorder, RecordingMeter, merge_quality, BLOCK_SECONDS, LEVEL_INTERVAL, LEVEL_FLOOR, STARTUP_CHECK
+
+# Interval in seconds between two latency reports sent via websocket
+LATENCY_REPORT_INTERVAL = 60
+
+# Heartbeat LED blink pattern, 0.1 seconds on and 0.4 seconds off
+HEARTBEAT_FREQUENCY = 2
+HEARTBEAT_DUTY_CYCLE = 20
+
+# Time in seconds the phone line has to be stable before a hook edge is accepted
+HOOK_DEBOUNCE = 0.3
+
+# Threads for blocking I/O like uploads and downloads, so they never block the event loop
+IO_WORKERS = 2
+
+# Address of the server, can be overridden to run against another instance
+SERVER = os.environ.get('WEDDINGRING_SERVER', 'localhost:8080')
+
+# Id of this phone, so one server can coordinate several of them
+# The server keeps a configuration per phone, routes commands to it and stores it with the recordings
+DEVICE_ID = os.environ.get('WEDDINGRING_DEVICE') or socket.gethostname()
+
+# The phone identifies itself when it connects to the websocket
+SOCKET_URL = f"ws://{SERVER}/socket?device={quote(DEVICE_ID)}"
+
+# Folder caching the downloaded messages, keyed by their checksum
+MESSAGE_CACHE_FOLDER = 'message_cache'
+
+# Number of messages kept in the cache, the least recently played ones are removed first
+MESSAGE_CACHE_SIZE = 50
+
+# Files of the recordings, a recording is only deleted once the server has stored it
+RECORDING_PATTERN = 'recorded_*.wav'
+
+# Recordings the server refused, e.g. because they do not meet its audio requirements, are moved here
+REJECTED_FOLDER = 'rejected'
+
+# An upload that failed because the server was unreachable or had an error is retried after a delay in seconds that
+# doubles with every attempt up to UPLOAD_RETRY_MAX_DELAY. After UPLOAD_MAX_ATTEMPTS the recording stays on the card
+# and is only queued again after a restart
+UPLOAD_RETRY_DELAY = 30
+UPLOAD_RETRY_MAX_DELAY = 30 * 60
+UPLOAD_MAX_ATTEMPTS = 10
 
 # Function to get the current phone interface status
 # This function reads the GPIOs for the phone interface
@@ -55,9 +104,18 @@ class PhoneStateMachine:
         # Initialize recording filename
         self.recording_filename = None
 
+        # Level meter of the running recording and the task polling it
+        self.recording_meter = None
+        self.meter_task = None
+
         # Initialize debug state attribute
         self.debug = False
 
+        # Initialize the call latency tracking
+        # The timeline belongs to the call that is currently being set up or torn down
+        self.latency = LatencyTracker()
+        self.timeline = None
+
         # Setup GPIO event detection
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
@@ -72,12 +130,23 @@ class PhoneStateMachine:
         # Add event detection for the phone interface
         GPIO.add_event_detect(GPIO_LA_UPPER, GPIO.BOTH, callback=self.phoneInterfaceCallback)
 
-        # Start the heartbeat thread
-        self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
-        self.heartbeat_thread.start()
+        # Blink the heartbeat LED with PWM, so no Python code has to wake up for it
+        # The PWM object has to be kept, the LED stops blinking once it is garbage collected
+        self.heartbeat = GPIO.PWM(GPIO_HEARTBEAT_A, HEARTBEAT_FREQUENCY)
+        self.heartbeat.start(HEARTBEAT_DUTY_CYCLE)
 
-        # Message index
-        self.message_index = 0
+        # Hook edges are debounced on the event loop, only one debounce runs at a time
+        self.debounce_task = None
+
+        # Bounded pool for blocking I/O, uploads queue up instead of starting a thread each
+        self.executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='io')
+
+        # Recordings whose upload failed, file path to the call quality, the failed attempts and the time of the retry
+        # They are uploaded again once their delay passed, the ones left by an earlier run right away
+        self.pending_uploads = {
+            file_path: {'quality': None, 'attempts': 0, 'retryAt': 0} for file_path in glob.glob(RECORDING_PATTERN)
+        }
+        self.pending_lock = threading.Lock()
 
         # Initialize an default config
         self.config = {
@@ -88,11 +157,13 @@ class PhoneStateMachine:
             'ringOffTime': 1,
             'ringCount': 4,
             'messages': True,
-            'randomMessages': True
+            'randomMessages': True,
+            'capturePeriodTime': None,
+            'captureBufferTime': None
         }
 
-        # Run auto ring daemon
-        self.start_auto_ringing()
+        # Plans the automated rings on the event loop, it starts once the config is received
+        self.scheduler = AutoRingScheduler(LoopClock(loop), self.auto_ring, self.publish_next_ring)
 
 
     # Wait overall N seconds, but do it in 0.1s intervals
@@ -103,6 +174,7 @@ class PhoneStateMachine:
             # Before we wait to ring again, we check if the interface tells us the phone is off-hook
             if getCurrentPhoneInterfaceStatus() == 'OFF_HOOK':
                 print("Phone is off-hook, stopping ringer")
+                self.timeline = self.latency.begin('pickUp')
                 self.answer_call()
                 return True
         return False
@@ -119,6 +191,7 @@ class PhoneStateMachine:
             # Before we ring again, we check if the interface tells us the phone is off-hook
             if getCurrentPhoneInterfaceStatus() == 'OFF_HOOK':
                 print("Phone is off-hook, stopping ringer")
+                self.timeline = self.latency.begin('pickUp')
                 self.answer_call()
                 return
             GPIO.output(GPIO_RING_RELAY, GPIO.HIGH)
@@ -136,38 +209,61 @@ class PhoneStateMachine:
         self.miss_call()
         
     # Callback function for the phone interface
-    # This function is called when the phone interface changes state
-    # It will check the current state of the phone interface and transition the state machine accordingly
-    # The function will only check the interface if the state is not ringing
+    # This function is called from the GPIO thread when the phone interface changes state
+    # It only hands the edge to the event loop, the debouncing happens there
     def phoneInterfaceCallback(self, channel):
-        # We only check the interface if we're not in state ringing
-        if self.state != 'ringing':
+        edgeDetected = time.monotonic()
+        self.loop.call_soon_threadsafe(self.hook_edge, edgeDetected)
+
+    # Start debouncing a hook edge, unless a debounce is already running
+    # Further edges during a debounce are covered by it, since it reads the interface again
+    def hook_edge(self, edge_detected):
+        if self.debounce_task is None or self.debounce_task.done():
+            self.debounce_task = asyncio.create_task(self.debounce_hook(edge_detected))
+
+    # Check the interface until it is stable and transition the state machine accordingly
+    # The interface is only checked if the state is not ringing, the ringer checks it itself
+    async def debounce_hook(self, edge_detected):
+        while self.state != 'ringing':
             newState = getCurrentPhoneInterfaceStatus()
-            sleep(0.3)
+            await asyncio.sleep(HOOK_DEBOUNCE)
             newStateCheck = getCurrentPhoneInterfaceStatus()
-            if newState == newStateCheck:
-                print(f"Phone interface returned {newState}")
-                if newState == 'ON_HOOK' and self.state == 'offHook':
-                    asyncio.run_coroutine_threadsafe(self.transition_to_hang_up(), self.loop)
-                elif newState == 'OFF_HOOK' and self.state == 'onHook':
-                    asyncio.run_coroutine_threadsafe(self.transition_to_pick_up(), self.loop)
-                else:
-                    print('This state transition is not supported')
-            else:
+            if newState != newStateCheck:
                 print("Interface status is not stable, retrying...")
-        # else:
-        #     print("Phone is ringing, no need to check interface status")
+                continue
+            print(f"Phone interface returned {newState}")
+            if newState == 'ON_HOOK' and self.state == 'offHook':
+                timeline = self.latency.begin('hangUp', edge_detected)
+                timeline.mark('debounced')
+                await self.transition_to_hang_up(timeline)
+            elif newState == 'OFF_HOOK' and self.state == 'onHook':
+                timeline = self.latency.begin('pickUp', edge_detected)
+                timeline.mark('debounced')
+                await self.transition_to_pick_up(timeline)
+            else:
+                print('This state transition is not supported')
+            return
 
     # Transition to hang up state
-    async def transition_to_hang_up(self):
+    # The timeline of the hook edge is kept until the state has been entered
+    async def transition_to_hang_up(self, timeline=None):
         print("Transitioning to hang up")
+        self.timeline = timeline
+        self.mark_latency('transition_fired')
         self.hang_up()
     
     # Transition to pick up state
-    async def transition_to_pick_up(self):
+    async def transition_to_pick_up(self, timeline=None):
         print("Transitioning to pick up")
+        self.timeline = timeline
+        self.mark_latency('transition_fired')
         self.pick_up()
 
+    # Mark a stage on the timeline of the current call, if there is one
+    def mark_latency(self, stage):
+        if self.timeline:
+            self.timeline.mark(stage)
+
     # Transition to ringing state
     async def transition_to_ringing(self):
         print("Transitioning to ringing")
@@ -187,6 +283,7 @@ class PhoneStateMachine:
             # Stop recording and playback when entering onHook
             self.stop_recording()
             self.stop_playback()
+        self.timeline = None
 
     # This function is called when the state machine enters the offHook state
     # It will set the GPIOs to the correct state and send a message to the server
@@ -200,9 +297,10 @@ class PhoneStateMachine:
         asyncio.create_task(self.send_message('STATUS:OFF_HOOK'))
 
         if self.debug == False:
-            # Start recording and playback
+            # Start recording and playback, the message is fetched in the background
             self.start_recording()
-            self.start_playback()
+            self.executor.submit(self.start_playback, self.timeline)
+        self.timeline = None
 
     # This function is called when the state machine enters the ringing state
     # It will set the GPIOs to the correct state and send a message to the server
@@ -223,10 +321,17 @@ class PhoneStateMachine:
                 async with websockets.connect(uri) as websocket:
                     print("Connected to WebSocket.")
                     self.websocket = websocket
+                    # Get the latest config, this also reports the next automated ring
+                    await self.get_latest_config()
+                    # Upload the recordings the server did not get while it was unreachable
+                    self.retry_uploads()
+                    # Report the call latency while connected
+                    latency_task = asyncio.create_task(self.report_latency())
                     # Start the message listener
-                    await asyncio.gather(self.listen_for_messages(), self.run_state_machine())
-                    # Get the latest config
-                    self.get_latest_config()
+                    try:
+                        await asyncio.gather(self.listen_for_messages(), self.run_state_machine())
+                    finally:
+                        latency_task.cancel()
                     break  # Exit the loop if the connection was successful
             except Exception as e:
                 print(f"Connection failed: {e}. Retrying in 5 seconds...")
@@ -250,7 +355,7 @@ class PhoneStateMachine:
                     print("Received config update command")
                     # Handle the config update command here
                     await self.send_message("STATUS:CONFIG_UPDATED")
-                    self.get_latest_config()
+                    await self.get_latest_config()
                 # This command will send the current status to the server
                 elif message == "COMMAND:SEND_STATUS":
                     print("Received status request command")
@@ -261,6 +366,7 @@ class PhoneStateMachine:
                         await self.send_message('STATUS:OFF_HOOK')
                     elif self.state == 'ringing':
                         await self.send_message('STATUS:RINGING')
+                    self.scheduler.publish()
                 # This command will play a message to the user
                 elif message.startswith("COMMAND:START_PLAYBACK"):
                     print("Received play message command")
@@ -272,14 +378,7 @@ class PhoneStateMachine:
                             message_id = parts[2]
                             print(f"Playing message with ID: {message_id}")
                             await self.send_message("STATUS:DEBUG:START_PLAYBACK:" + message_id)
-                            # Get the message from the server
-                            response = requests.get(f"http://localhost:8080/messages/{message_id}/binary")
-                            if response.status_code == 200:
-                                with open("playback.wav", "wb") as f:
-                                    f.write(response.content)
-                                self.start_playback()
-                            else:
-                                print(f"Failed to get message: {response.status_code}")
+                            self.executor.submit(self.play_message, message_id)
                         else:
                             print(f"Invalid message format: {message}")
                     else:
@@ -302,6 +401,15 @@ class PhoneStateMachine:
                     # send acknowledgement message
                     await self.send_message("STATUS:DEBUG:OFF")
                     self.debug = False
+                # This command will send the current call latency summary
+                elif message == "COMMAND:SEND_LATENCY":
+                    print("Received latency request command")
+                    await self.send_latency()
+                # This command will write all latency samples to a file for offline analysis
+                elif message == "COMMAND:DUMP_LATENCY":
+                    print("Received latency dump command")
+                    file_path = self.latency.dump(f"latency_{int(time.time())}.json")
+                    await self.send_message("STATUS:LATENCY_DUMPED:" + file_path)
                 # This command will start the recording
                 elif message == "COMMAND:START_RECORDING":
                     print("Received start recording command")
@@ -324,11 +432,13 @@ class PhoneStateMachine:
             print(f"Connection closed or error encountered: {e}")
 
     # Send a websocket message to the server
-    async def send_message(self, message):
+    # Frequent messages like the input level are not logged
+    async def send_message(self, message, log=True):
         if self.websocket:
             try:
                 await self.websocket.send(message)
-                print(f"Sent message: {message}")
+                if log:
+                    print(f"Sent message: {message}")
             except Exception as e:
                 print(f"Failed to send message, connection closed or error encountered: {e}")
 
@@ -336,78 +446,188 @@ class PhoneStateMachine:
     async def run_state_machine(self):
         print(f"Current state: {self.state}")
 
-    # Heartbeat function that blinks the heartbeat LED
-    # This function runs in a separate thread
-    # The heartbeat LED is connected to GPIO_HEARTBEAT_A
-    # This is used to indicate that the program is running
-    def heartbeat(self):
+    # Send the call latency summary to the server
+    # The summary contains count, percentiles and maximum per stage in milliseconds
+    async def send_latency(self):
+        await self.send_message("STATUS:LATENCY:" + json.dumps(self.latency.summary(), separators=(',', ':')))
+
+    # Periodically report the call latency summary via websocket
+    async def report_latency(self):
         while True:
-            GPIO.output(GPIO_HEARTBEAT_A, GPIO.HIGH)
-            sleep(0.1)
-            GPIO.output(GPIO_HEARTBEAT_A, GPIO.LOW)
-            sleep(0.4)
+            await asyncio.sleep(LATENCY_REPORT_INTERVAL)
+            await self.send_latency()
 
     # Starts the actual recording using arecord with the correct settings
     # The recording is saved to a file called recorded.wav
     # The file is recorded in 32-bit signed little-endian format, with a sample rate of 96kHz and 2 channels
     # The recording is started in a separate process, which is stored in the recording_process attribute
     # This allows us to stop the recording later on demand
+    # The period and buffer time of the device come from the config, the defaults of ALSA are used without them.
+    # The stderr of arecord is followed for overruns and a recorder that exits early is reported to the server
     def start_recording(self):
         print("Starting recording")
         self.recording_filename = f"recorded_{int(time.time())}.wav"
-        self.recording_process = subprocess.Popen([
-            'arecord', '-D', 'plughw:0', '-c', '2', '-r', '96000', '-f', 'S32_LE', '-t', 'wav', self.recording_filename
-        ])
+        self.recording_process = Recorder(self.recording_filename, self.config.get('capturePeriodTime'),
+                                          self.config.get('captureBufferTime'))
+        self.recording_process.start()
+        self.mark_latency('recorder_started')
+        self.recording_meter = RecordingMeter(self.recording_filename)
+        self.meter_task = asyncio.create_task(self.meter_recording(self.recording_meter))
+        self.loop.call_later(STARTUP_CHECK, self.check_recorder, self.recording_process)
+
+    # Report a recorder that is no longer running shortly after it was started, e.g. the device was busy
+    # The message is "STATUS:CAPTURE_FAILED:" followed by JSON with the exit code and the last error of arecord
+    def check_recorder(self, recorder):
+        if recorder is not self.recording_process:
+            return
+        failure = recorder.failure()
+        if failure:
+            print(f"Recorder failed: {failure}")
+            asyncio.create_task(self.send_message("STATUS:CAPTURE_FAILED:" + json.dumps(failure, separators=(',', ':'))))
+
+    # Meter the input level of the recording while it is running
+    # The loudest block since the last frame is sent as "STATUS:LEVEL:<rms>,<peak>" in dBFS,
+    # at most every LEVEL_INTERVAL seconds
+    async def meter_recording(self, meter):
+        rms = peak = LEVEL_FLOOR
+        last_sent = self.loop.time()
+        while True:
+            await asyncio.sleep(BLOCK_SECONDS)
+            try:
+                levels = meter.poll()
+            except Exception as e:
+                print(f"Level metering stopped: {e}")
+                return
+            if levels is not None and len(levels[0]):
+                rms = max(rms, float(levels[0].max()))
+                peak = max(peak, float(levels[1].max()))
+            if self.loop.time() - last_sent >= LEVEL_INTERVAL:
+                last_sent = self.loop.time()
+                await self.send_message(f"STATUS:LEVEL:{rms:.1f},{peak:.1f}", log=False)
+                rms = peak = LEVEL_FLOOR
+
+    # Stop metering and return the call quality of the recording
+    # The audio written after the last poll is metered first
+    def stop_metering(self, meter, meter_task):
+        if meter_task:
+            meter_task.cancel()
+        if meter is None:
+            return None
+        try:
+            meter.poll()
+            return meter.quality()
+        except Exception as e:
+            print(f"Failed to meter the recording: {e}")
+            return None
+        finally:
+            meter.close()
 
     # Stops the recording process
     # This is done by terminating the process
     # After stopping the recording, we post-process the recording
+    # Waiting for arecord to finalize the file runs in the I/O executor, so the event loop keeps handling hook
+    # edges and the websocket meanwhile. A new call may start before, the recording keeps its own meter and timeline
     def stop_recording(self):
         print("Stopping recording")
         if self.recording_process:
-            self.recording_process.terminate()
+            recorder = self.recording_process
             self.recording_process = None
-            # Post-process the recording asynchronously
-            self.post_process_recording(self.recording_filename)
-
-    # Starts the playback of the message
-    # The message is played back using aplay with the correct settings
-    # The playback is done in a separate process, which is stored in the playback_process attribute
-    # This allows us to stop the playback later on demand
-    def start_playback(self):
+            recorder.terminate()
+            meter, meter_task = self.recording_meter, self.meter_task
+            self.recording_meter = None
+            self.meter_task = None
+            asyncio.create_task(self.finish_recording(recorder, meter, meter_task, self.timeline))
+
+    # Wait for the recorder to finalize the file and post-process the recording
+    # The capture report of the recorder (overruns, audio missing from the file) is added to the call quality
+    async def finish_recording(self, recorder, meter, meter_task, timeline):
+        try:
+            capture, failure = await self.loop.run_in_executor(self.executor, recorder.stop)
+        except Exception as e:
+            print(f"Failed to stop recording: {e}")
+            self.stop_metering(meter, meter_task)
+            return
+        if timeline:
+            timeline.mark('recorder_stopped')
+        if failure:
+            print(f"Recorder had stopped on its own: {failure}")
+        quality = merge_quality(self.stop_metering(meter, meter_task), capture)
+        if not os.path.exists(recorder.file_path):
+            print("Recorder did not create a file, nothing to upload")
+            return
+        # Post-process the recording asynchronously
+        self.post_process_recording(recorder.file_path, timeline, quality)
+
+    # Starts the playback of the next message
+    # The server picks the message according to the configured message order and keeps the
+    # position, so only the picked message is transferred and the order survives restarts.
+    # Runs in the I/O executor, timeline is the call that started the playback
+    def start_playback(self, timeline=None):
         if self.config['messages'] == False:
             print("Messages are disabled, can not play message")
             return
         print("Starting playback")
-        # Get list of messages from server
-        messageList = requests.get("http://localhost:8080/messages").json()
-        messageCount = len(messageList)
-        # Determine which message to use
-        if self.config['randomMessages']:
-            # Use a random message
-            # The message_index is set to a random number between 0 and the number of messages
-            self.message_index = random.randint(0, messageCount - 1)
-        else:
-            # Use the next message in the list
-            # If we reach the end of the list, start over
-            # This is done by using the modulo operator
-            # The message_index will be incremented by 1 and then taken modulo the messageCount
-            # This will result in the message_index being reset to 0 when it reaches the end of the list
-            self.message_index = (self.message_index + 1) % messageCount
-        # Get the message ID from the message list
-        message_id = messageList[self.message_index]['id']
+        response = requests.get(f"http://{SERVER}/messages/next")
+        if response.status_code == 404:
+            print("No messages available, can not play message")
+            return
+        if response.status_code != 200:
+            print(f"Failed to pick message: {response.status_code}")
+            return
+        message = response.json()
+        self.play_message(message['id'], message.get('checksum'), timeline)
+
+    # Fetch a message and start playing it on the event loop
+    # Runs in the I/O executor
+    def play_message(self, message_id, checksum=None, timeline=None):
         print(f"Playing message with ID: {message_id}")
-        # # Get the message from the server
-        # response = requests.get(f"http://localhost:8080/messages/{message_id}/binary")
-        if response.status_code == 200:
-            with open("playback.wav", "wb") as f:
-                f.write(response.content)
-            # Start the playback process
-            self.playback_process = subprocess.Popen([
-                'aplay', '-D', 'plughw:0', '-c', '2', '-r', '96000', '-f', 'S32_LE', "/home/pi/weddingRingManager/server/messages/{message_id}.wav"
-            ])
-        else:
+        file_path = self.get_message_file(message_id, checksum)
+        if file_path:
+            self.loop.call_soon_threadsafe(self.play_file, file_path, timeline)
+
+    # Get the local file of a message, it is only downloaded if it is not cached yet
+    # Messages stored before the server computed checksums are cached by their id
+    # Returns the path of the file or None if the download failed
+    def get_message_file(self, message_id, checksum=None):
+        os.makedirs(MESSAGE_CACHE_FOLDER, exist_ok=True)
+        file_path = os.path.join(MESSAGE_CACHE_FOLDER, f"{checksum or message_id}.wav")
+        if os.path.exists(file_path):
+            # The modification time marks the file as recently used
+            os.utime(file_path)
+            return file_path
+        response = requests.get(f"http://{SERVER}/messages/{message_id}/binary")
+        if response.status_code != 200:
             print(f"Failed to get message: {response.status_code}")
+            return None
+        # Write to a temporary file first, so an interrupted download is never played
+        # The name is unique, two workers may download the same message at the same time
+        with tempfile.NamedTemporaryFile(dir=MESSAGE_CACHE_FOLDER, suffix='.part', delete=False) as f:
+            f.write(response.content)
+        os.replace(f.name, file_path)
+        self.prune_message_cache()
+        return file_path
+
+    # Remove the least recently used messages if the cache holds more than MESSAGE_CACHE_SIZE files
+    def prune_message_cache(self):
+        files = [entry for entry in os.scandir(MESSAGE_CACHE_FOLDER) if entry.name.endswith('.wav')]
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:max(0, len(files) - MESSAGE_CACHE_SIZE)]:
+            os.remove(entry.path)
+
+    # Play a wav file
+    # The playback is done in a separate process, which is stored in the playback_process attribute
+    # This allows us to stop the playback later on demand
+    # Runs on the event loop, a message that arrives after the phone was hung up is not played
+    def play_file(self, file_path, timeline=None):
+        if self.state != 'offHook':
+            print("Phone is not off-hook anymore, not playing message")
+            return
+        self.playback_process = subprocess.Popen([
+            'aplay', '-D', 'plughw:0', '-c', '2', '-r', '96000', '-f', 'S32_LE', file_path
+        ])
+        # aplay does not report its first frame, spawning the process is the closest observable point
+        if timeline:
+            timeline.mark('playback_started')
 
     # Stops the playback process
     # This is done by terminating the process
@@ -420,67 +640,117 @@ class PhoneStateMachine:
     # Upload the recording to the server
     # This function will upload the recording to the server
     # The recording is uploaded as a file to the server
-    def upload_recording(self, file_path):
+    # The timeline of the hang up is marked once the server acknowledged the upload
+    # quality is the call quality measured by the level meter together with the capture report, it is stored with the record
+    # The file is the only copy of the recording, it is deleted once the server stored it. It is kept for a retry if
+    # the server was unreachable or answered with 5xx, and moved to REJECTED_FOLDER if the server refused it (4xx).
+    # attempts is the number of uploads of the file that failed before
+    def upload_recording(self, file_path, timeline=None, quality=None, attempts=0):
+        status = None
         try:
             with open(file_path, "rb") as f:
-                response = requests.post("http://localhost:8080/records", files={"file": f})
-            if response.status_code == 201:
+                data = {"device": DEVICE_ID}
+                if quality:
+                    data["quality"] = json.dumps(quality)
+                response = requests.post(f"http://{SERVER}/records", files={"file": f}, data=data)
+            status = response.status_code
+            # 200 means the same audio was already stored, e.g. by a retried upload
+            if status in (200, 201):
                 print("Upload successful")
+                if timeline:
+                    timeline.mark('upload_acknowledged')
             else:
-                print(f"Upload failed with status code: {response.status_code}")
+                print(f"Upload failed with status code: {status}")
         except Exception as e:
             print(f"Failed to upload recording: {e}")
-        finally:
+        if status in (200, 201):
             # Delete the file after uploading
             os.remove(file_path)
             print(f"Deleted file: {file_path}")
+        elif not os.path.exists(file_path):
+            return
+        elif status is not None and status < 500:
+            # Sending the same file again would be refused again
+            self.reject_recording(file_path, status)
+        else:
+            self.queue_upload(file_path, quality, attempts + 1)
+
+    # Keep a recording whose upload failed for another attempt after the backoff delay
+    def queue_upload(self, file_path, quality, attempts):
+        if attempts >= UPLOAD_MAX_ATTEMPTS:
+            print(f"Giving up uploading {file_path} after {attempts} attempts, it is queued again after a restart")
+            return
+        delay = min(UPLOAD_RETRY_DELAY * 2 ** (attempts - 1), UPLOAD_RETRY_MAX_DELAY)
+        with self.pending_lock:
+            self.pending_uploads[file_path] = {'quality': quality, 'attempts': attempts, 'retryAt': time.monotonic() + delay}
+        print(f"Kept file for another upload in {delay} seconds: {file_path}")
+        # Retried even if no call and no reconnect happens meanwhile
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, self.retry_uploads)
+
+    # Move a recording the server refused out of the queue, it is kept for a manual import
+    def reject_recording(self, file_path, status):
+        os.makedirs(REJECTED_FOLDER, exist_ok=True)
+        target = os.path.join(REJECTED_FOLDER, os.path.basename(file_path))
+        os.replace(file_path, target)
+        print(f"Server refused the recording with status code {status}, moved it to {target}")
+
+    # Upload the recordings again whose retry delay passed
+    # The server stores the same audio only once, so a recording that did arrive is not stored twice
+    def retry_uploads(self):
+        now = time.monotonic()
+        with self.pending_lock:
+            due = {file_path: upload for file_path, upload in self.pending_uploads.items() if upload['retryAt'] <= now}
+            for file_path in due:
+                del self.pending_uploads[file_path]
+        for file_path, upload in due.items():
+            print(f"Retrying upload of {file_path}")
+            self.executor.submit(self.upload_recording, file_path, None, upload['quality'], upload['attempts'])
 
     # Post-process the recording
     # This function is called after the recording has been stopped
-    def post_process_recording(self, file_path):
+    def post_process_recording(self, file_path, timeline=None, quality=None):
         print("Post-processing recording")
-        threading.Thread(target=self.upload_recording, args=(file_path,), daemon=True).start()
+        if quality and quality['quality'] != 'ok':
+            print(f"Recording quality: {quality}")
+        self.executor.submit(self.upload_recording, file_path, timeline, quality)
+        # Recordings whose upload failed before are retried together with every new one
+        self.retry_uploads()
 
     # Get the latest config from the server and apply it
     # This function sends a request to the server to get the latest config
+    # The server applies the settings of this phone to the default config
     # The config is stored in the config attribute
-    def get_latest_config(self):
-        response = requests.get("http://localhost:8080/config")
+    # The request runs in the I/O executor, the config is applied on the event loop
+    async def get_latest_config(self):
+        response = await self.loop.run_in_executor(self.executor, requests.get, f"http://{SERVER}/config?device={quote(DEVICE_ID)}")
         if response.status_code == 200:
             self.config = response.json()
             print("Received config:", self.config)
+            self.scheduler.configure(self.config)
         else:
             print("Failed to get config:", response.status_code)
 
-    # Starts a separate thread that will perform the randomized ringing
-    # The ringing will be done according to the config settings
-    # The ringing will be done in a separate thread to not block the main thread
-    def start_auto_ringing(self):
-        print("Starting auto ringing daemon")
-        threading.Thread(target=self.auto_ringing_thread, daemon=True).start()
-
-    # The auto ringing thread function
-    # This function will perform the randomized ringing
-    # The ringing will be done according to the config settings
-    def auto_ringing_thread(self):
-        while True:
-            if self.config['autoRing'] and self.debug == False:
-                # Calculate the random time to wait
-                wait_time = random.randint(self.config['autoRingMinSpan'] * 60, self.config['autoRingMaxSpan'] * 60)
-                print(f"Waiting {wait_time} seconds before ringing")
-                sleep(wait_time)
-                if self.state == 'onHook':
-                    asyncio.run_coroutine_threadsafe(self.transition_to_ringing(), self.loop)
-                else:
-                    print("Can not ring, since we are already off-hook.")
-            else:
-                sleep(10)
+    # Ring the phone, called by the auto ring scheduler on the event loop
+    def auto_ring(self):
+        if self.debug:
+            print("Debug mode is on, skipping automated ring")
+        elif self.state == 'onHook':
+            self.incoming_call()
+        else:
+            print("Can not ring, since we are already off-hook.")
+
+    # Send the time of the next automated ring to the server
+    # The message is "STATUS:NEXT_RING:" followed by JSON with the time in seconds since the epoch,
+    # null if auto ring is disabled, and whether the ring was moved to the end of the quiet hours
+    def publish_next_ring(self, next_ring, quiet):
+        status = json.dumps({'nextRing': next_ring and int(next_ring), 'quiet': quiet}, separators=(',', ':'))
+        asyncio.run_coroutine_threadsafe(self.send_message("STATUS:NEXT_RING:" + status), self.loop)
 
 # Main function
 async def main():
     loop = asyncio.get_running_loop()
     phone = PhoneStateMachine(loop)
-    await phone.connect_to_websocket("ws://localhost:8080/socket")
+    await phone.connect_to_websocket(SOCKET_URL)
 
 # Run the main function
 if __name__ == "__main__":
@@ -0,0 +1,325 @@
+import os
+import re
+import struct
+import time
+import threading
+import subprocess
+from collections import deque
+import numpy as np
+
+# Level metering of the recording
+# arecord keeps writing the recording straight into its file. The meter follows the growing file like
+# tail -f and reads the new audio from the page cache, so the capture path itself is not touched:
+# a slow meter can never make arecord overrun, it only falls behind and catches up on the next poll.
+
+# Length of a metering block in seconds
+BLOCK_SECONDS = 0.1
+
+# Minimum time in seconds between two level frames sent via websocket
+LEVEL_INTERVAL = 0.25
+
+# Level in dBFS reported for digital silence
+LEVEL_FLOOR = -120.0
+
+# A block whose RMS level is below this many dBFS is silent
+SILENCE_LEVEL = -60.0
+# Silence of this many seconds in a row flags the recording, e.g. a dead microphone
+SILENCE_SECONDS = 10
+
+# A block whose peak level reaches this many dBFS is clipped
+CLIPPING_LEVEL = -0.1
+# Clipped blocks of this many seconds in total flag the recording
+CLIPPING_SECONDS = 0.5
+
+# numpy sample types of the supported sample widths in bytes
+SAMPLE_TYPES = {2: '<i2', 4: '<i4'}
+
+# Convert linear levels (0..1) to dBFS
+def to_db(levels):
+    return np.maximum(20 * np.log10(np.maximum(levels, 1e-12)), LEVEL_FLOOR)
+
+# Parse the header of a wav file that is still being written
+# Returns the sample rate, channels, sample width and the offset of the audio data,
+# or None if the header is not complete yet
+def parse_wav_header(data):
+    if len(data) < 12:
+        return None
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError('Not a wav file')
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+        if chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('The data chunk comes before the fmt chunk')
+            return fmt + (offset + 8,)
+        if chunk_id == b'fmt ':
+            if offset + 24 > len(data):
+                return None
+            channels, sample_rate = struct.unpack('<HI', data[offset + 10:offset + 16])
+            bits = struct.unpack('<H', data[offset + 22:offset + 24])[0]
+            fmt = (sample_rate, channels, bits // 8)
+        offset += 8 + chunk_size + chunk_size % 2
+    return None
+
+# Computes the RMS and peak level of every block of the recording and tracks the call quality
+class LevelMeter:
+    def __init__(self, sample_rate, channels, sample_width):
+        if sample_width not in SAMPLE_TYPES:
+            raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+        self.dtype = np.dtype(SAMPLE_TYPES[sample_width])
+        self.block_size = max(1, int(sample_rate * BLOCK_SECONDS)) * channels * sample_width
+        self.full_scale = float(2 ** (sample_width * 8 - 1))
+        self.pending = b''
+        self.blocks = 0
+        self.mean_squares = 0.0
+        self.peak = 0.0
+        self.silent_run = 0
+        self.longest_silence = 0
+        self.clipped = 0
+
+    # Meter audio data, only complete blocks are metered and the rest is kept for the next call
+    # All blocks are computed at once, so the cost per call hardly depends on the number of blocks
+    # Returns the RMS and peak levels of the new blocks in dBFS as two arrays
+    def feed(self, data):
+        data = self.pending + data if self.pending else data
+        count = len(data) // self.block_size
+        self.pending = data[count * self.block_size:]
+        if not count:
+            return np.empty(0), np.empty(0)
+        samples = np.frombuffer(data, self.dtype, count * self.block_size // self.dtype.itemsize).reshape(count, -1)
+        # The peaks are taken from the integers, the squares are summed in float32 which is precise enough for a meter
+        peaks = np.maximum(samples.max(axis=1).astype(np.int64), -samples.min(axis=1).astype(np.int64)) / self.full_scale
+        scaled = samples.astype(np.float32)
+        mean_squares = np.einsum('ij,ij->i', scaled, scaled).astype(np.float64) / samples.shape[1] / self.full_scale ** 2
+        rms_db = to_db(np.sqrt(mean_squares))
+        peak_db = to_db(peaks)
+
+        self.blocks += count
+        self.mean_squares += float(mean_squares.sum())
+        self.peak = max(self.peak, float(peaks.max()))
+        self.clipped += int(np.count_nonzero(peak_db >= CLIPPING_LEVEL))
+        for silent in rms_db < SILENCE_LEVEL:
+            self.silent_run = self.silent_run + 1 if silent else 0
+            self.longest_silence = max(self.longest_silence, self.silent_run)
+        return rms_db, peak_db
+
+    # Call quality of everything metered so far
+    # quality is 'ok' or the comma separated flags 'silence' and 'clipping'
+    def quality(self):
+        block_ms = BLOCK_SECONDS * 1000
+        flags = []
+        if self.longest_silence * BLOCK_SECONDS >= SILENCE_SECONDS:
+            flags.append('silence')
+        if self.clipped * BLOCK_SECONDS >= CLIPPING_SECONDS:
+            flags.append('clipping')
+        return {
+            'rmsDb': round(float(to_db(np.sqrt(self.mean_squares / self.blocks))), 1) if self.blocks else LEVEL_FLOOR,
+            'peakDb': round(float(to_db(self.peak)), 1),
+            'silenceMs': int(self.longest_silence * block_ms),
+            'clippingMs': int(self.clipped * block_ms),
+            'quality': ','.join(flags) or 'ok'
+        }
+
+# Follows a wav file that arecord is writing and meters the audio appended since the last poll
+class RecordingMeter:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file = None
+        self.header = b''
+        self.meter = None
+
+    # Read and meter the audio written since the last poll
+    # Returns the RMS and peak levels of the new blocks, None until the header was written
+    def poll(self):
+        if self.file is None:
+            try:
+                self.file = open(self.file_path, 'rb')
+            except FileNotFoundError:
+                return None
+        data = self.file.read()
+        if self.meter is None:
+            self.header += data
+            fmt = parse_wav_header(self.header)
+            if fmt is None:
+                return None
+            sample_rate, channels, sample_width, data_offset = fmt
+            self.meter = LevelMeter(sample_rate, channels, sample_width)
+            data = self.header[data_offset:]
+            self.header = b''
+        return self.meter.feed(data)
+
+    # Call quality of the recording, None if no audio was metered
+    def quality(self):
+        return self.meter.quality() if self.meter and self.meter.blocks else None
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+# Health of the capture pipeline
+# arecord reports overruns on stderr ("overrun!!! (at least 12.345 ms long)"): the buffer was full and audio was
+# dropped. With -v it also dumps the setup of the device, including the period and buffer size it got. The recorder
+# reads stderr in a thread, checks that arecord is still running after the start and compares the recorded audio
+# with the time the call lasted once it is stopped.
+
+# Format of the recordings, as required by the server
+RATE = 96000
+CHANNELS = 2
+SAMPLE_FORMAT = 'S32_LE'
+
+# Seconds after the start of arecord it has to be still running, e.g. it exits at once if the device is busy
+STARTUP_CHECK = 1.0
+
+# Recorded audio this many milliseconds shorter than the call flags the recording as truncated
+# Opening the device takes part of the call, so a small difference is expected
+TRUNCATED_MS = 1000
+
+# Number of other stderr lines kept to report why arecord failed
+KEEP_LINES = 5
+
+XRUN = re.compile(r'(overrun|underrun)!!!(?: \(at least ([\d.]+) ms long\))?')
+HW_PARAM = re.compile(r'^\s*(period_size|buffer_size)\s*:\s*(\d+)')
+# Lines of the start message and the setup dump, the other lines are errors
+INFO = re.compile(r'^(\s|Recording |Plug PCM|Hardware PCM|Its setup is|Slave:)')
+
+# Follows the messages arecord writes to stderr
+# Without a stream nothing is reported, e.g. if arecord could not be started
+class CaptureMonitor:
+    def __init__(self, stream=None):
+        self.xruns = 0
+        self.xrun_ms = 0.0
+        self.sizes = {}
+        self.lines = deque(maxlen=KEEP_LINES)
+        self.thread = None
+        if stream is not None:
+            self.thread = threading.Thread(target=self.read, args=(stream,), daemon=True)
+            self.thread.start()
+
+    def read(self, stream):
+        for line in stream:
+            self.parse(line)
+        stream.close()
+
+    def parse(self, line):
+        xrun = XRUN.search(line)
+        if xrun:
+            self.xruns += 1
+            self.xrun_ms += float(xrun.group(2) or 0)
+            return
+        param = HW_PARAM.match(line)
+        if param:
+            # A plug device dumps its own setup first and then the one of the hardware below it, the first one counts
+            self.sizes.setdefault(param.group(1), int(param.group(2)))
+        elif line.strip() and not INFO.match(line):
+            self.lines.append(line.strip())
+
+    def join(self, timeout=None):
+        if self.thread:
+            self.thread.join(timeout)
+
+# Runs arecord for one recording
+# period_time and buffer_time are in microseconds, None keeps the defaults of ALSA
+class Recorder:
+    def __init__(self, file_path, period_time=None, buffer_time=None, device='plughw:0'):
+        self.file_path = file_path
+        self.command = ['arecord', '-D', device, '-c', str(CHANNELS), '-r', str(RATE), '-f', SAMPLE_FORMAT, '-t', 'wav', '-v']
+        if period_time:
+            self.command += ['-F', str(period_time)]
+        if buffer_time:
+            self.command += ['-B', str(buffer_time)]
+        self.command.append(file_path)
+        self.process = None
+        self.monitor = None
+        self.started = None
+        self.start_error = None
+        self.stopped = None
+        self.stop_failure = None
+
+    def start(self):
+        self.started = time.monotonic()
+        try:
+            self.process = subprocess.Popen(self.command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors='replace')
+        except OSError as e:
+            # arecord is not installed, there is nothing to stop
+            self.start_error = {'exitCode': None, 'error': str(e)}
+            self.monitor = CaptureMonitor()
+            return
+        self.monitor = CaptureMonitor(self.process.stderr)
+
+    # Why arecord is not running anymore, None while it is running
+    def failure(self):
+        if self.start_error:
+            return self.start_error
+        code = self.process.poll()
+        if code is None:
+            return None
+        self.monitor.join(1)
+        return {'exitCode': code, 'error': ' '.join(self.monitor.lines) or None}
+
+    # Ask arecord to stop without waiting for it, the recording ends now even if stop is called later
+    def terminate(self):
+        if self.stopped is not None:
+            return
+        self.stopped = time.monotonic()
+        # Taken before the signal, arecord exiting because of it is not a failure
+        self.stop_failure = self.failure()
+        if self.stop_failure is None:
+            self.process.terminate()
+
+    # Stop arecord and let it finalize the file, this blocks for up to a few seconds
+    # Returns the capture report, see capture_report, and the failure if arecord had stopped on its own before
+    def stop(self):
+        self.terminate()
+        if self.stop_failure is None:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.monitor.join(1)
+        return capture_report(self.file_path, self.stopped - self.started, self.monitor), self.stop_failure
+
+# Frames of audio in a finished wav file, 0 if it has no complete header
+def recorded_frames(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(4096)
+        fmt = parse_wav_header(header)
+    except (OSError, ValueError):
+        return 0
+    if fmt is None:
+        return 0
+    sample_rate, channels, sample_width, data_offset = fmt
+    return max(0, os.path.getsize(file_path) - data_offset) // (channels * sample_width)
+
+# Capture quality of a recording, sent with the upload next to the level quality
+# droppedFrames is counted from the overruns arecord reported, durationMismatchMs is the time of the call that is
+# missing from the file, it also covers audio lost without an overrun message, e.g. a recorder that stopped early.
+# The flags are 'xrun' and 'truncated', periodFrames and bufferFrames are the sizes the device was set up with.
+def capture_report(file_path, elapsed, monitor):
+    frames = recorded_frames(file_path)
+    mismatch_ms = int(round(elapsed * 1000 - frames * 1000 / RATE))
+    flags = []
+    if monitor.xruns:
+        flags.append('xrun')
+    if mismatch_ms > TRUNCATED_MS:
+        flags.append('truncated')
+    return {
+        'xruns': monitor.xruns,
+        'droppedFrames': int(round(monitor.xrun_ms * RATE / 1000)),
+        'durationMismatchMs': mismatch_ms,
+        'periodFrames': monitor.sizes.get('period_size'),
+        'bufferFrames': monitor.sizes.get('buffer_size'),
+        'flags': flags
+    }
+
+# Add the capture report to the quality of the level meter, the flags of both are combined
+def merge_quality(quality, capture):
+    flags = capture.pop('flags')
+    if quality and quality['quality'] != 'ok':
+        flags = quality['quality'].split(',') + flags
+    return dict(quality or {}, **capture, quality=','.join(flags) or 'ok')
@@ -0,0 +1,74 @@
+import collections
+import json
+import threading
+import time
+
+# Stages of a call, in the order they happen
+# Every stage is measured as the time since the hook edge that started the chain
+STAGES = [
+    'debounced',
+    'transition_fired',
+    'recorder_started',
+    'playback_started',
+    'recorder_stopped',
+    'upload_acknowledged'
+]
+
+# Percentiles that are reported for every stage
+PERCENTILES = [50, 90, 99]
+
+# Compute a percentile from a sorted list of samples using the nearest rank
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return None
+    rank = max(0, min(len(sorted_samples) - 1, int(round(p / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[rank]
+
+# A single chain of events, started by a hook edge
+# kind is either 'pickUp' or 'hangUp'
+class CallTimeline:
+    def __init__(self, tracker, kind, edge_detected=None):
+        self.tracker = tracker
+        self.kind = kind
+        self.edge_detected = edge_detected if edge_detected is not None else time.monotonic()
+
+    # Mark a stage as reached now
+    def mark(self, stage):
+        self.tracker.add_sample(self.kind, stage, time.monotonic() - self.edge_detected)
+
+# Keeps the latest samples of every stage in ring buffers
+# Samples are added from the GPIO callback thread, the event loop and the upload threads
+class LatencyTracker:
+    def __init__(self, size=256):
+        self.size = size
+        self.lock = threading.Lock()
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=self.size))
+
+    # Start a new chain of events at the given monotonic timestamp
+    def begin(self, kind, edge_detected=None):
+        return CallTimeline(self, kind, edge_detected)
+
+    def add_sample(self, kind, stage, seconds):
+        with self.lock:
+            self.samples[f"{kind}.{stage}"].append(seconds)
+
+    # Summarize all stages with count, percentiles and maximum in milliseconds
+    def summary(self):
+        with self.lock:
+            samples = {key: sorted(values) for key, values in self.samples.items()}
+        summary = {}
+        for key, values in samples.items():
+            entry = {'count': len(values)}
+            for p in PERCENTILES:
+                entry[f"p{p}"] = round(percentile(values, p) * 1000, 1)
+            entry['max'] = round(values[-1] * 1000, 1)
+            summary[key] = entry
+        return summary
+
+    # Write all raw samples and the summary to a JSON file for offline analysis
+    def dump(self, file_path):
+        with self.lock:
+            samples = {key: [round(v * 1000, 3) for v in values] for key, values in self.samples.items()}
+        with open(file_path, 'w') as f:
+            json.dump({'dumpedAt': int(time.time()), 'summary': self.summary(), 'samplesMs': samples}, f, indent=2)
+        return file_path
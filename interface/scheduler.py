@@ -0,0 +1,108 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+# Config fields that change the plan of the auto ring scheduler
+SCHEDULE_FIELDS = ('autoRing', 'autoRingMinSpan', 'autoRingMaxSpan', 'autoRingQuietStart', 'autoRingQuietEnd')
+
+# Clock of the scheduler on the real device
+# Timers run on the asyncio event loop, the wall time is only used for the quiet hours
+class LoopClock:
+    def __init__(self, loop):
+        self.loop = loop
+
+    # Current time in seconds since the epoch
+    def now(self):
+        return time.time()
+
+    # Call callback after delay seconds, returns a handle that can be cancelled
+    def call_later(self, delay, callback):
+        return self.loop.call_later(delay, callback)
+
+# Parse a "HH:MM" time of day into minutes since midnight, None if it is not set
+def parse_time_of_day(value):
+    if not value:
+        return None
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+# End of the quiet hours if the timestamp lies within them, otherwise None
+# The quiet hours are given as "HH:MM" in local time and can span midnight, e.g. 22:00 to 08:00
+def quiet_until(timestamp, quiet_start, quiet_end):
+    start = parse_time_of_day(quiet_start)
+    end = parse_time_of_day(quiet_end)
+    if start is None or end is None or start == end:
+        return None
+    moment = datetime.fromtimestamp(timestamp)
+    minute = moment.hour * 60 + moment.minute + moment.second / 60
+    if start < end:
+        quiet = start <= minute < end
+    else:
+        quiet = minute >= start or minute < end
+    if not quiet:
+        return None
+    until = moment.replace(hour=end // 60, minute=end % 60, second=0, microsecond=0)
+    if until <= moment:
+        until += timedelta(days=1)
+    return until.timestamp()
+
+# Plans the automated rings
+# Exactly one timer is pending while auto ring is enabled. A config change cancels it and plans the
+# next ring right away, so disabling auto ring or changing the span takes effect immediately.
+# A ring that would fall into the quiet hours is moved to their end.
+# ring is called when the timer expires, on_schedule with the planned time (None if nothing is planned)
+# and whether the ring was moved out of the quiet hours. Both are called on the thread of the clock.
+class AutoRingScheduler:
+    def __init__(self, clock, ring, on_schedule=None, rng=None):
+        self.clock = clock
+        self.ring = ring
+        self.on_schedule = on_schedule
+        self.random = rng or random.Random()
+        self.config = {}
+        self.handle = None
+        self.next_ring = None
+        self.quiet = False
+
+    # Apply a new config
+    # The plan is only redone if a field that affects it changed, otherwise the current plan is reported again
+    def configure(self, config):
+        changed = any(config.get(key) != self.config.get(key) for key in SCHEDULE_FIELDS)
+        self.config = dict(config)
+        if changed or (self.config.get('autoRing') and self.handle is None):
+            self.reschedule()
+        else:
+            self.publish()
+
+    # Cancel the pending ring and plan the next one
+    def reschedule(self):
+        self.cancel()
+        if self.config.get('autoRing'):
+            minimum = self.config['autoRingMinSpan'] * 60
+            maximum = max(minimum, self.config['autoRingMaxSpan'] * 60)
+            ring_at = self.clock.now() + self.random.randint(minimum, maximum)
+            until = quiet_until(ring_at, self.config.get('autoRingQuietStart'), self.config.get('autoRingQuietEnd'))
+            self.quiet = until is not None
+            if self.quiet:
+                ring_at = until
+            self.next_ring = ring_at
+            self.handle = self.clock.call_later(ring_at - self.clock.now(), self.fire)
+        self.publish()
+
+    # Cancel the pending ring without planning a new one
+    def cancel(self):
+        if self.handle:
+            self.handle.cancel()
+        self.handle = None
+        self.next_ring = None
+        self.quiet = False
+
+    # Timer callback, rings and plans the next ring
+    def fire(self):
+        self.handle = None
+        self.ring()
+        self.reschedule()
+
+    # Report the current plan
+    def publish(self):
+        if self.on_schedule:
+            self.on_schedule(self.next_ring, self.quiet)
@@ -0,0 +1,57 @@
+import os
+import threading
+
+# In lazy mode flasgger (and jsonschema with it) is only imported, and the OpenAPI spec only built,
+# on the first request to the API explorer. Set WEDDINGRING_LAZY_DOCS=0 to set it up at startup instead.
+LAZY_DOCS = os.environ.get('WEDDINGRING_LAZY_DOCS', '1') == '1'
+
+# Paths served by flasgger
+DOCS_PREFIXES = ('/apidocs', '/apispec', '/flasgger_static')
+
+# Attach an OpenAPI spec to a view function
+# This is what flasgger's swag_from does for dictionaries, without importing flasgger
+def swag_from(specs):
+    def decorator(function):
+        function.specs_dict = specs
+        return function
+    return decorator
+
+# Build a separate app holding flasgger
+# It gets the same routes and view functions as the main app so flasgger can collect their specs
+def build_docs_app(app):
+    from flask import Flask
+    from flasgger import Swagger
+    docs = Flask(app.import_name)
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        docs.add_url_rule(rule.rule, rule.endpoint, app.view_functions[rule.endpoint], methods=rule.methods)
+    Swagger(docs)
+    return docs
+
+# WSGI middleware that dispatches the API explorer paths to the docs app, which is built on first use
+class LazyDocs:
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.docs_app = None
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith(DOCS_PREFIXES):
+            return self.get_docs_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    def get_docs_app(self):
+        with self.lock:
+            if self.docs_app is None:
+                self.docs_app = build_docs_app(self.app)
+        return self.docs_app
+
+# Set up the API explorer, either lazily or right away
+def init_docs(app):
+    if LAZY_DOCS:
+        app.wsgi_app = LazyDocs(app)
+    else:
+        from flasgger import Swagger
+        Swagger(app)
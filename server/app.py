@@ -1,66 +1,124 @@
-from flask import Flask
-from flasgger import Swagger
+from flask import Flask, request
 from database import init_db, close_connection
 from endpoints.records import records_bp
 from endpoints.config import config_bp
-from endpoints.messages import messages_bp
+from endpoints.messages import messages_bp, UPLOAD_FOLDER as MESSAGES_FOLDER
+from endpoints.maintenance import maintenance_bp
+from endpoints.metrics import metrics_bp
+from endpoints.export import export_bp
+from endpoints.stats import stats_bp
+from endpoints.static_files import static_files_bp
+from endpoints.devices import devices_bp
+from endpoints.replication import replication_bp
+from endpoints.scheduler import scheduler_bp
+from reconcile import reconcile
+from replication import start_replication
+from scheduler import scheduler, LOW
+from message_cache import message_cache
+from apidocs import init_docs
 from flask_sock import Sock
-from websocket_utils import connections
+from websocket_utils import connections, route, DEVICE_ID
+import devices
+from metrics import register_request_hooks, WEBSOCKET_CONNECTIONS
 import RPi.GPIO as GPIO
-import threading
-from time import sleep
+import os
 
 # Create the Flask app
-app = Flask(__name__)
+# The static files are served by static_files_bp, which prefers the fingerprinted build
+app = Flask(__name__, static_folder=None)
 sock = Sock(app)
 # Register the teardown function
 app.teardown_appcontext(close_connection)
+# Register the request hooks that feed /metrics
+register_request_hooks(app)
 
 # Register the blueprints
 app.register_blueprint(records_bp)
 app.register_blueprint(config_bp)
 app.register_blueprint(messages_bp)
+app.register_blueprint(maintenance_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(export_bp)
+app.register_blueprint(stats_bp)
+app.register_blueprint(static_files_bp)
+app.register_blueprint(devices_bp)
+app.register_blueprint(replication_bp)
+app.register_blueprint(scheduler_bp)
 
-# Initialize the Swagger extension
-swagger = Swagger(app)
+# Initialize the Swagger extension, by default the spec is only built on the first /apidocs request
+init_docs(app)
 
 # WebSocket route
+# Phone interfaces connect with ?device=<id>, browsers without it, see route in websocket_utils.py
 @sock.route('/socket')
 def socket(ws):
+    device_id = request.args.get('device')
+    if device_id is not None and not DEVICE_ID.match(device_id):
+        ws.close(1008, 'Invalid device id')
+        return
     # Add the new connection to the list
     connections.append(ws)
+    WEBSOCKET_CONNECTIONS.inc()
+    if device_id is not None:
+        devices.connect(device_id, ws)
     try:
         while True:
             data = ws.receive()
             if data is None:
                 break
-            # Broadcast the message to all connected clients
-            for conn in connections:
-                if conn != ws:
-                    conn.send(data)
+            # Let the server keep track of statuses, then pass the message on to the other clients
+            route(data, ws, device_id)
     finally:
         # Remove the connection when done
         connections.remove(ws)
+        WEBSOCKET_CONNECTIONS.dec()
+        if device_id is not None:
+            devices.disconnect(device_id, ws)
 
-# Heartbeat function running in a separate thread
-# The heartbeat should toggle the Raspberry pi GPIO pin 24
-# It is on 0.8 seconds and off 0.2 seconds
-def heartbeat():
-    while True:
-        GPIO.output(24, GPIO.HIGH)
-        sleep(0.8)
-        GPIO.output(24, GPIO.LOW)
-        sleep(0.2)
+# Heartbeat LED on the Raspberry pi GPIO pin 24
+# It is on 0.8 seconds and off 0.2 seconds, driven by PWM so no Python thread has to wake up for it
+HEARTBEAT_PIN = 24
+HEARTBEAT_FREQUENCY = 1
+HEARTBEAT_DUTY_CYCLE = 80
 
-if __name__ == '__main__':
+# The PWM object has to be kept, the LED stops blinking once it is garbage collected
+heartbeat = None
+
+# Initialize the database and bring it in sync with the audio folders
+# This runs once per start, before any request is served
+def startup():
     with app.app_context():
         init_db()
-    # Set up the GPIO pin
+        # Bring the database and the audio folders back in sync
+        print("Reconciled audio folders:", reconcile())
+
+# Start the threads doing background work: the scheduler of the jobs and the replication from a primary
+# They run in the process serving the requests, in production the gunicorn worker
+# The messages are read into the memory of that process as the first job, see message_cache.py
+def start_background_work():
+    scheduler.start(app)
+    scheduler.submit('messageCache', lambda: message_cache.warm(MESSAGES_FOLDER), LOW)
+    start_replication(app)
+
+# Set up the GPIO pin and start the heartbeat
+# In production this is called from the gunicorn master only, so exactly one process drives the pin
+def start_heartbeat():
+    global heartbeat
     GPIO.setmode(GPIO.BCM)
-    GPIO.setup(24, GPIO.OUT)
+    GPIO.setup(HEARTBEAT_PIN, GPIO.OUT)
     GPIO.setwarnings(False)
-    # Start the heartbeat thread
-    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
-    heartbeat_thread.start()
+    heartbeat = GPIO.PWM(HEARTBEAT_PIN, HEARTBEAT_FREQUENCY)
+    heartbeat.start(HEARTBEAT_DUTY_CYCLE)
+
+# Development entry point using the Werkzeug server, production uses gunicorn (see gunicorn.conf.py)
+if __name__ == '__main__':
+    startup()
+    start_heartbeat()
     # Run the Flask app
-    app.run(debug=True, port=8080, host='0.0.0.0')
+    # Port and debug mode can be overridden, e.g. to run several instances side by side
+    port = int(os.environ.get('WEDDINGRING_PORT', 8080))
+    debug = os.environ.get('WEDDINGRING_DEBUG', '1') == '1'
+    # With the reloader the app runs in a child process, only that one does background work
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_work()
+    app.run(debug=debug, port=port, host='0.0.0.0')
@@ -1,21 +1,75 @@
-from pydub import AudioSegment
+import os
+import json
+import mmap
+import struct
 
 # Allowed audio file extensions
 ALLOWED_EXTENSIONS = {'wav'}
 
+# Size of the pieces a slice is streamed in
+SLICE_CHUNK_SIZE = 256 * 1024
+
+# Raised when a slice can not be cut from a file, e.g. because it starts behind the end of the audio
+class SliceError(Exception):
+    pass
+
+# Call quality measured by the level meter of the interface and the capture report of its recorder, stored as columns of the record
+# Maps the fields of the quality JSON to their type
+QUALITY_FIELDS = {'rmsDb': float, 'peakDb': float, 'silenceMs': int, 'clippingMs': int, 'quality': str,
+                  'xruns': int, 'droppedFrames': int, 'durationMismatchMs': int, 'periodFrames': int, 'bufferFrames': int}
+
+# Flags the quality may consist of, see interface/capture.py
+QUALITY_FLAGS = {'ok', 'silence', 'clipping', 'xrun', 'truncated'}
+
+# Parse the quality JSON sent along with an upload
+# Unknown fields are ignored, so an interface that measures more can talk to an older server
+# Returns the columns to store or raises ValueError
+def parse_quality(value):
+    if not value:
+        return {}
+    try:
+        data = json.loads(value)
+    except json.JSONDecodeError:
+        raise ValueError('quality is not valid JSON')
+    if not isinstance(data, dict):
+        raise ValueError('quality must be an object')
+    columns = {}
+    for field, field_type in QUALITY_FIELDS.items():
+        if data.get(field) is None:
+            continue
+        field_value = data[field]
+        if field_type is str:
+            if not isinstance(field_value, str) or not set(field_value.split(',')) <= QUALITY_FLAGS:
+                raise ValueError(f"quality must be a comma separated list of {', '.join(sorted(QUALITY_FLAGS))}")
+        elif isinstance(field_value, bool) or not isinstance(field_value, (int, float)):
+            raise ValueError(f"{field} must be a number")
+        columns[field] = field_type(field_value)
+    return columns
+
 # Check if the file is a valid audio file
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # Get the length of the audio file
+# The length is taken from the wav header, pydub is only used for files the header parser does not understand
 def get_audio_length(file_path):
+    header = read_wav_header(file_path)
+    if header is not None:
+        return header['length']
+    # pydub is imported here instead of at module level to keep the server startup fast
+    from pydub import AudioSegment
     audio = AudioSegment.from_wav(file_path)
     return len(audio)
 
 # Validate the audio file
 # The audio file must be 32-bit and 96KHz stereo audio
+# The wav header is checked first, pydub is only used for files the header parser does not understand
 def validate_audio(file_path):
+    header = read_wav_header(file_path)
+    if header is not None:
+        return header_meets_requirements(header)
+    from pydub import AudioSegment
     audio = AudioSegment.from_wav(file_path)
     if audio.sample_width != 4:
         return False  # Not 32-bit
@@ -23,4 +77,141 @@ def validate_audio(file_path):
         return False  # Not 96KHz
     if audio.channels != 2:
         return False
-    return True
\ No newline at end of file
+    return True
+
+# Format of a wav file as stored in the columns of its row, see the audio metadata migration
+# The fmt chunk is stored as it is, so slices and reels keep the exact format without reading the file
+AUDIO_COLUMNS = ('sizeBytes', 'sampleRate', 'channels', 'bitDepth', 'blockAlign', 'dataOffset', 'dataSize', 'fmtChunk')
+
+# Read the header of a wav file without loading the audio data
+# The RIFF chunks are walked until the data chunk is found, the samples are never read
+# Returns a dictionary with the format, the content of the fmt chunk, the offset and size of the data chunk,
+# the size of the file and the length in ms
+# Returns None if the file is not a PCM wav file
+def read_wav_header(file_path):
+    with open(file_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            return None
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'fmt ':
+                fmt_data = f.read(chunk_size)
+                if len(fmt_data) < 16:
+                    return None
+                fmt = struct.unpack('<HHIIHH', fmt_data[:16])
+                # Chunks are padded to an even size
+                if chunk_size % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    return None
+                format_tag, channels, sample_rate, _, block_align, bit_depth = fmt
+                # 1 is integer PCM, 3 is float PCM and 0xFFFE is WAVE_FORMAT_EXTENSIBLE as written for 32-bit audio
+                if format_tag not in (1, 3, 0xFFFE) or block_align == 0 or sample_rate == 0:
+                    return None
+                data_offset = f.tell()
+                available = file_size - data_offset
+                # arecord can leave the size unset when it is interrupted, fall back to the file size
+                if chunk_size == 0 or chunk_size > available:
+                    chunk_size = available
+                chunk_size -= chunk_size % block_align
+                frames = chunk_size // block_align
+                return {
+                    'sampleRate': sample_rate,
+                    'channels': channels,
+                    'bitDepth': bit_depth,
+                    'blockAlign': block_align,
+                    'fmtChunk': fmt_data,
+                    'dataOffset': data_offset,
+                    'dataSize': chunk_size,
+                    'sizeBytes': file_size,
+                    'length': round(frames * 1000 / sample_rate)
+                }
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+# Check a parsed wav header against the requirements of validate_audio
+def header_meets_requirements(header):
+    return header is not None and \
+           header['bitDepth'] == 32 and \
+           header['sampleRate'] == 96000 and \
+           header['channels'] == 2
+
+# Columns of a row describing the format of its file, header is the result of read_wav_header
+# Empty for files the header parser does not understand, their columns stay NULL
+def audio_metadata(header):
+    return {column: header[column] for column in AUDIO_COLUMNS} if header else {}
+
+# Row of a record or message as returned by the API
+# The fmt chunk is only stored to build headers, it is binary and not part of the API
+def public_row(row):
+    data = dict(row)
+    data.pop('fmtChunk', None)
+    return data
+
+# Header of the file of a row, taken from its columns
+# Rows stored before the metadata existed, or whose file could not be parsed, fall back to reading the header
+# Returns None if the file is not a PCM wav file
+def stored_header(row, file_path):
+    if row['sampleRate'] is not None:
+        header = {column: row[column] for column in AUDIO_COLUMNS}
+        header['length'] = round(header['dataSize'] // header['blockAlign'] * 1000 / header['sampleRate'])
+        return header
+    return read_wav_header(file_path)
+
+# Build the header of a wav file with a single data chunk of data_size bytes
+# fmt_chunk is the content of the fmt chunk of the source file, so the format is kept exactly,
+# including the extensible format arecord writes for 32-bit audio
+def build_wav_header(fmt_chunk, data_size):
+    fmt_padding = b'\0' * (len(fmt_chunk) % 2)
+    riff_size = 4 + 8 + len(fmt_chunk) + len(fmt_padding) + 8 + data_size + data_size % 2
+    return b'RIFF' + struct.pack('<I', riff_size) + b'WAVE' + \
+        b'fmt ' + struct.pack('<I', len(fmt_chunk)) + fmt_chunk + fmt_padding + \
+        b'data' + struct.pack('<I', data_size)
+
+# Locate a span of a wav file given in milliseconds
+# The times are rounded down to whole frames and the end is clamped to the length of the audio.
+# header is the header of the file (see stored_header), the position of the span is computed from it.
+# Returns the header for a wav file holding only the span, and the offset and size of the span in the file
+def wav_slice(header, start_ms, end_ms):
+    if header is None:
+        raise SliceError('The file is not a PCM wav file')
+    frames = header['dataSize'] // header['blockAlign']
+    start = min(frames, start_ms * header['sampleRate'] // 1000)
+    end = min(frames, end_ms * header['sampleRate'] // 1000)
+    if start >= end:
+        raise SliceError(f"The slice is outside of the audio, which is {header['length']} ms long")
+    size = (end - start) * header['blockAlign']
+    return build_wav_header(header['fmtChunk'], size), header['dataOffset'] + start * header['blockAlign'], size
+
+# Stream a span of a file from a memory map
+# Only the span is mapped, starting at the allocation granularity below the offset, so the
+# work does not depend on the size of the file. The map is opened right away, so a missing file
+# fails before the response starts, and closed once the last piece was sent.
+def stream_span(file_path, offset, size, chunk_size=SLICE_CHUNK_SIZE):
+    aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+    with open(file_path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), offset - aligned + size, offset=aligned, access=mmap.ACCESS_READ)
+    if hasattr(mapped, 'madvise'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+    def pieces():
+        try:
+            position = offset - aligned
+            end = position + size
+            while position < end:
+                yield mapped[position:min(end, position + chunk_size)]
+                position += chunk_size
+            # The data chunk is padded to an even size
+            if size % 2:
+                yield b'\0'
+        finally:
+            mapped.close()
+
+    return pieces()
@@ -0,0 +1,164 @@
+import os
+import json
+import uuid
+import shutil
+import zipfile
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from werkzeug.utils import secure_filename
+from audio_utils import allowed_file, get_audio_length, validate_audio
+from blob_store import receive, commit_uploads, upload_result, SizeLimitError, BLOB_FOLDER
+from websocket_utils import broadcast
+from scheduler import call_active, record_decision
+
+# Number of files validated in parallel
+# Validation mostly reads wav headers, so threads are enough and keep the memory use low on the Pi
+BATCH_WORKERS = min(4, os.cpu_count() or 1)
+
+# Maximum number of audio files in one batch, including the files inside zip archives
+MAX_BATCH_FILES = 500
+
+# Maximum size of one audio file in bytes, a call of more than 20 minutes at 32-bit/96kHz stereo
+MAX_FILE_BYTES = int(os.environ.get('WEDDINGRING_MAX_FILE_BYTES', 1024 ** 3))
+
+# Maximum bytes one batch may store, after unpacking its zip archives
+MAX_BATCH_BYTES = int(os.environ.get('WEDDINGRING_MAX_BATCH_BYTES', 4 * 1024 ** 3))
+
+# Bytes a batch always leaves free on the disk, the recordings of the guests have to fit on it
+FREE_SPACE_RESERVE = 512 * 1024 ** 2
+
+# Raised when a batch cannot be processed at all
+class BatchError(Exception):
+    pass
+
+# Bytes a batch may store, MAX_BATCH_BYTES or less if the disk is fuller
+def batch_limit():
+    os.makedirs(BLOB_FOLDER, exist_ok=True)
+    return max(0, min(MAX_BATCH_BYTES, shutil.disk_usage(BLOB_FOLDER).free - FREE_SPACE_RESERVE))
+
+# Receive the uploaded files into the blob folder
+# Zip archives are unpacked, only the .wav files inside them are used
+# Returns one entry per audio file with the original name, the temporary path, the checksum and the size
+# Files that are not allowed or larger than MAX_FILE_BYTES are returned with an error and are not saved.
+# A zip entry is checked by its declared size before it is unpacked and never unpacked beyond it, so a zip bomb
+# can not fill the disk. A batch larger than batch_limit is rejected as a whole.
+def save_uploads(uploads):
+    entries = []
+    limit = batch_limit()
+    remaining = limit
+
+    # open_source returns a context manager with the stream, declared is the size a zip archive states for the entry
+    def add(name, open_source, declared=None):
+        nonlocal remaining
+        if len(entries) >= MAX_BATCH_FILES:
+            raise BatchError(f'Too many files, at most {MAX_BATCH_FILES} are allowed per batch')
+        entry = {'file': name}
+        if not allowed_file(name):
+            entry['error'] = 'File type not allowed'
+        elif declared is not None and declared > MAX_FILE_BYTES:
+            entry['error'] = f'File too large, at most {MAX_FILE_BYTES} bytes are allowed'
+        elif declared is not None and declared > remaining:
+            raise BatchError(f'Batch too large, at most {limit} bytes can be stored')
+        else:
+            allowed = declared if declared is not None else min(MAX_FILE_BYTES, remaining)
+            try:
+                with open_source() as source:
+                    entry['tmp'], entry['checksum'], entry['size'] = receive(source, allowed)
+            except SizeLimitError:
+                if declared is not None:
+                    entry['error'] = 'File is larger than declared in the zip archive'
+                elif allowed == MAX_FILE_BYTES:
+                    entry['error'] = f'File too large, at most {MAX_FILE_BYTES} bytes are allowed'
+                else:
+                    raise BatchError(f'Batch too large, at most {limit} bytes can be stored')
+            else:
+                remaining -= entry['size']
+        entries.append(entry)
+
+    try:
+        for upload in uploads:
+            name = secure_filename(upload.filename or '')
+            if name.lower().endswith('.zip'):
+                try:
+                    archive = zipfile.ZipFile(upload.stream)
+                except zipfile.BadZipFile:
+                    entries.append({'file': name, 'error': 'Invalid zip file'})
+                    continue
+                with archive:
+                    for info in archive.infolist():
+                        # Skip folders and the resource forks macOS adds to archives
+                        if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                            continue
+                        add(f"{name}/{secure_filename(os.path.basename(info.filename))}", lambda: archive.open(info), info.file_size)
+            else:
+                add(name, lambda: nullcontext(upload.stream))
+    except Exception:
+        remove_files(entries)
+        raise
+    return entries
+
+# Validate a saved file and read its length
+def validate_entry(entry):
+    try:
+        if not validate_audio(entry['tmp']):
+            entry['error'] = 'Audio file does not meet requirements (32-bit, 96KHz)'
+        else:
+            entry['length'] = get_audio_length(entry['tmp'])
+    except Exception:
+        entry['error'] = 'Invalid audio file'
+    return entry
+
+# Remove the received files of the given entries
+def remove_files(entries):
+    for entry in entries:
+        path = entry.pop('tmp', None)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+# Send the progress of a batch to all websocket clients
+def send_progress(batch_id, table, done, total, entry):
+    broadcast('STATUS:UPLOAD:' + json.dumps({
+        'batchId': batch_id,
+        'table': table,
+        'done': done,
+        'total': total,
+        'file': entry['file'],
+        'ok': 'error' not in entry
+    }))
+
+# Import a batch of uploaded files into a table
+# The files are received, validated in a thread pool and all valid ones are added in a single transaction.
+# Content that is already stored in the table is reported as duplicate and not stored again.
+# The progress is sent over the websocket after every validated file.
+# Returns the batch id and one result per file, either with the row or with an error
+def import_batch(uploads, table, folder):
+    batch_id = str(uuid.uuid4())
+    entries = save_uploads(uploads)
+    pending = [entry for entry in entries if 'tmp' in entry]
+    done = len(entries) - len(pending)
+
+    # During a call a single thread validates, so the batch does not compete with the recording, see scheduler.py
+    workers = BATCH_WORKERS
+    if call_active():
+        workers = 1
+        record_decision('batchImport', 'reduce')
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in as_completed([executor.submit(validate_entry, entry) for entry in pending]):
+            done += 1
+            send_progress(batch_id, table, done, len(entries), future.result())
+
+    remove_files([entry for entry in pending if 'error' in entry])
+    valid = [entry for entry in pending if 'error' not in entry]
+    try:
+        commit_uploads(valid, table, folder)
+    except Exception:
+        remove_files(valid)
+        raise
+
+    results = []
+    for entry in entries:
+        if 'error' in entry:
+            results.append({'file': entry['file'], 'error': entry['error']})
+        else:
+            results.append(dict(upload_result(entry), file=entry['file']))
+    return batch_id, results
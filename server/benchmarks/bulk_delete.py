@@ -0,0 +1,88 @@
+# Benchmark for deleting many records at once
+# Seeds a temporary database and folder with records and compares deleting them one by one,
+# as DELETE /records/<id> did before, with the transactional bulk delete of bulk.py.
+# The database time and the file removal time of the bulk delete are reported separately.
+# Usage (from the server directory):
+#   python3 benchmarks/bulk_delete.py --records 1000 --target 0.5
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, SERVER_DIR)
+
+from flask import Flask
+from database import init_db, get_db, query_db, execute_db
+from bulk import build_selection, delete_rows, unlink_files
+
+TABLE = 'records'
+FOLDER = 'recordings'
+
+# Create rows and small files for the given number of records
+def seed(count):
+    ids = [str(uuid.uuid4()) for _ in range(count)]
+    now = int(time.time())
+    db = get_db()
+    db.executemany(f'INSERT INTO {TABLE} (id, recordTimestamp, length) VALUES (?, ?, ?)', [(record_id, now, 1000) for record_id in ids])
+    db.commit()
+    for record_id in ids:
+        with open(os.path.join(FOLDER, f"{record_id}.wav"), 'wb') as f:
+            f.write(b'RIFF')
+    return ids
+
+# Delete every record with its own SELECT, DELETE and commit and then its file
+def delete_one_by_one(ids):
+    start = time.perf_counter()
+    for record_id in ids:
+        if query_db(f'SELECT * FROM {TABLE} WHERE id = ?', [record_id], one=True):
+            execute_db(f'DELETE FROM {TABLE} WHERE id = ?', [record_id])
+            os.remove(os.path.join(FOLDER, f"{record_id}.wav"))
+    return time.perf_counter() - start
+
+# Delete all records with the bulk delete, returns the database and the file removal time
+def delete_bulk(ids):
+    where, args = build_selection({'ids': ids})
+    start = time.perf_counter()
+    deleted, _ = delete_rows(TABLE, where, args)
+    db_time = time.perf_counter() - start
+    start = time.perf_counter()
+    unlink_files(TABLE, FOLDER, deleted)
+    assert len(deleted) == len(ids)
+    return db_time, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare deleting records one by one with the bulk delete')
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--target', type=float, default=0.5, help='Maximum database seconds of the bulk delete')
+    parser.add_argument('--dir', help='Directory the database and files are created in, defaults to a temporary one. '
+                                      'Use a directory on the SD card to measure the real storage.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='weddingring-bulk-', dir=args.dir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.makedirs(FOLDER)
+    app = Flask(__name__)
+    try:
+        with app.app_context():
+            init_db()
+            single = delete_one_by_one(seed(args.records))
+            db_time, unlink_time = delete_bulk(seed(args.records))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"One by one:  {single * 1000:>10.1f} ms for {args.records} records")
+    print(f"Bulk delete: {db_time * 1000:>10.1f} ms database, {unlink_time * 1000:.1f} ms file removal")
+    if db_time > args.target:
+        print(f"FAIL: bulk delete database time {db_time:.3f} s exceeds the target of {args.target} s")
+        sys.exit(1)
+    print(f"OK: bulk delete database time {db_time:.3f} s is within the target of {args.target} s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+# Background work during a call
+# Starts the production server, fills it with recordings and lets a fake phone go off-hook in the middle of an
+# export to a directory while the zip of all recordings is downloaded. The export has to pause until the resume
+# delay after the call has passed, the download has to slow down to the throttle rate and GET /config has to stay
+# as fast as without background work. Reports the latency of GET /config per phase and the scheduler metrics.
+# Usage (from the server directory):
+#   python3 benchmarks/call_shedding.py --records 30 --length 5 --call 5
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import simple_websocket
+from fixtures import build_wav
+from load_test import spawn_server, multipart, perform, percentile
+
+# Request GET /config until stopped and keep the latencies
+class Prober:
+    def __init__(self, url, interval):
+        self.url = url
+        self.interval = interval
+        self.latencies = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.perf_counter()
+            perform(urllib.request.Request(f'{self.url}/config'))
+            self.latencies.append(time.perf_counter() - started)
+            time.sleep(self.interval)
+
+    # Latencies since the last call, in milliseconds
+    def take(self):
+        latencies, self.latencies = sorted(self.latencies), []
+        return {
+            'requests': len(latencies),
+            'p50Ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99Ms': round(percentile(latencies, 99) * 1000, 2)
+        }
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+def get_json(url):
+    return perform(urllib.request.Request(url), parse=True)[2]
+
+def post_json(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'})
+    return perform(request, parse=True)
+
+# Start an export of all records into a directory and return a function reading its progress
+def start_export(url, directory, volume):
+    os.makedirs(directory)
+    status, _, body = post_json(f'{url}/export', {'mountPoint': directory, 'volume': volume})
+    if status != 202:
+        raise RuntimeError(f"Export could not be started: {status} {body}")
+    return lambda: get_json(f'{url}/export')
+
+def wait_for(condition, timeout, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(interval)
+    raise RuntimeError("Timed out")
+
+# Download the zip of all records and count the bytes received per time
+class Download:
+    def __init__(self, url):
+        self.received = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(url,), daemon=True)
+        self.thread.start()
+
+    def run(self, url):
+        with urllib.request.urlopen(f'{url}/records/allBinaries', timeout=600) as response:
+            while not self.stopped.is_set():
+                data = response.read(64 * 1024)
+                if not data:
+                    break
+                self.received.append((time.monotonic(), len(data)))
+
+    # Bytes per second received between two points in time
+    def rate(self, start, end):
+        return sum(size for at, size in self.received if start <= at < end) / (end - start)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+def scheduler_metrics(url):
+    with urllib.request.urlopen(f'{url}/metrics') as response:
+        lines = response.read().decode().splitlines()
+    return [line for line in lines if line.startswith(('weddingring_scheduler_', 'weddingring_active_calls'))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that background work steps back during a call')
+    parser.add_argument('--records', type=int, default=30)
+    parser.add_argument('--length', type=float, default=5, help='Length of every record in seconds')
+    parser.add_argument('--call', type=float, default=5, help='Seconds the phone is off-hook')
+    parser.add_argument('--resume-delay', type=float, default=2, help='WEDDINGRING_RESUME_DELAY of the server')
+    parser.add_argument('--throttle', type=int, default=1024 * 1024, help='WEDDINGRING_THROTTLE_RATE of the server in bytes per second')
+    parser.add_argument('--port', type=int, default=8093)
+    args = parser.parse_args()
+
+    process, workdir = spawn_server(args.port, WEDDINGRING_RESUME_DELAY=args.resume_delay,
+                                    WEDDINGRING_THROTTLE_RATE=args.throttle, WEDDINGRING_EXPORT_REQUIRE_MOUNT=0)
+    url = f'http://localhost:{args.port}'
+    phone = prober = None
+    errors = []
+    report = {}
+    try:
+        for i in range(args.records):
+            body, content_type = multipart('file', f'{i}.wav', build_wav(args.length, frequency=300 + i * 10))
+            perform(urllib.request.Request(f'{url}/records', data=body, headers={'Content-Type': content_type}))
+        phone = simple_websocket.Client(f'{url}/socket?device=bench-phone')
+        prober = Prober(url, 0.02)
+
+        time.sleep(2)
+        report['idle'] = prober.take()
+
+        # Export without a call
+        started = time.monotonic()
+        progress = start_export(url, os.path.join(workdir, 'usb-a'), 'bench-a')
+        wait_for(lambda: progress()['state'] == 'finished', 600)
+        report['export'] = dict(prober.take(), seconds=round(time.monotonic() - started, 2))
+
+        # A call starts in the middle of an export and a download of all records
+        progress = start_export(url, os.path.join(workdir, 'usb-b'), 'bench-b')
+        wait_for(lambda: progress()['done'] >= 2, 600)
+        phone.send('STATUS:OFF_HOOK')
+        call_started = time.monotonic()
+        time.sleep(0.5)
+        download = Download(url)
+        done_at_start = progress()['done']
+        time.sleep(args.call)
+        done_at_end = progress()['done']
+        call_status = get_json(f'{url}/scheduler')
+        phone.send('STATUS:ON_HOOK')
+        call_ended = time.monotonic()
+        # The first half of the call fills the socket buffers, the rate is taken from the second half
+        download_rate = download.rate(call_started + args.call / 2, call_ended)
+        during_call = prober.take()
+        wait_for(lambda: progress()['done'] > done_at_end or progress()['state'] == 'finished', 60, 0.01)
+        resumed_after = time.monotonic() - call_ended
+        time.sleep(1)
+        download.stop()
+        after_rate = download.rate(call_ended + args.resume_delay + 0.2, time.monotonic())
+        wait_for(lambda: progress()['state'] == 'finished', 600)
+        report['call'] = dict(during_call, exportedDuringCall=done_at_end - done_at_start,
+                              jobState=[job['state'] for job in call_status['jobs'] if job['task'] == 'export'][-1],
+                              downloadBytesPerSecond=int(download_rate), downloadAfterCallBytesPerSecond=int(after_rate),
+                              resumedAfterSeconds=round(resumed_after, 2))
+        report['metrics'] = scheduler_metrics(url)
+
+        # A chunk that was read before the call started may still be finished
+        if done_at_end - done_at_start > 1:
+            errors.append(f"The export copied {done_at_end - done_at_start} files during the call")
+        if resumed_after < args.resume_delay - 0.5:
+            errors.append(f"The export resumed {resumed_after:.2f} seconds after the call, before the resume delay")
+        if download_rate > args.throttle * 1.5:
+            errors.append(f"The download ran at {int(download_rate)} bytes/s during the call, the throttle is {args.throttle}")
+        if during_call['p99Ms'] > max(report['idle']['p99Ms'] * 5, 50):
+            errors.append(f"GET /config p99 was {during_call['p99Ms']} ms during the call")
+    finally:
+        if prober:
+            prober.stop()
+        if phone:
+            phone.close()
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report['errors'] = errors
+    print(json.dumps(report, indent=2))
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+# Synthetic wav fixtures for the benchmarks
+# The fixtures match the format the server accepts: 32-bit, 96kHz, stereo
+import os
+import sys
+
+# The wav builder is shared with the simulation, so both produce the same test audio
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(REPO_DIR)
+
+from simulation.wav import build_wav, wav_header, RATE, CHANNELS, SAMPLE_WIDTH
+
+# Write fixtures of the given lengths to a directory, existing fixtures are reused
+# Returns a dictionary of length in seconds to file path
+def ensure_fixtures(directory, lengths):
+    os.makedirs(directory, exist_ok=True)
+    fixtures = {}
+    for seconds in lengths:
+        file_path = os.path.join(directory, f"fixture_{seconds}s.wav")
+        if not os.path.exists(file_path):
+            with open(file_path, 'wb') as f:
+                f.write(build_wav(seconds))
+        fixtures[seconds] = file_path
+    return fixtures
@@ -0,0 +1,251 @@
+# Load test for the server
+# Hits the ingest and download paths with a configurable concurrency and reports throughput,
+# p50/p99 latency and the peak RSS of the server per scenario. Results are saved as JSON
+# so runs of different versions on the same device can be compared with --compare.
+# Usage (from the server directory):
+#   python3 benchmarks/load_test.py --spawn --mode production --concurrency 4 --requests 40 --lengths 5 30
+#   python3 benchmarks/load_test.py --url http://localhost:8080 --pid <server pid>
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fixtures import ensure_fixtures
+
+# Compute a percentile from a sorted list using the nearest rank
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+# Read the current RSS of a process and its children in kB
+# With gunicorn the requests are served by worker processes below the master
+def read_rss(pid):
+    try:
+        rss = 0
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1])
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            for child in f.read().split():
+                rss += read_rss(int(child)) or 0
+        return rss
+    except OSError:
+        return None
+
+# Samples the RSS of the server in the background and keeps the peak
+class RssSampler:
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self.stopped = threading.Event()
+
+    def __enter__(self):
+        if self.pid:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = read_rss(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            self.stopped.wait(self.interval)
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        return False
+
+# Build a multipart form data body with a single file
+def multipart(field, filename, content):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: audio/wav\r\n\r\n'
+    ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+# Status returned for a request that got no response, e.g. a refused or reset connection or a timeout
+NO_RESPONSE = 599
+
+# Perform a request and read the complete response
+# Returns the status code, the number of body bytes and the parsed JSON body if requested
+def perform(request, parse=False):
+    try:
+        with urllib.request.urlopen(request, timeout=600) as response:
+            body = response.read()
+            return response.status, len(body), json.loads(body) if parse else None
+    except urllib.error.HTTPError as e:
+        return e.code, 0, None
+    except (urllib.error.URLError, OSError):
+        return NO_RESPONSE, 0, None
+
+# Run one scenario, make_request is called with the request number and returns a urllib request
+def run_scenario(name, make_request, count, concurrency, pid, parse=False):
+    latencies = []
+    transferred = [0]
+    errors = [0]
+    results = []
+    lock = threading.Lock()
+
+    def worker(i):
+        request = make_request(i)
+        start = time.perf_counter()
+        status, size, body = perform(request, parse)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            transferred[0] += size + len(request.data or b'')
+            if status >= 400:
+                errors[0] += 1
+            elif body is not None:
+                results.append(body)
+
+    with RssSampler(pid) as sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(worker, range(count)))
+        duration = time.perf_counter() - start
+
+    latencies.sort()
+    report = {
+        'requests': count,
+        'errors': errors[0],
+        'durationSeconds': round(duration, 3),
+        'throughputRps': round(count / duration, 2),
+        'throughputMBps': round(transferred[0] / duration / 1e6, 2),
+        'p50Ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99Ms': round(percentile(latencies, 99) * 1000, 2),
+        'maxMs': round(latencies[-1] * 1000, 2),
+        'peakRssKb': sampler.peak
+    }
+    print(f"{name:<20} {report['throughputRps']:>8} req/s {report['throughputMBps']:>8} MB/s "
+          f"p50 {report['p50Ms']:>9} ms p99 {report['p99Ms']:>9} ms errors {report['errors']}")
+    return report, results
+
+# Start a server from this checkout in a temporary directory, or in workdir to restart it on its data
+# mode is either 'production' (gunicorn) or 'dev' (Werkzeug development server), variables are added to the environment
+def spawn_server(port, mode='production', workdir=None, **variables):
+    workdir = workdir or tempfile.mkdtemp(prefix='weddingring-load-')
+    env = dict(os.environ, WEDDINGRING_PORT=str(port), WEDDINGRING_DEBUG='0', **{key: str(value) for key, value in variables.items()})
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SERVER_DIR, env.get('PYTHONPATH')]))
+    if mode == 'production':
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(SERVER_DIR, 'gunicorn.conf.py'), 'app:app']
+    else:
+        command = [sys.executable, os.path.join(SERVER_DIR, 'app.py')]
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://localhost:{port}/config', timeout=1).close()
+            return process, workdir
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Spawned server did not come up")
+
+# Print the relative change of every scenario against a previous result file
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['scenarios']
+    print(f"\nChange against {baseline_path}:")
+    for name, report in current.items():
+        if name not in baseline:
+            continue
+        changes = []
+        for key in ('throughputRps', 'p50Ms', 'p99Ms', 'peakRssKb'):
+            old, new = baseline[name].get(key), report.get(key)
+            if old and new is not None:
+                changes.append(f"{key} {(new / old - 1) * 100:+.1f}%")
+        print(f"{name:<20} {', '.join(changes)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the weddingRing server')
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--pid', type=int, help='PID of the server to sample the RSS of')
+    parser.add_argument('--spawn', action='store_true', help='Start a server from this checkout in a temporary directory')
+    parser.add_argument('--port', type=int, default=8091, help='Port of the spawned server')
+    parser.add_argument('--mode', choices=['production', 'dev'], default='production', help='How the spawned server is run')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=40, help='Requests per scenario')
+    parser.add_argument('--zip-requests', type=int, default=2, help='Requests for the allBinaries scenario')
+    parser.add_argument('--lengths', type=float, nargs='+', default=[5, 30], help='Fixture lengths in seconds')
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), 'weddingring-fixtures'))
+    parser.add_argument('--output', help='Result file, defaults to benchmarks/results/load_<timestamp>.json')
+    parser.add_argument('--compare', help='Previous result file to compare against')
+    args = parser.parse_args()
+
+    server = workdir = None
+    if args.spawn:
+        server, workdir = spawn_server(args.port, args.mode)
+        args.url = f'http://localhost:{args.port}'
+        args.pid = server.pid
+
+    try:
+        url = args.url.rstrip('/')
+        fixtures = ensure_fixtures(args.fixtures, args.lengths)
+        scenarios = {}
+        uploaded = []
+
+        for seconds, file_path in fixtures.items():
+            with open(file_path, 'rb') as f:
+                body, content_type = multipart('file', os.path.basename(file_path), f.read())
+            make = lambda i: urllib.request.Request(f'{url}/records', data=body, headers={'Content-Type': content_type})
+            scenarios[f'upload_{seconds:g}s'], records = run_scenario(f'upload {seconds:g}s', make, args.requests, args.concurrency, args.pid, parse=True)
+            uploaded.extend(record['id'] for record in records)
+
+        scenarios['list'], _ = run_scenario('list', lambda i: urllib.request.Request(f'{url}/records'),
+                                            args.requests, args.concurrency, args.pid)
+        if uploaded:
+            scenarios['binary'], _ = run_scenario('binary', lambda i: urllib.request.Request(f'{url}/records/{uploaded[i % len(uploaded)]}/binary'),
+                                                  args.requests, args.concurrency, args.pid)
+        scenarios['allBinaries'], _ = run_scenario('allBinaries', lambda i: urllib.request.Request(f'{url}/records/allBinaries'),
+                                                   args.zip_requests, min(args.concurrency, args.zip_requests), args.pid)
+        config = lambda i: urllib.request.Request(f'{url}/config', method='PUT', data=json.dumps({'ringCount': i % 10 + 1}).encode(),
+                                                  headers={'Content-Type': 'application/json'})
+        scenarios['config'], _ = run_scenario('config', config, args.requests, args.concurrency, args.pid)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        'meta': {
+            'timestamp': int(time.time()),
+            'host': socket.gethostname(),
+            'url': args.url,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'lengths': args.lengths
+        },
+        'scenarios': scenarios
+    }
+    output = args.output or os.path.join(BENCHMARK_DIR, 'results', f"load_{result['meta']['timestamp']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults saved to {output}")
+    if args.compare:
+        compare(scenarios, args.compare)
+
+if __name__ == '__main__':
+    main()
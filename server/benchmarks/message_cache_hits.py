@@ -0,0 +1,153 @@
+# Message binaries served from memory
+# Starts the production server once with the message cache disabled and once with its default budget, uploads
+# greeting messages and requests them the way the interface (whole files) and the browsers (Range requests while
+# seeking) do. Reports the latency per kind of request, the bytes the server read per request (rchar of
+# /proc/<pid>/io, covering the files and the database) and the hit rate and memory use from /metrics. It fails
+# if the cached server still reads the files or its hit rate is below --target.
+# Usage (from the server directory):
+#   python3 benchmarks/message_cache_hits.py --messages 4 --length 10 --requests 200
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import build_wav
+from load_test import spawn_server, multipart, perform, percentile
+
+# Bytes read by a process and its children, with gunicorn the requests are served by a worker below the master
+def read_chars(pid):
+    try:
+        total = 0
+        with open(f'/proc/{pid}/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    total = int(line.split()[1])
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            for child in f.read().split():
+                total += read_chars(int(child)) or 0
+        return total
+    except OSError:
+        return None
+
+def metrics(url):
+    with urllib.request.urlopen(f'{url}/metrics') as response:
+        lines = response.read().decode().splitlines()
+    values = {}
+    for line in lines:
+        if line.startswith('weddingring_message_cache_'):
+            name, value = line.rsplit(' ', 1)
+            values[name] = float(value)
+    return values
+
+# Wait until the messages were read into memory after the start
+def wait_for_warm_up(url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = perform(urllib.request.Request(f'{url}/scheduler'), parse=True)[2]
+        jobs = [job for job in status['jobs'] if job['task'] == 'messageCache']
+        if jobs and jobs[-1]['state'] in ('finished', 'failed'):
+            return jobs[-1]['result']
+        time.sleep(0.1)
+    raise RuntimeError("The message cache was not warmed up")
+
+def run(mode, args, port):
+    variables = {'WEDDINGRING_MESSAGE_CACHE_BYTES': 0} if mode == 'disabled' else {}
+    process, workdir = spawn_server(port, **variables)
+    url = f'http://localhost:{port}'
+    try:
+        messages = []
+        for i in range(args.messages):
+            body, content_type = multipart('file', f'{i}.wav', build_wav(args.length, frequency=300 + i * 10))
+            status, _, result = perform(urllib.request.Request(f'{url}/messages', data=body, headers={'Content-Type': content_type}), parse=True)
+            messages.append((result['id'], len(body)))
+        # Messages uploaded after the start are read into memory on their first request, restart to warm them up
+        process.terminate()
+        process.wait()
+        process, _ = spawn_server(port, workdir=workdir, **variables)
+        warm_up = wait_for_warm_up(url)
+
+        rng = random.Random(args.seed)
+        requests = []
+        for _ in range(args.requests):
+            message_id, size = rng.choice(messages)
+            if rng.random() < args.range_share:
+                start = rng.randrange(size // 2)
+                requests.append(('range', message_id, {'Range': f'bytes={start}-{start + args.range_size - 1}'}))
+            else:
+                requests.append(('full', message_id, {}))
+
+        latencies = {'full': [], 'range': []}
+        sizes = []
+
+        def fetch(request):
+            kind, message_id, headers = request
+            started = time.perf_counter()
+            with urllib.request.urlopen(urllib.request.Request(f'{url}/messages/{message_id}/binary', headers=headers)) as response:
+                sizes.append(len(response.read()))
+            latencies[kind].append(time.perf_counter() - started)
+
+        before = read_chars(process.pid)
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(fetch, requests))
+        read = read_chars(process.pid) - before
+        values = metrics(url)
+        hits = values.get('weddingring_message_cache_requests_total{result="hit"}', 0)
+        lookups = sum(value for name, value in values.items() if name.startswith('weddingring_message_cache_requests_total'))
+        report = {
+            'warmUp': warm_up,
+            'bytesServed': sum(sizes),
+            'bytesReadPerRequest': int(read / len(requests)),
+            'hitRate': round(hits / lookups, 3) if lookups else None,
+            'cacheBytes': int(values.get('weddingring_message_cache_bytes', 0)),
+            'budgetBytes': int(values.get('weddingring_message_cache_budget_bytes', 0))
+        }
+        for kind, values in latencies.items():
+            values.sort()
+            report[kind] = {
+                'requests': len(values),
+                'p50Ms': round(percentile(values, 50) * 1000, 2) if values else None,
+                'p99Ms': round(percentile(values, 99) * 1000, 2) if values else None
+            }
+        return report
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare serving message binaries from the files and from memory')
+    parser.add_argument('--messages', type=int, default=4)
+    parser.add_argument('--length', type=float, default=10, help='Length of every message in seconds')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--range-share', type=float, default=0.5, help='Share of the requests that ask for a range')
+    parser.add_argument('--range-size', type=int, default=256 * 1024, help='Bytes of every range request')
+    parser.add_argument('--target', type=float, default=0.95, help='Lowest hit rate of the cached server')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8097)
+    args = parser.parse_args()
+
+    report = {'disabled': run('disabled', args, args.port), 'cached': run('cached', args, args.port)}
+    cached = report['cached']
+    errors = []
+    if cached['hitRate'] is None or cached['hitRate'] < args.target:
+        errors.append(f"The hit rate was {cached['hitRate']}, the target is {args.target}")
+    # The requests themselves are read too, but not a file
+    if cached['bytesReadPerRequest'] > 64 * 1024:
+        errors.append(f"The cached server read {cached['bytesReadPerRequest']} bytes per request")
+    if not cached['cacheBytes']:
+        errors.append('No message was held in memory')
+    report['errors'] = errors
+    print(json.dumps(report, indent=2))
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Measures the cost of the request instrumentation behind /metrics
+# Usage (from the server directory): python3 benchmarks/metrics_overhead.py [requests]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+import metrics
+
+# Build a minimal app with a single route, optionally with the metrics hooks
+def build_app(instrumented):
+    app = Flask(__name__)
+    if instrumented:
+        metrics.register_request_hooks(app)
+
+    @app.route('/ping')
+    def ping():
+        return 'pong', 200
+
+    return app
+
+# Time a number of requests against the app using the test client
+def time_requests(app, count):
+    client = app.test_client()
+    # Warm up
+    for _ in range(100):
+        client.get('/ping')
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get('/ping')
+    return (time.perf_counter() - start) / count
+
+# Time a number of raw histogram observations
+def time_observe(count):
+    histogram = metrics.Histogram('benchmark_seconds', 'Benchmark histogram', ('label',))
+    start = time.perf_counter()
+    for i in range(count):
+        histogram.observe(i * 1e-6, 'value')
+    return (time.perf_counter() - start) / count
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    observe = time_observe(count * 10)
+    plain = time_requests(build_app(False), count)
+    instrumented = time_requests(build_app(True), count)
+    print(f"Histogram observe:        {observe * 1e9:8.0f} ns")
+    print(f"Request without metrics:  {plain * 1e6:8.1f} us")
+    print(f"Request with metrics:     {instrumented * 1e6:8.1f} us")
+    print(f"Overhead per request:     {(instrumented - plain) * 1e6:8.1f} us ({(instrumented / plain - 1) * 100:.1f}%)")
@@ -0,0 +1,87 @@
+# Benchmark for GET /records/<id>/slice
+# Creates records of different lengths and measures cutting the same span out of each of them.
+# The slice is served from a memory map of the span only, so its time should not grow with the
+# length of the record. The audio data of the fixtures is sparse, only the span is ever read.
+# Usage (from the server directory):
+#   python3 benchmarks/slice.py --lengths 60 240 960 3600 --span 10 --target 2
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from flask import Flask
+from database import init_db, execute_db
+from fixtures import wav_header, RATE, CHANNELS, SAMPLE_WIDTH
+
+# Create a record of the given length in seconds, the audio data is a hole in the file
+def create_record(seconds):
+    record_id = str(uuid.uuid4())
+    data_size = int(seconds * RATE) * CHANNELS * SAMPLE_WIDTH
+    with open(os.path.join('recordings', f"{record_id}.wav"), 'wb') as f:
+        f.write(wav_header(data_size))
+        f.truncate(f.tell() + data_size)
+    execute_db('INSERT INTO records (id, recordTimestamp, length) VALUES (?, ?, ?)', (record_id, int(time.time()), seconds * 1000))
+    return record_id
+
+# Request the slice repeatedly and return the median time in ms and the size of the response
+def measure(client, record_id, start_ms, end_ms, repeat):
+    durations = []
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(f'/records/{record_id}/slice?start={start_ms}&end={end_ms}')
+        size = len(response.get_data())
+        durations.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+    return statistics.median(durations) * 1000, size
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the slice endpoint for records of different lengths')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[60, 240, 960, 3600], help='Record lengths in seconds')
+    parser.add_argument('--span', type=float, default=10, help='Length of the slice in seconds, cut from the middle')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--target', type=float, default=2.0, help='Maximum ratio between the slowest and the fastest median')
+    parser.add_argument('--dir', help='Directory the records are created in, defaults to a temporary one. '
+                                      'Use a directory on the SD card to measure the real storage.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='weddingring-slice-', dir=args.dir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # The blueprint creates its folder relative to the working directory on import
+        from endpoints.records import records_bp
+        app = Flask(__name__)
+        app.register_blueprint(records_bp)
+        results = {}
+        with app.app_context():
+            init_db()
+            records = {seconds: create_record(seconds) for seconds in args.lengths}
+        client = app.test_client()
+        for seconds, record_id in records.items():
+            start_ms = int((seconds - args.span) * 500)
+            results[seconds] = measure(client, record_id, start_ms, start_ms + int(args.span * 1000), args.repeat)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for seconds, (median, size) in results.items():
+        print(f"{seconds:>6} s record: {median:>8.2f} ms median for a {size / 1e6:.1f} MB slice")
+    medians = [median for median, _ in results.values()]
+    ratio = max(medians) / min(medians)
+    if ratio > args.target:
+        print(f"FAIL: the slowest slice took {ratio:.2f} times as long as the fastest, the target is {args.target}")
+        sys.exit(1)
+    print(f"OK: the slowest slice took {ratio:.2f} times as long as the fastest, within the target of {args.target}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# Startup benchmark for the server
+# Prints an import time breakdown of app.py and measures the time from process start until the first
+# request is answered, for the lazy and the eager API docs mode and for a fresh and an existing database.
+# The run fails if the median time to first request of the default (lazy) mode exceeds --target.
+# Usage (from the server directory):
+#   python3 benchmarks/startup.py --runs 5 --target 2.0
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Environment for a server started from this checkout
+def server_env(**variables):
+    env = dict(os.environ, WEDDINGRING_DEBUG='0', **{k: str(v) for k, v in variables.items()})
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [SERVER_DIR, env.get('PYTHONPATH')]))
+    return env
+
+# Import app.py with -X importtime and sum the cumulative time of its direct imports per top level package
+# Returns the total import time of app.py and the packages sorted by their share in ms
+def import_profile(lazy_docs):
+    workdir = tempfile.mkdtemp(prefix='weddingring-startup-')
+    try:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=workdir,
+                                env=server_env(WEDDINGRING_LAZY_DOCS=int(lazy_docs)), capture_output=True, text=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    packages = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # Children are listed before their parent and indented by two spaces per level
+        # The cumulative time of a direct import of app.py includes everything below it
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() == 'app':
+            total = int(cumulative_us) / 1000
+        elif depth == 1:
+            package = name.strip().split('.')[0]
+            packages[package] = packages.get(package, 0) + int(cumulative_us) / 1000
+    return total, sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+# Start the development server in workdir and measure the seconds until GET /config is answered
+def time_to_first_request(workdir, port, lazy_docs):
+    url = f'http://localhost:{port}/config'
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(SERVER_DIR, 'app.py')], cwd=workdir,
+                               env=server_env(WEDDINGRING_PORT=port, WEDDINGRING_LAZY_DOCS=int(lazy_docs)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + 60
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("Server exited during startup")
+            try:
+                urllib.request.urlopen(url, timeout=1).close()
+                elapsed = time.perf_counter() - start
+                break
+            except OSError:
+                time.sleep(0.01)
+        else:
+            raise RuntimeError("Server did not come up")
+        # The first docs request pays for the import of flasgger and the spec in lazy mode
+        docs_start = time.perf_counter()
+        urllib.request.urlopen(f'http://localhost:{port}/apispec_1.json', timeout=30).close()
+        return elapsed, time.perf_counter() - docs_start
+    finally:
+        process.terminate()
+        process.wait()
+
+# Measure a mode several times, the first start of every run uses a fresh database
+def measure(runs, port, lazy_docs):
+    fresh, existing, docs = [], [], []
+    for _ in range(runs):
+        workdir = tempfile.mkdtemp(prefix='weddingring-startup-')
+        try:
+            elapsed, docs_elapsed = time_to_first_request(workdir, port, lazy_docs)
+            fresh.append(elapsed)
+            docs.append(docs_elapsed)
+            elapsed, _ = time_to_first_request(workdir, port, lazy_docs)
+            existing.append(elapsed)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'freshDatabaseMs': round(statistics.median(fresh) * 1000, 1),
+        'existingDatabaseMs': round(statistics.median(existing) * 1000, 1),
+        'firstDocsRequestMs': round(statistics.median(docs) * 1000, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup time of the weddingRing server')
+    parser.add_argument('--runs', type=int, default=5, help='Starts per mode, the median is reported')
+    parser.add_argument('--port', type=int, default=8092)
+    parser.add_argument('--target', type=float, default=2.0, help='Maximum median seconds to the first request with an existing database')
+    parser.add_argument('--top', type=int, default=10, help='Number of packages shown in the import breakdown')
+    parser.add_argument('--output', help='Result file, defaults to benchmarks/results/startup_<timestamp>.json')
+    args = parser.parse_args()
+
+    result = {
+        'meta': {'timestamp': int(time.time()), 'host': socket.gethostname(), 'runs': args.runs, 'targetSeconds': args.target},
+        'imports': {},
+        'modes': {}
+    }
+    for name, lazy_docs in (('lazy', True), ('eager', False)):
+        total, packages = import_profile(lazy_docs)
+        result['imports'][name] = {'totalMs': round(total, 1), 'packages': {k: round(v, 1) for k, v in packages}}
+        print(f"Import time ({name} docs): {total:.1f} ms")
+        for package, ms in packages[:args.top]:
+            print(f"  {package:<24} {ms:>8.1f} ms")
+
+    print()
+    for name, lazy_docs in (('lazy', True), ('eager', False)):
+        report = measure(args.runs, args.port, lazy_docs)
+        result['modes'][name] = report
+        print(f"{name:<6} first request: fresh db {report['freshDatabaseMs']:>8} ms, existing db {report['existingDatabaseMs']:>8} ms, "
+              f"first /apispec request {report['firstDocsRequestMs']:>8} ms")
+
+    output = args.output or os.path.join(BENCHMARK_DIR, 'results', f"startup_{result['meta']['timestamp']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    measured = result['modes']['lazy']['existingDatabaseMs'] / 1000
+    if measured > args.target:
+        print(f"FAIL: time to first request {measured:.3f} s exceeds the target of {args.target} s")
+        sys.exit(1)
+    print(f"OK: time to first request {measured:.3f} s is within the target of {args.target} s")
+
+if __name__ == '__main__':
+    main()
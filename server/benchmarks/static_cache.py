@@ -0,0 +1,113 @@
+# Benchmark for the caching of the management UI
+# Emulates a browser on a guest's phone that opens every page twice: once with an empty cache and once
+# more after that. The cache follows the Cache-Control headers: immutable files are not requested again,
+# files with no-cache are revalidated with If-None-Match. Reports the requests that reach the server and
+# the transferred bytes, for the source tree (every file revalidated, as served before the build) and
+# for the fingerprinted and precompressed build.
+# Usage (from the server directory):
+#   python3 benchmarks/static_cache.py
+import argparse
+import gzip
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, SERVER_DIR)
+
+import build_static
+import endpoints.static_files as static_files
+from flask import Flask
+
+PAGES = ['index.html', 'recordings.html', 'messages.html', 'configuration.html', 'debug.html']
+
+# Assets referenced by a page
+ASSET = re.compile(r'(?:src|href)="([^"/:#?][^"]*\.(?:js|css))"')
+
+# Body of a response as the browser sees it
+def decode(response):
+    data = response.get_data()
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    if encoding == 'br':
+        import brotli
+        return brotli.decompress(data)
+    return data
+
+# Browser cache emulation, keyed by URL as (etag, immutable, body)
+class Browser:
+    def __init__(self, client, encoding):
+        self.client = client
+        self.encoding = encoding
+        self.cache = {}
+        self.requests = 0
+        self.bytes = 0
+
+    # Returns the body from the server or the cache
+    def get(self, url):
+        cached = self.cache.get(url)
+        if cached and cached[1]:
+            return cached[2]
+        headers = {'Accept-Encoding': self.encoding}
+        if cached:
+            headers['If-None-Match'] = cached[0]
+        response = self.client.get(url, headers=headers)
+        self.requests += 1
+        # The headers are counted roughly, the body exactly as it was sent
+        self.bytes += len(response.get_data()) + sum(len(key) + len(value) + 4 for key, value in response.headers.items())
+        if response.status_code == 304:
+            return cached[2]
+        assert response.status_code == 200, (url, response.status_code)
+        body = decode(response)
+        self.cache[url] = (response.headers.get('ETag'), 'immutable' in response.headers.get('Cache-Control', ''), body)
+        return body
+
+    def open(self, page):
+        html = self.get(f'/static/{page}').decode('utf-8')
+        for asset in ASSET.findall(html):
+            self.get(f'/static/{asset}')
+
+# Open all pages cold and warm, returns the requests and bytes of both passes
+def navigate(client, encoding):
+    browser = Browser(client, encoding)
+    results = {}
+    for name in ('cold', 'warm'):
+        requests, transferred = browser.requests, browser.bytes
+        for page in PAGES:
+            browser.open(page)
+        results[name] = {'requests': browser.requests - requests, 'bytes': browser.bytes - transferred}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the requests and bytes of page navigations with and without the static build')
+    parser.add_argument('--encoding', default='br, gzip', help='Accept-Encoding of the emulated browser')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='weddingring-static-')
+    try:
+        build_folder = os.path.join(workdir, 'static_build')
+        build_static.build(build_static.SOURCE_FOLDER, build_folder)
+        static_files.BUILD_FOLDER = build_folder
+        app = Flask(__name__, static_folder=None)
+        app.register_blueprint(static_files.static_files_bp)
+        client = app.test_client()
+
+        results = {}
+        # In debug mode the source tree is served
+        app.debug = True
+        results['source'] = navigate(client, args.encoding)
+        app.debug = False
+        results['build'] = navigate(client, args.encoding)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for tree, passes in results.items():
+        for name, result in passes.items():
+            print(f"{tree:>6} {name}: {result['requests']:>3} requests, {result['bytes'] / 1024:>7.1f} KiB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Websocket latency under load
+# Measures the time a message needs to be relayed from one websocket client to another through /socket,
+# first on an idle server, then while large uploads and /records/allBinaries downloads run concurrently.
+# With the production server the latency should stay flat, the development server is given for comparison.
+# Usage (from the server directory):
+#   python3 benchmarks/ws_latency.py --mode production --transfers 4
+#   python3 benchmarks/ws_latency.py --mode dev --transfers 4
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import simple_websocket
+from fixtures import build_wav
+from load_test import spawn_server, multipart, perform, percentile
+
+# Measure the relay latency of a number of messages sent from one client to another
+def measure(url, count, interval):
+    sender = simple_websocket.Client(f'{url}/socket')
+    receiver = simple_websocket.Client(f'{url}/socket')
+    latencies = []
+    try:
+        # The server registers a connection after the handshake, probe until the receiver is reachable
+        for _ in range(50):
+            sender.send('BENCHMARK:ready')
+            if receiver.receive(timeout=0.2) == 'BENCHMARK:ready':
+                break
+        for i in range(count):
+            sent = time.perf_counter()
+            sender.send(f'BENCHMARK:{i}')
+            # Skip anything that is not our message, e.g. broadcasts of the server or late probes
+            while True:
+                message = receiver.receive(timeout=30)
+                if message is None:
+                    raise RuntimeError(f"Message {i} was not relayed within 30 seconds")
+                if message == f'BENCHMARK:{i}':
+                    break
+            latencies.append(time.perf_counter() - sent)
+            time.sleep(interval)
+    finally:
+        sender.close()
+        receiver.close()
+    latencies.sort()
+    return {
+        'messages': count,
+        'p50Ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99Ms': round(percentile(latencies, 99) * 1000, 2),
+        'maxMs': round(latencies[-1] * 1000, 2)
+    }
+
+# Keep uploading and downloading until stopped, alternating per transfer thread
+def transfer(url, upload, stopped, index, counter):
+    while not stopped.is_set():
+        if index % 2:
+            body, content_type = upload
+            request = urllib.request.Request(f'{url}/records', data=body, headers={'Content-Type': content_type})
+        else:
+            request = urllib.request.Request(f'{url}/records/allBinaries')
+        try:
+            perform(request)
+            counter.append(1)
+        except OSError:
+            # The server is shut down at the end of the test while transfers are still running
+            return
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure websocket latency during concurrent large transfers')
+    parser.add_argument('--mode', choices=['production', 'dev'], default='production')
+    parser.add_argument('--port', type=int, default=8092)
+    parser.add_argument('--transfers', type=int, default=4, help='Concurrent upload/download threads')
+    parser.add_argument('--seed-records', type=int, default=10, help='Records uploaded before the test')
+    parser.add_argument('--length', type=float, default=30, help='Length of the uploaded recordings in seconds')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.02, help='Seconds between two messages')
+    parser.add_argument('--output', help='File the JSON result is written to')
+    args = parser.parse_args()
+
+    server, workdir = spawn_server(args.port, args.mode)
+    url = f'http://localhost:{args.port}'
+    try:
+        upload = multipart('file', 'recording.wav', build_wav(args.length))
+        for _ in range(args.seed_records):
+            perform(urllib.request.Request(f'{url}/records', data=upload[0], headers={'Content-Type': upload[1]}))
+
+        idle = measure(f'ws://localhost:{args.port}', args.messages, args.interval)
+
+        stopped = threading.Event()
+        completed = []
+        threads = [threading.Thread(target=transfer, args=(url, upload, stopped, i, completed), daemon=True)
+                   for i in range(args.transfers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(1)
+        loaded = measure(f'ws://localhost:{args.port}', args.messages, args.interval)
+        loaded['transfersCompleted'] = len(completed)
+        stopped.set()
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {'mode': args.mode, 'transfers': args.transfers, 'idle': idle, 'loaded': loaded}
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import os
+import time
+import uuid
+import hashlib
+import threading
+from database import get_db, transaction
+from audio_utils import read_wav_header, audio_metadata
+from scheduler import checkpoint
+
+# Content addressed storage of the audio files
+# Every distinct file is stored once as blobs/<sha256>.wav. The file of a record, <folder>/<id>.wav,
+# is a hard link to its blob, so everything reading the record files keeps working unchanged and
+# storing the same content again only costs a directory entry. The blobs table counts the rows
+# referencing each blob, a blob is removed once the last row referencing it is deleted.
+BLOB_FOLDER = 'blobs'
+
+# Prefix of the temporary files uploads are received into
+UPLOAD_PREFIX = '.upload-'
+
+# Size of the chunks uploads are read and hashed in
+CHUNK_SIZE = 1024 * 1024
+
+# Serializes the duplicate check and the insert of uploads, so two uploads of the same content
+# arriving at the same time do not both create a row
+ingest_lock = threading.Lock()
+
+# Path of the blob with the given checksum
+def blob_path(checksum):
+    return os.path.join(BLOB_FOLDER, f"{checksum}.wav")
+
+# Raised when a stream is larger than the bytes allowed for it
+class SizeLimitError(Exception):
+    pass
+
+# Write an uploaded stream into a temporary file in the blob folder and compute its SHA-256 on the way
+# With a limit, receiving stops with SizeLimitError as soon as the stream is larger, the file is removed
+# Returns the temporary path, the hex checksum and the size in bytes
+def receive(stream, limit=None):
+    os.makedirs(BLOB_FOLDER, exist_ok=True)
+    tmp_path = os.path.join(BLOB_FOLDER, f"{UPLOAD_PREFIX}{uuid.uuid4()}")
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+                if limit is not None and size > limit:
+                    raise SizeLimitError(f'Larger than {limit} bytes')
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, sha256.hexdigest(), size
+
+# Compute the SHA-256 of a stored file
+def hash_file(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+# Count one more reference to a blob, the blob row is created with the first reference
+def add_reference(db, checksum, size):
+    db.execute('''
+        INSERT INTO blobs (checksum, size, refCount) VALUES (?, ?, 1)
+        ON CONFLICT (checksum) DO UPDATE SET refCount = refCount + 1
+    ''', (checksum, size))
+
+# Drop one reference per checksum, called in the transaction deleting the rows
+# Blobs that are no longer referenced get a tombstone and their row is removed
+# Returns the checksums of these blobs, their files are removed after the commit
+def release_references(db, checksums):
+    db.executemany('UPDATE blobs SET refCount = refCount - 1 WHERE checksum = ?', [(checksum,) for checksum in checksums])
+    unused = [row[0] for row in db.execute('SELECT checksum FROM blobs WHERE refCount <= 0').fetchall()]
+    db.executemany("INSERT OR IGNORE INTO tombstones (folder, id) VALUES ('blobs', ?)", [(checksum,) for checksum in unused])
+    db.execute('DELETE FROM blobs WHERE refCount <= 0')
+    return unused
+
+# Add received and validated uploads to a table
+# Every entry needs tmp, checksum, size and length, columns optionally holds further validated columns
+# of the row. id and recordTimestamp are generated unless the entry has them, e.g. a record copied from
+# another server keeps them. An upload whose content is already stored in the
+# table is not stored again, the entry gets the existing row and duplicate set to True instead.
+# New entries are moved into the blob store, linked as <folder>/<id>.wav and inserted in one transaction.
+def commit_uploads(entries, table, folder):
+    record_timestamp = int(time.time())
+    linked = []
+    # The format of the file is stored with the row, so it never has to be read from the file again
+    for entry in entries:
+        entry['columns'] = dict(entry.get('columns', {}), **audio_metadata(read_wav_header(entry['tmp'])))
+    with ingest_lock:
+        try:
+            with transaction() as db:
+                for entry in entries:
+                    # Rows inserted earlier in this transaction are found too, so duplicates within a batch are detected
+                    existing = db.execute(f'SELECT * FROM {table} WHERE checksum = ? LIMIT 1', (entry['checksum'],)).fetchone()
+                    if existing:
+                        os.remove(entry.pop('tmp'))
+                        entry.update(dict(existing), duplicate=True)
+                        continue
+                    entry['id'] = entry.get('id') or str(uuid.uuid4())
+                    entry.setdefault('recordTimestamp', record_timestamp)
+                    path = blob_path(entry['checksum'])
+                    if os.path.exists(path):
+                        os.remove(entry.pop('tmp'))
+                    else:
+                        os.replace(entry.pop('tmp'), path)
+                    os.link(path, os.path.join(folder, f"{entry['id']}.wav"))
+                    linked.append(entry)
+                    row = dict(entry.get('columns', {}), id=entry['id'], recordTimestamp=entry['recordTimestamp'],
+                               length=entry['length'], checksum=entry['checksum'])
+                    db.execute(f'''
+                        INSERT INTO {table} ({', '.join(row)})
+                        VALUES ({', '.join('?' * len(row))})
+                    ''', tuple(row.values()))
+                    add_reference(db, entry['checksum'], entry['size'])
+                    entry['duplicate'] = False
+        except Exception:
+            # The blobs stay, unreferenced blobs are removed by the reconciler
+            for entry in linked:
+                os.remove(os.path.join(folder, f"{entry['id']}.wav"))
+            raise
+    return entries
+
+# Public fields of a committed upload
+def upload_result(entry):
+    return {key: entry[key] for key in ('id', 'recordTimestamp', 'length', 'checksum', 'duplicate')}
+
+# Bring the blobs table and the blob folder in line with the rows
+# Reference counts are recounted from the tables, unreferenced blobs and stale temporary files are removed
+# tables is the list of tables referencing blobs, grace_period protects uploads that are in progress
+def reconcile_blobs(tables, grace_period):
+    db = get_db()
+    report = {'refCountsFixed': 0, 'removed': 0}
+    cursor = db.cursor()
+    cursor.row_factory = None
+    union = ' UNION ALL '.join(f'SELECT checksum FROM {table}' for table in tables)
+    counts = dict(cursor.execute(f'SELECT checksum, COUNT(*) FROM ({union}) WHERE checksum IS NOT NULL GROUP BY checksum'))
+    stored = dict(cursor.execute('SELECT checksum, refCount FROM blobs'))
+    cursor.close()
+
+    fixes = [(count, checksum) for checksum, count in counts.items() if checksum in stored and stored[checksum] != count]
+    unused = [checksum for checksum in stored if checksum not in counts]
+    report['refCountsFixed'] = len(fixes)
+    if fixes or unused:
+        with transaction():
+            db.executemany('UPDATE blobs SET refCount = ? WHERE checksum = ?', fixes)
+            db.executemany('DELETE FROM blobs WHERE checksum = ?', [(checksum,) for checksum in unused])
+
+    if not os.path.isdir(BLOB_FOLDER):
+        return report
+    now = time.time()
+    with os.scandir(BLOB_FOLDER) as files:
+        for entry in files:
+            if entry.name.startswith(UPLOAD_PREFIX):
+                stale = now - entry.stat().st_mtime > grace_period
+            else:
+                checksum = entry.name[:-4]
+                stale = checksum not in counts and now - entry.stat().st_mtime > grace_period
+            if stale:
+                os.remove(entry.path)
+                report['removed'] += 1
+    return report
+
+# Compute the checksum of all rows stored before content addressing and move their files into the blob store
+# A file whose content is already stored as a blob is replaced by a hard link to it, which frees its space
+# folders maps every table to the folder holding its audio files
+def deduplicate(folders):
+    db = get_db()
+    report = {'hashed': 0, 'linked': 0, 'bytesFreed': 0}
+    os.makedirs(BLOB_FOLDER, exist_ok=True)
+    for table, folder in folders.items():
+        for row in db.execute(f'SELECT id FROM {table} WHERE checksum IS NULL').fetchall():
+            # Hashing reads the whole file, it waits while a guest is on the phone
+            checkpoint('deduplicate')
+            file_path = os.path.join(folder, f"{row['id']}.wav")
+            if not os.path.exists(file_path):
+                continue
+            checksum = hash_file(file_path)
+            path = blob_path(checksum)
+            stat = os.stat(file_path)
+            with ingest_lock:
+                if not os.path.exists(path):
+                    os.link(file_path, path)
+                elif not os.path.samefile(path, file_path):
+                    # Swap the file for a link to the blob, the rename is atomic
+                    tmp_path = f"{file_path}{UPLOAD_PREFIX}{uuid.uuid4()}"
+                    os.link(path, tmp_path)
+                    os.replace(tmp_path, file_path)
+                    report['linked'] += 1
+                    report['bytesFreed'] += stat.st_size
+                with transaction():
+                    db.execute(f'UPDATE {table} SET checksum = ? WHERE id = ?', (checksum, row['id']))
+                    add_reference(db, checksum, stat.st_size)
+            report['hashed'] += 1
+    return report
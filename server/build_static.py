@@ -0,0 +1,156 @@
+# Build the static tree of the management UI for caching
+# Every asset (js, css, images) is copied as <name>.<hash>.<ext>, named after its content, and the
+# references in the HTML pages are rewritten to these names. A fingerprinted file never changes, so it
+# is served as immutable and a browser fetches it once. The pages keep their names and are revalidated
+# with their ETag on every navigation, which costs a 304 when nothing changed.
+# All text files additionally get precompressed .gz and .br variants, so neither nginx nor Flask
+# compress anything per request.
+# Usage (from the server directory): python3 build_static.py
+import argparse
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import time
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Source tree and the built tree served by nginx and Flask
+SOURCE_FOLDER = os.path.join(SERVER_DIR, 'static')
+BUILD_FOLDER = os.path.join(SERVER_DIR, 'static_build')
+
+# Length of the content hash in the file names
+HASH_LENGTH = 10
+
+# Matches the file names of fingerprinted assets, e.g. main.0123456789.js
+FINGERPRINT = re.compile(r'\.[0-9a-f]{%d}\.[^./]+$' % HASH_LENGTH)
+
+# Files that are precompressed
+COMPRESSED_EXTENSIONS = ('.html', '.js', '.css', '.json', '.svg', '.txt')
+
+# Files smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 256
+
+# src and href attributes pointing to local files, absolute URLs and anchors are left alone
+REFERENCE = re.compile(r'(?P<attribute>\b(?:src|href)=")(?P<path>(?![a-z]+:|//|#)[^"?#]+)(?P<rest>[^"]*")')
+
+# Name of the fingerprinted copy of a file
+def fingerprinted_name(relative_path, content):
+    stem, extension = os.path.splitext(relative_path)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{extension}"
+
+# Rewrite the references of a page to the fingerprinted assets
+# Paths are resolved relative to the page, /static/ paths relative to the tree
+def rewrite_references(html, page, assets):
+    page_dir = os.path.dirname(page)
+
+    def replace(match):
+        path = match.group('path')
+        if path.startswith('/static/'):
+            relative_path = path[len('/static/'):]
+            prefix = '/static/'
+        elif path.startswith('/'):
+            return match.group(0)
+        else:
+            relative_path = os.path.normpath(os.path.join(page_dir, path)).replace(os.sep, '/')
+            prefix = ''
+        if relative_path not in assets:
+            return match.group(0)
+        target = assets[relative_path]
+        if not prefix:
+            target = os.path.relpath(target, page_dir or '.').replace(os.sep, '/')
+        return f"{match.group('attribute')}{prefix}{target}{match.group('rest')}"
+
+    return REFERENCE.sub(replace, html)
+
+# Brotli is optional, without it only gzip variants are built
+def brotli_compress(content):
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(content, quality=11)
+
+# Write the .gz and .br variants next to a file if they are smaller than the file
+# Returns the sizes of the written variants
+def write_compressed(file_path, content, previous_path):
+    sizes = {}
+    if not file_path.endswith(COMPRESSED_EXTENSIONS) or len(content) < MIN_COMPRESS_SIZE:
+        return sizes
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0), '.br': brotli_compress(content)}
+    for suffix, compressed in variants.items():
+        if compressed is not None and len(compressed) < len(content):
+            write_file(file_path + suffix, compressed, previous_path + suffix)
+            sizes[suffix] = len(compressed)
+    return sizes
+
+# Write a file of the build
+# A file whose content did not change since the previous build keeps its modification time, the ETags
+# of nginx and Flask are derived from it, so browsers only fetch the files that really changed
+def write_file(file_path, content, previous_path):
+    with open(file_path, 'wb') as f:
+        f.write(content)
+    try:
+        with open(previous_path, 'rb') as f:
+            unchanged = f.read() == content
+    except OSError:
+        unchanged = False
+    if unchanged:
+        stat = os.stat(previous_path)
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+# Build the tree into output
+# Every file is also kept under its original name, so assets that are loaded by scripts keep working
+# The tree is built next to the output and swapped in at the end, a running server never sees half a build
+# Returns a report with the number of files and the bytes of the plain and the compressed files
+def build(source=SOURCE_FOLDER, output=BUILD_FOLDER):
+    started = time.perf_counter()
+    staging = output + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    files = {}
+    for directory, _, names in os.walk(source):
+        for name in names:
+            path = os.path.join(directory, name)
+            relative_path = os.path.relpath(path, source).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                files[relative_path] = f.read()
+
+    assets = {path: fingerprinted_name(path, content) for path, content in files.items() if not path.endswith('.html')}
+    outputs = {}
+    for path, content in files.items():
+        if path.endswith('.html'):
+            content = rewrite_references(content.decode('utf-8'), path, assets).encode('utf-8')
+        else:
+            outputs[assets[path]] = content
+        outputs[path] = content
+
+    report = {'files': len(files), 'fingerprinted': len(assets), 'bytes': 0, '.gz': 0, '.br': 0}
+    for path, content in outputs.items():
+        file_path = os.path.join(staging, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        write_file(file_path, content, os.path.join(output, path))
+        report['bytes'] += len(content)
+        for suffix, size in write_compressed(file_path, content, os.path.join(output, path)).items():
+            report[suffix] += size
+
+    previous = output + '.old'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(output):
+        os.replace(output, previous)
+    os.replace(staging, output)
+    shutil.rmtree(previous, ignore_errors=True)
+    report['durationMs'] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Fingerprint and precompress the static files of the management UI')
+    parser.add_argument('--source', default=SOURCE_FOLDER)
+    parser.add_argument('--output', default=BUILD_FOLDER)
+    args = parser.parse_args()
+    report = build(args.source, args.output)
+    print(f"Built {report['files']} files ({report['fingerprinted']} fingerprinted) into {args.output} in {report['durationMs']} ms")
+    print(f"{report['bytes']} bytes, {report['.gz']} bytes gzip, {report['.br']} bytes brotli")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import os
+import json
+from database import get_db, query_db, transaction
+from blob_store import BLOB_FOLDER, release_references
+
+# Raised when a bulk request does not select records in a valid way
+class BulkError(Exception):
+    pass
+
+# Build the WHERE clause for a bulk request
+# Records are selected by a list of ids, by a recordTimestamp range (from/to, inclusive) or by both.
+# An empty selection is rejected so a request can never match every record by accident.
+# The ids are passed as a single JSON parameter, so any number of ids fits into one statement.
+def build_selection(body):
+    if not isinstance(body, dict):
+        raise BulkError('Expected a JSON object')
+    clauses = []
+    args = []
+    ids = body.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(record_id, str) for record_id in ids):
+            raise BulkError('ids must be a list of strings')
+        clauses.append('id IN (SELECT value FROM json_each(?))')
+        args.append(json.dumps(ids))
+    for key, operator in (('from', '>='), ('to', '<=')):
+        value = body.get(key)
+        if value is None:
+            continue
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise BulkError(f'{key} must be a unix timestamp in seconds')
+        clauses.append(f'recordTimestamp {operator} ?')
+        args.append(value)
+    if not clauses:
+        raise BulkError('Select records with ids and/or a from/to range')
+    return ' AND '.join(clauses), args
+
+# Get the rows of all selected records
+def bulk_get(table, body):
+    where, args = build_selection(body)
+    return query_db(f'SELECT * FROM {table} WHERE {where} ORDER BY recordTimestamp', args)
+
+# Delete the rows of the selected records in a single transaction
+# A tombstone is written for every deleted row in the same transaction, so a file whose unlink is
+# interrupted by a crash is removed on the next start instead of being re-imported by the reconciler.
+# The references of the rows to their blobs are released, blobs that are no longer used get a tombstone too.
+# Returns the ids of the deleted rows and the checksums of the unused blobs
+def delete_rows(table, where, args):
+    with transaction() as db:
+        cursor = db.cursor()
+        cursor.row_factory = None
+        rows = cursor.execute(f'SELECT id, checksum FROM {table} WHERE {where}', args).fetchall()
+        ids = [row[0] for row in rows]
+        cursor.executemany('INSERT OR IGNORE INTO tombstones (folder, id) VALUES (?, ?)', [(table, record_id) for record_id in ids])
+        cursor.execute(f'DELETE FROM {table} WHERE {where}', args)
+        unused_blobs = release_references(cursor, [row[1] for row in rows if row[1] is not None])
+    return ids, unused_blobs
+
+# Remove the files of deleted records and then their tombstones
+def unlink_files(table, folder, ids):
+    for record_id in ids:
+        try:
+            os.remove(os.path.join(folder, f"{record_id}.wav"))
+        except FileNotFoundError:
+            pass
+    with transaction() as db:
+        db.executemany('DELETE FROM tombstones WHERE folder = ? AND id = ?', [(table, record_id) for record_id in ids])
+
+# Delete the selected records, first the rows and then the files and the blobs no longer used
+# Returns the ids of the deleted records
+def delete_records(table, folder, where, args):
+    ids, unused_blobs = delete_rows(table, where, args)
+    if ids:
+        unlink_files(table, folder, ids)
+    if unused_blobs:
+        unlink_files('blobs', BLOB_FOLDER, unused_blobs)
+    return ids
+
+# Delete all records selected by a bulk request
+# Returns the ids of the deleted records
+def bulk_delete(table, folder, body):
+    where, args = build_selection(body)
+    return delete_records(table, folder, where, args)
+
+# Remove the files of all tombstones left behind by an interrupted delete
+# folders maps every table, and blobs, to the folder holding its files
+# Returns the number of purged tombstones
+def purge_tombstones(folders):
+    cursor = get_db().cursor()
+    cursor.row_factory = None
+    tombstones = cursor.execute('SELECT folder, id FROM tombstones').fetchall()
+    cursor.close()
+    for table, folder in folders.items():
+        ids = [record_id for tombstone_table, record_id in tombstones if tombstone_table == table]
+        if ids:
+            unlink_files(table, folder, ids)
+    return len(tombstones)
@@ -0,0 +1,36 @@
+import json
+from websocket_utils import subscribe
+from metrics import CAPTURE_RECORDINGS, CAPTURE_XRUNS, CAPTURE_DROPPED_FRAMES, CAPTURE_DURATION_MISMATCH, CAPTURE_FAILURES
+
+# Health of the capture pipeline of the interfaces
+# Every upload carries the capture report of its recorder next to the level quality (see interface/capture.py):
+# the overruns arecord reported, the frames they dropped and the time of the call that is missing from the file.
+# They are stored with the record and counted per device here, so a regression after a change of the period or
+# buffer time, or a failing sound card, shows up in the metrics. An interface whose recorder exits right after
+# the start reports it with STATUS:CAPTURE_FAILED:<json>.
+
+# Label of recordings and failures of interfaces without a device id
+NO_DEVICE = ''
+
+# Count a stored recording, quality are the columns parsed from its quality JSON
+def count_recording(device_id, quality):
+    device = device_id or NO_DEVICE
+    for flag in (quality.get('quality') or 'ok').split(','):
+        CAPTURE_RECORDINGS.inc(1, device, flag)
+    if quality.get('xruns'):
+        CAPTURE_XRUNS.inc(quality['xruns'], device)
+    if quality.get('droppedFrames'):
+        CAPTURE_DROPPED_FRAMES.inc(quality['droppedFrames'], device)
+    if quality.get('durationMismatchMs') is not None:
+        # A file longer than the call (the clocks differ slightly) is nothing missing
+        CAPTURE_DURATION_MISMATCH.observe(max(quality['durationMismatchMs'], 0) / 1000, device)
+
+def record_failure(status, device_id):
+    try:
+        failure = json.loads(status)
+    except ValueError:
+        failure = status
+    print(f"Recorder of {device_id or 'the interface'} failed: {failure}")
+    CAPTURE_FAILURES.inc(1, device_id or NO_DEVICE)
+
+subscribe('STATUS:CAPTURE_FAILED:', record_failure)
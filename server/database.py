@@ -1,5 +1,7 @@
 import sqlite3
+from contextlib import contextmanager
 from flask import g
+from metrics import DB_LATENCY, timed
 
 # Database file
 DATABASE = 'database.db'
@@ -15,61 +17,51 @@ def get_db():
         db.row_factory = sqlite3.Row  # To return rows as dictionaries
     return db
 
+# Add a column to an existing table unless it is there already
+def add_column(cursor, table, column, definition):
+    columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()]
+    if column not in columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
 # Initialize the database
-# Create tables if they do not exist
+# Brings the schema up to date by running the pending migrations, see migrations.py
 def init_db():
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS records (
-            id TEXT PRIMARY KEY,
-            recordTimestamp INTEGER,
-            length INTEGER
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id TEXT PRIMARY KEY,
-            recordTimestamp INTEGER,
-            length INTEGER
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS config (
-            id INTEGER PRIMARY KEY,
-            autoRing BOOLEAN DEFAULT 0,
-            autoRingMinSpan INTEGER DEFAULT 60,
-            autoRingMaxSpan INTEGER DEFAULT 600,
-            ringOnTime INTEGER DEFAULT 1,
-            ringOffTime INTEGER DEFAULT 1,
-            messages BOOLEAN DEFAULT 1,
-            randomMessages BOOLEAN DEFAULT 1,
-            ringCount INTEGER DEFAULT 4
-        )
-    ''')
-    cursor.execute('''
-        INSERT OR IGNORE INTO config (id) VALUES (1)
-    ''')
-    db.commit()
+    from migrations import migrate
+    migrate(get_db())
 
 # Query the database
 # Return the result of the query
 # If one is set to True, return the first result
 # If one is set to False, return all results
 def query_db(query, args=(), one=False):
-    cur = get_db().execute(query, args)
-    rv = cur.fetchall()
-    cur.close()
+    with timed(DB_LATENCY, 'query'):
+        cur = get_db().execute(query, args)
+        rv = cur.fetchall()
+        cur.close()
     return (rv[0] if rv else None) if one else rv
 
 # Execute DB action
 def execute_db(query, args=()):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute(query, args)
-    db.commit()
+    with timed(DB_LATENCY, 'execute'):
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute(query, args)
+        db.commit()
     return cursor
 
+# Run several statements in one transaction
+# The changes are committed when the block finishes and rolled back if it raises
+@contextmanager
+def transaction():
+    db = get_db()
+    with timed(DB_LATENCY, 'transaction'):
+        try:
+            yield db
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
 # Close the database connection
 # If the connection exists, close it
 def close_connection(exception):
@@ -0,0 +1,104 @@
+import json
+import time
+import threading
+from database import query_db, execute_db
+from websocket_utils import subscribe, register_device, unregister_device, devices as connected
+from scheduler import end_call
+
+# Registry of the phone interfaces
+# Every interface that opened /socket?device=<id> is stored in the devices table, so it can be named and
+# configured while it is offline. Its configuration only holds the settings that differ from the default
+# configuration (the config row with id 1), everything else is inherited and follows changes of the default.
+# Interfaces without a device id, e.g. older versions, get the default configuration and are not registered.
+
+# Live state of the connected interfaces by device id: connectedAt and the last reported hook state
+live = {}
+live_lock = threading.Lock()
+
+# Hook states reported by the interface as STATUS:<state>
+HOOK_STATES = ('ON_HOOK', 'OFF_HOOK', 'RINGING')
+
+# Register an interface that connected to /socket
+def connect(device_id, conn):
+    now = int(time.time())
+    execute_db('''
+        INSERT INTO devices (id, firstSeen, lastSeen) VALUES (?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET lastSeen = excluded.lastSeen
+    ''', (device_id, now, now))
+    with live_lock:
+        live[device_id] = {'connectedAt': now, 'state': None}
+    register_device(device_id, conn)
+    print(f"Device {device_id} connected")
+
+# Forget the connection of an interface, the device stays registered
+def disconnect(device_id, conn):
+    unregister_device(device_id, conn)
+    if device_id in connected:
+        # The interface already reconnected on another connection
+        return
+    with live_lock:
+        live.pop(device_id, None)
+    # A call the interface was in when it disconnected no longer holds back the background work
+    end_call(device_id)
+    execute_db('UPDATE devices SET lastSeen = ? WHERE id = ?', (int(time.time()), device_id))
+    print(f"Device {device_id} disconnected")
+
+# Keep the last hook state of every interface
+def remember_state(status, device_id):
+    if device_id is None or status not in HOOK_STATES:
+        return
+    with live_lock:
+        if device_id in live:
+            live[device_id]['state'] = status
+
+subscribe('STATUS:', remember_state)
+
+# Settings of a device that differ from the default configuration
+def load_overrides(device_id):
+    row = query_db('SELECT config FROM devices WHERE id = ?', (device_id,), one=True)
+    return json.loads(row['config']) if row and row['config'] else {}
+
+def save_overrides(device_id, overrides):
+    execute_db('UPDATE devices SET config = ? WHERE id = ?', (json.dumps(overrides) if overrides else None, device_id))
+
+# The default configuration
+def default_config():
+    config = dict(query_db('SELECT * FROM config WHERE id = 1', one=True))
+    config.pop('id', None)
+    return config
+
+# The configuration of a device, the default configuration with the settings of the device applied
+# Without a device id, or for an unknown one, this is the default configuration
+def effective_config(device_id=None):
+    config = default_config()
+    if device_id:
+        config.update(load_overrides(device_id))
+    return config
+
+# A devices row with its overrides parsed and its live state
+def describe(row):
+    device = dict(row)
+    device['config'] = json.loads(device['config']) if device['config'] else {}
+    with live_lock:
+        state = dict(live.get(device['id'], {}))
+    device['online'] = device['id'] in connected
+    device['connectedAt'] = state.get('connectedAt')
+    device['state'] = state.get('state')
+    return device
+
+# A registered device, None if it is not registered
+def get_device(device_id):
+    row = query_db('''
+        SELECT d.*, (SELECT COUNT(*) FROM records r WHERE r.deviceId = d.id) AS records
+        FROM devices d WHERE d.id = ?
+    ''', (device_id,), one=True)
+    return describe(row) if row else None
+
+# All registered devices, the online ones first
+def list_devices():
+    rows = query_db('''
+        SELECT d.*, COUNT(r.id) AS records
+        FROM devices d LEFT JOIN records r ON r.deviceId = d.id
+        GROUP BY d.id ORDER BY d.id
+    ''')
+    return sorted((describe(row) for row in rows), key=lambda device: not device['online'])
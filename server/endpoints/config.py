@@ -1,8 +1,12 @@
 from flask import Blueprint, request, jsonify
+import re
 import json
-from database import query_db, execute_db
-from flasgger import swag_from
-from websocket_utils import broadcast
+import time
+from database import execute_db
+from apidocs import swag_from
+from websocket_utils import broadcast, subscribe
+from message_selector import MODES
+from devices import effective_config, default_config
 
 config_bp = Blueprint('config', __name__)
 
@@ -10,16 +14,50 @@ DEFAULT_CONFIG = {
     "autoRing": False,
     "autoRingMinSpan": 60,
     "autoRingMaxSpan": 600,
+    "autoRingQuietStart": None,
+    "autoRingQuietEnd": None,
     "ringOnTime": 1,
     "ringOffTime": 1,
     "messages": True,
     "randomMessages": True,
-    "ringCount": 4
+    "messageMode": None,
+    "ringCount": 4,
+    "capturePeriodTime": None,
+    "captureBufferTime": None
 }
 
+# Next automated ring as last reported by every interface via STATUS:NEXT_RING, by device id
+# Interfaces without a device id are kept under None
+next_rings = {}
+
+def remember_next_ring(status, device_id):
+    next_rings[device_id] = dict(json.loads(status), reportedAt=int(time.time()))
+
+subscribe('STATUS:NEXT_RING:', remember_next_ring)
+
+# Report of the next ring of a device, or the earliest planned ring of all interfaces
+def get_next_ring_report(device_id=None):
+    empty = {'nextRing': None, 'quiet': False, 'reportedAt': None}
+    if device_id is not None:
+        return dict(next_rings.get(device_id, empty), deviceId=device_id)
+    planned = [(report['nextRing'], device) for device, report in list(next_rings.items()) if report.get('nextRing')]
+    if planned:
+        device = min(planned, key=lambda entry: entry[0])[1]
+        return dict(next_rings[device], deviceId=device)
+    return dict(empty, deviceId=None)
+
+# Time of day in the format HH:MM
+TIME_OF_DAY = re.compile(r'^([01][0-9]|2[0-3]):[0-5][0-9]$')
+
+# Allowed period and buffer time of arecord in microseconds, null keeps the defaults of ALSA
+CAPTURE_TIMES = {'capturePeriodTime': (1000, 500000), 'captureBufferTime': (2000, 2000000)}
+
 def validate_config(data):
     errors = []
 
+    if not isinstance(data, dict):
+        return ['The configuration must be an object']
+
     if 'autoRing' in data and not isinstance(data['autoRing'], bool):
         errors.append("'autoRing' must be a boolean")
     if 'autoRingMinSpan' in data:
@@ -36,18 +74,45 @@ def validate_config(data):
     if 'ringOffTime' in data:
         if not isinstance(data['ringOffTime'], int) or not (1 <= data['ringOffTime'] <= 30):
             errors.append("'ringOffTime' must be an integer between 1 and 30")
-    if 'messages' in data and not isinstance(data['randomMessages'], bool):
+    if 'messages' in data and not isinstance(data['messages'], bool):
         errors.append("'messages' must be a boolean")
     if 'randomMessages' in data and not isinstance(data['randomMessages'], bool):
         errors.append("'randomMessages' must be a boolean")
     if 'ringCount' in data:
         if not isinstance(data['ringCount'], int) or not (1 <= data['ringCount'] <= 10):
             errors.append("'ringCount' must be an integer between 1 and 10")
+    for key in ('autoRingQuietStart', 'autoRingQuietEnd'):
+        if key in data and data[key] is not None and not (isinstance(data[key], str) and TIME_OF_DAY.match(data[key])):
+            errors.append(f"'{key}' must be a time of day as HH:MM or null")
+    if 'messageMode' in data and data['messageMode'] is not None and data['messageMode'] not in MODES:
+        errors.append(f"'messageMode' must be one of {', '.join(MODES)}")
+    for key, (low, high) in CAPTURE_TIMES.items():
+        if key in data and data[key] is not None and (isinstance(data[key], bool) or not isinstance(data[key], int) or not (low <= data[key] <= high)):
+            errors.append(f"'{key}' must be an integer between {low} and {high} microseconds or null")
 
     return errors
 
+# Check the settings that depend on each other once an update is applied to the configuration
+def validate_merged(config):
+    errors = []
+    if config['autoRingMinSpan'] > config['autoRingMaxSpan']:
+        errors.append("'autoRingMinSpan' must be less than or equal to 'autoRingMaxSpan'")
+    # ALSA needs at least two periods in the buffer
+    if config['capturePeriodTime'] and config['captureBufferTime'] and config['captureBufferTime'] < 2 * config['capturePeriodTime']:
+        errors.append("'captureBufferTime' must be at least twice 'capturePeriodTime'")
+    return errors
+
 @config_bp.route('/config', methods=['GET'])
 @swag_from({
+    'parameters': [
+        {
+            'name': 'device',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Id of a phone interface, its own settings are applied to the default configuration'
+        }
+    ],
     'responses': {
         200: {
             'description': 'Configuration object',
@@ -57,11 +122,16 @@ def validate_config(data):
                     'autoRing': {'type': 'boolean'},
                     'autoRingMinSpan': {'type': 'integer'},
                     'autoRingMaxSpan': {'type': 'integer'},
+                    'autoRingQuietStart': {'type': 'string', 'example': '22:00'},
+                    'autoRingQuietEnd': {'type': 'string', 'example': '08:00'},
                     'ringOnTime': {'type': 'integer'},
                     'ringOffTime': {'type': 'integer'},
                     'messages': {'type': 'boolean'},
                     'randomMessages': {'type': 'boolean'},
-                    'ringCount': {'type': 'integer'}
+                    'messageMode': {'type': 'string', 'enum': list(MODES)},
+                    'ringCount': {'type': 'integer'},
+                    'capturePeriodTime': {'type': 'integer', 'description': 'Period time of arecord in microseconds, null for the default'},
+                    'captureBufferTime': {'type': 'integer', 'description': 'Buffer time of arecord in microseconds, null for the default'}
                 }
             }
         }
@@ -69,10 +139,7 @@ def validate_config(data):
     'tags': ['config']
 })
 def get_config():
-    config = query_db('SELECT * FROM config WHERE id = 1', one=True)
-    config_dict = dict(config)
-    config_dict.pop('id', None)  # Remove the 'id' field from the dictionary
-    return jsonify(config_dict), 200
+    return jsonify(effective_config(request.args.get('device'))), 200
 
 @config_bp.route('/config', methods=['PUT', 'PATCH'])
 @swag_from({
@@ -85,11 +152,16 @@ def get_config():
                     'autoRing': {'type': 'boolean'},
                     'autoRingMinSpan': {'type': 'integer'},
                     'autoRingMaxSpan': {'type': 'integer'},
+                    'autoRingQuietStart': {'type': 'string', 'example': '22:00'},
+                    'autoRingQuietEnd': {'type': 'string', 'example': '08:00'},
                     'ringOnTime': {'type': 'integer'},
                     'ringOffTime': {'type': 'integer'},
                     'messages': {'type': 'boolean'},
                     'randomMessages': {'type': 'boolean'},
-                    'ringCount': {'type': 'integer'}
+                    'messageMode': {'type': 'string', 'enum': list(MODES)},
+                    'ringCount': {'type': 'integer'},
+                    'capturePeriodTime': {'type': 'integer', 'description': 'Period time of arecord in microseconds, null for the default'},
+                    'captureBufferTime': {'type': 'integer', 'description': 'Buffer time of arecord in microseconds, null for the default'}
                 }
             }
         },
@@ -113,11 +185,16 @@ def get_config():
                     'autoRing': {'type': 'boolean'},
                     'autoRingMinSpan': {'type': 'integer'},
                     'autoRingMaxSpan': {'type': 'integer'},
+                    'autoRingQuietStart': {'type': 'string', 'example': '22:00'},
+                    'autoRingQuietEnd': {'type': 'string', 'example': '08:00'},
                     'ringOnTime': {'type': 'integer'},
                     'ringOffTime': {'type': 'integer'},
                     'messages': {'type': 'boolean'},
                     'randomMessages': {'type': 'boolean'},
-                    'ringCount': {'type': 'integer'}
+                    'messageMode': {'type': 'string', 'enum': list(MODES)},
+                    'ringCount': {'type': 'integer'},
+                    'capturePeriodTime': {'type': 'integer', 'description': 'Period time of arecord in microseconds, null for the default'},
+                    'captureBufferTime': {'type': 'integer', 'description': 'Buffer time of arecord in microseconds, null for the default'}
                 }
             }
         }
@@ -131,31 +208,74 @@ def update_config():
     if errors:
         return jsonify({'errors': errors}), 400
 
-    current_config = query_db('SELECT * FROM config WHERE id = 1', one=True)
-    current_config = dict(current_config)
+    current_config = default_config()
 
     # Update the current config with new values
     updated_config = {**current_config, **data}
+    # Keep randomMessages in line for interfaces that do not know messageMode
+    if data.get('messageMode') is not None and 'randomMessages' not in data:
+        updated_config['randomMessages'] = data['messageMode'] == 'random'
+    errors = validate_merged(updated_config)
+    if errors:
+        return jsonify({'errors': errors}), 400
 
     execute_db('''
         UPDATE config
-        SET autoRing = ?, autoRingMinSpan = ?, autoRingMaxSpan = ?, ringOnTime = ?, ringOffTime = ?, messages = ?, randomMessages = ?, ringCount = ?
+        SET autoRing = ?, autoRingMinSpan = ?, autoRingMaxSpan = ?, autoRingQuietStart = ?, autoRingQuietEnd = ?, ringOnTime = ?, ringOffTime = ?, messages = ?, randomMessages = ?, messageMode = ?, ringCount = ?, capturePeriodTime = ?, captureBufferTime = ?
         WHERE id = 1
     ''', (
         updated_config['autoRing'],
         updated_config['autoRingMinSpan'],
         updated_config['autoRingMaxSpan'],
+        updated_config['autoRingQuietStart'],
+        updated_config['autoRingQuietEnd'],
         updated_config['ringOnTime'],
         updated_config['ringOffTime'],
         updated_config['messages'],
         updated_config['randomMessages'],
-        updated_config['ringCount']
+        updated_config['messageMode'],
+        updated_config['ringCount'],
+        updated_config['capturePeriodTime'],
+        updated_config['captureBufferTime']
     ))
 
     # Once the config is updated, we need to send a new status via websocket
     # The message is "COMMAND:UPDATE_CONFIG", no additional data is needed
-    # The message should be sent to all connected clients
+    # The message should be sent to all connected clients, every interface inherits the default configuration
     broadcast('COMMAND:UPDATE_CONFIG')
 
-    updated_config.pop('id', None)  # Remove the 'id' field from the dictionary before returning
     return jsonify(updated_config), 200
+
+@config_bp.route('/config/nextRing', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve the next automated ring planned by an interface',
+    'description': 'The interfaces report their plan via STATUS:NEXT_RING whenever it changes. '
+                   'Without a device the earliest planned ring of all interfaces is returned. '
+                   'nextRing is null if automated ringing is disabled or the interface did not report yet.',
+    'parameters': [
+        {
+            'name': 'device',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Id of a phone interface'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Next automated ring',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'nextRing': {'type': 'integer', 'description': 'Seconds since the epoch'},
+                    'quiet': {'type': 'boolean', 'description': 'The ring was moved to the end of the quiet hours'},
+                    'reportedAt': {'type': 'integer'},
+                    'deviceId': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['config']
+})
+def get_next_ring():
+    return jsonify(get_next_ring_report(request.args.get('device'))), 200
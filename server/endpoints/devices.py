@@ -0,0 +1,215 @@
+from flask import Blueprint, request, jsonify
+import re
+from database import execute_db
+from apidocs import swag_from
+from websocket_utils import send_to_device, dispatch
+from devices import list_devices, get_device, load_overrides, save_overrides, effective_config
+from endpoints.config import validate_config, validate_merged, DEFAULT_CONFIG
+
+devices_bp = Blueprint('devices', __name__)
+
+# Commands that can be sent to a single interface, e.g. COMMAND:RING or COMMAND:START_PLAYBACK:<message id>
+COMMAND = re.compile(r'^COMMAND:[A-Z_]+(:[A-Za-z0-9._-]+)?$')
+
+DEVICE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'string'},
+        'name': {'type': 'string'},
+        'online': {'type': 'boolean'},
+        'state': {'type': 'string', 'enum': ['ON_HOOK', 'OFF_HOOK', 'RINGING']},
+        'connectedAt': {'type': 'integer'},
+        'firstSeen': {'type': 'integer'},
+        'lastSeen': {'type': 'integer'},
+        'records': {'type': 'integer'},
+        'config': {'type': 'object', 'description': 'Settings that differ from the default configuration'}
+    }
+}
+
+DEVICE_CONFIG_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'overrides': {'type': 'object', 'description': 'Settings of the device'},
+        'config': {'type': 'object', 'description': 'Default configuration with the settings of the device applied'}
+    }
+}
+
+ERROR_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'error': {'type': 'string'}
+    }
+}
+
+DEVICE_PARAMETER = {'name': 'device_id', 'in': 'path', 'type': 'string', 'required': True}
+
+@devices_bp.route('/devices', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve all phone interfaces that ever connected',
+    'description': 'An interface registers by opening /socket?device=<id>. The connected ones are listed first.',
+    'responses': {
+        200: {
+            'description': 'A list of devices',
+            'schema': {'type': 'array', 'items': DEVICE_SCHEMA}
+        }
+    },
+    'tags': ['devices']
+})
+def get_devices():
+    return jsonify(list_devices()), 200
+
+@devices_bp.route('/devices/<device_id>', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve a phone interface',
+    'parameters': [DEVICE_PARAMETER],
+    'responses': {
+        200: {'description': 'Device', 'schema': DEVICE_SCHEMA},
+        404: {'description': 'Device not found', 'schema': ERROR_SCHEMA}
+    },
+    'tags': ['devices']
+})
+def get_single_device(device_id):
+    device = get_device(device_id)
+    if device is None:
+        return jsonify({'error': 'Device not found'}), 404
+    return jsonify(device), 200
+
+@devices_bp.route('/devices/<device_id>', methods=['PATCH'])
+@swag_from({
+    'summary': 'Name a phone interface, e.g. after the spot it stands at',
+    'parameters': [
+        DEVICE_PARAMETER,
+        {
+            'name': 'body',
+            'in': 'body',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string', 'example': 'Next to the bar'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {'description': 'Updated device', 'schema': DEVICE_SCHEMA},
+        400: {'description': 'Invalid name', 'schema': ERROR_SCHEMA},
+        404: {'description': 'Device not found', 'schema': ERROR_SCHEMA}
+    },
+    'tags': ['devices']
+})
+def update_device(device_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not (data.get('name') is None or isinstance(data['name'], str)):
+        return jsonify({'error': "'name' must be a string or null"}), 400
+    if get_device(device_id) is None:
+        return jsonify({'error': 'Device not found'}), 404
+    execute_db('UPDATE devices SET name = ? WHERE id = ?', (data.get('name') or None, device_id))
+    return jsonify(get_device(device_id)), 200
+
+@devices_bp.route('/devices/<device_id>/config', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve the settings of a phone interface',
+    'parameters': [DEVICE_PARAMETER],
+    'responses': {
+        200: {'description': 'Settings of the device and the resulting configuration', 'schema': DEVICE_CONFIG_SCHEMA},
+        404: {'description': 'Device not found', 'schema': ERROR_SCHEMA}
+    },
+    'tags': ['devices']
+})
+def get_device_config(device_id):
+    if get_device(device_id) is None:
+        return jsonify({'error': 'Device not found'}), 404
+    return jsonify({'overrides': load_overrides(device_id), 'config': effective_config(device_id)}), 200
+
+# PUT replaces the settings of the device, PATCH adds to them and DELETE removes them all
+# Settings that are not set by the device are inherited from the default configuration (PUT /config)
+@devices_bp.route('/devices/<device_id>/config', methods=['PUT', 'PATCH', 'DELETE'])
+@swag_from({
+    'summary': 'Change the settings of a phone interface',
+    'description': 'PUT replaces the settings of the device, PATCH adds to them and DELETE removes them all. '
+                   'Everything the device does not set is inherited from the default configuration. '
+                   'The interface is told to fetch its configuration again if it is connected.',
+    'parameters': [
+        DEVICE_PARAMETER,
+        {
+            'name': 'body',
+            'in': 'body',
+            'schema': {
+                'type': 'object',
+                'description': 'Any settings of the configuration, see PUT /config',
+                'example': {'ringCount': 2, 'autoRing': True}
+            }
+        }
+    ],
+    'responses': {
+        200: {'description': 'Settings of the device and the resulting configuration', 'schema': DEVICE_CONFIG_SCHEMA},
+        400: {
+            'description': 'Validation error',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'errors': {'type': 'array', 'items': {'type': 'string'}}
+                }
+            }
+        },
+        404: {'description': 'Device not found', 'schema': ERROR_SCHEMA}
+    },
+    'tags': ['devices']
+})
+def update_device_config(device_id):
+    if get_device(device_id) is None:
+        return jsonify({'error': 'Device not found'}), 404
+    if request.method == 'DELETE':
+        overrides = {}
+    else:
+        data = request.get_json(silent=True)
+        errors = validate_config(data)
+        if not errors:
+            errors = [f"'{key}' is not a setting" for key in data if key not in DEFAULT_CONFIG]
+        if errors:
+            return jsonify({'errors': errors}), 400
+        overrides = {**load_overrides(device_id), **data} if request.method == 'PATCH' else data
+        errors = validate_merged({**effective_config(), **overrides})
+        if errors:
+            return jsonify({'errors': errors}), 400
+    save_overrides(device_id, overrides)
+    send_to_device(device_id, 'COMMAND:UPDATE_CONFIG')
+    return jsonify({'overrides': overrides, 'config': effective_config(device_id)}), 200
+
+@devices_bp.route('/devices/<device_id>/command', methods=['POST'])
+@swag_from({
+    'summary': 'Send a command to a single phone interface',
+    'description': 'The same as sending DEVICE:<id>:<command> over the websocket, see the debug page for the commands.',
+    'parameters': [
+        DEVICE_PARAMETER,
+        {
+            'name': 'body',
+            'in': 'body',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'command': {'type': 'string', 'example': 'COMMAND:RING'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        202: {'description': 'Command sent'},
+        400: {'description': 'Invalid command', 'schema': ERROR_SCHEMA},
+        404: {'description': 'Device not found', 'schema': ERROR_SCHEMA},
+        409: {'description': 'Device is not connected', 'schema': ERROR_SCHEMA}
+    },
+    'tags': ['devices']
+})
+def send_command(device_id):
+    data = request.get_json(silent=True)
+    command = data.get('command') if isinstance(data, dict) else None
+    if not isinstance(command, str) or not COMMAND.match(command):
+        return jsonify({'error': "'command' must be a command like COMMAND:RING"}), 400
+    if get_device(device_id) is None:
+        return jsonify({'error': 'Device not found'}), 404
+    if not send_to_device(device_id, command):
+        return jsonify({'error': 'Device is not connected'}), 409
+    # The server keeps track of the command as if it was sent over the websocket, e.g. for the ring statistics
+    dispatch(command, device_id)
+    return jsonify({'deviceId': device_id, 'command': command}), 202
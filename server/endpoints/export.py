@@ -0,0 +1,154 @@
+from flask import Blueprint, request, jsonify
+from apidocs import swag_from
+from export import start_export, get_status, journal_summary, forget_volume, ExportError, ExportRunning
+
+export_bp = Blueprint('export', __name__)
+
+# Mount point of the USB stick used by system/automount.sh
+DEFAULT_MOUNT_POINT = '/mnt/usb'
+
+STATUS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'state': {'type': 'string', 'enum': ['idle', 'queued', 'running', 'finished', 'failed']},
+        'job': {'type': 'integer', 'description': 'Id of the job in the scheduler, see GET /scheduler'},
+        'volume': {'type': 'string'},
+        'mountPoint': {'type': 'string'},
+        'total': {'type': 'integer'},
+        'done': {'type': 'integer'},
+        'bytes': {'type': 'integer'},
+        'failed': {'type': 'array', 'items': {'type': 'object'}},
+        'error': {'type': 'string'},
+        'startedAt': {'type': 'integer'},
+        'finishedAt': {'type': 'integer'}
+    }
+}
+
+@export_bp.route('/export', methods=['POST'])
+@swag_from({
+    'summary': 'Export new recordings to a USB stick',
+    'description': 'Copies every record that is not in the export journal of the volume yet. '
+                   'The export runs in the background, its progress is sent as STATUS:EXPORT messages over the websocket. '
+                   'It waits while a guest is on the phone and pauses when a call starts.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'mountPoint': {'type': 'string', 'default': DEFAULT_MOUNT_POINT},
+                    'volume': {'type': 'string', 'description': 'Filesystem UUID of the volume, determined from the mount point if not set'},
+                    'full': {'type': 'boolean', 'default': False, 'description': 'Check every record again instead of only the new ones'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        202: {
+            'description': 'Export started',
+            'schema': STATUS_SCHEMA
+        },
+        400: {
+            'description': 'Nothing is mounted at the mount point or its volume could not be determined',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        409: {
+            'description': 'An export is already running',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['export']
+})
+def post_export():
+    data = request.get_json(silent=True) or {}
+    try:
+        status = start_export(data.get('mountPoint', DEFAULT_MOUNT_POINT), data.get('volume'), bool(data.get('full', False)))
+    except ExportRunning as e:
+        return jsonify({'error': str(e)}), 409
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(status), 202
+
+@export_bp.route('/export', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve the status of the current or last export',
+    'responses': {
+        200: {
+            'description': 'Export status',
+            'schema': STATUS_SCHEMA
+        }
+    },
+    'tags': ['export']
+})
+def get_export():
+    return jsonify(get_status()), 200
+
+@export_bp.route('/export/journal', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve the number of exported records per volume',
+    'responses': {
+        200: {
+            'description': 'Export journal summary',
+            'schema': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'volume': {'type': 'string'},
+                        'records': {'type': 'integer'},
+                        'lastExport': {'type': 'integer'}
+                    }
+                }
+            }
+        }
+    },
+    'tags': ['export']
+})
+def get_journal():
+    return jsonify(journal_summary()), 200
+
+@export_bp.route('/export/journal/<volume>', methods=['DELETE'])
+@swag_from({
+    'summary': 'Forget the export journal of a volume',
+    'description': 'The next export to the volume checks every record again, e.g. after the stick was wiped.',
+    'parameters': [
+        {
+            'name': 'volume',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'Filesystem UUID of the volume'
+        }
+    ],
+    'responses': {
+        204: {
+            'description': 'Journal removed'
+        },
+        404: {
+            'description': 'No journal for this volume',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['export']
+})
+def delete_journal(volume):
+    if forget_volume(volume):
+        return '', 204
+    return jsonify({'error': 'No journal for this volume'}), 404
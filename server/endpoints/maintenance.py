@@ -0,0 +1,104 @@
+from flask import Blueprint, jsonify
+from apidocs import swag_from
+from reconcile import reconcile, deduplicate_files
+from stats import backfill
+from scheduler import scheduler, NORMAL, LOW
+
+maintenance_bp = Blueprint('maintenance', __name__)
+
+# Seconds a request waits for its job, a job that is held back by a call is answered with 202
+JOB_WAIT = 30
+
+JOB_RESPONSE = {
+    'description': 'The job did not finish in time, e.g. because a guest is on the phone. Its result is listed by GET /scheduler.',
+    'schema': {
+        'type': 'object',
+        'properties': {
+            'id': {'type': 'integer'},
+            'task': {'type': 'string'},
+            'state': {'type': 'string', 'enum': ['queued', 'running', 'paused']}
+        }
+    }
+}
+
+# Run maintenance as a job of the scheduler, so it never competes with a call, see scheduler.py
+def run_job(task, fn, priority):
+    job = scheduler.submit(task, fn, priority)
+    if not job['done'].wait(JOB_WAIT):
+        return jsonify(scheduler.describe(job)), 202
+    if job['state'] == 'failed':
+        return jsonify({'error': job['error']}), 500
+    return jsonify(job['result']), 200
+
+@maintenance_bp.route('/maintenance/reconcile', methods=['POST'])
+@swag_from({
+    'summary': 'Reconcile the audio folders with the database',
+    'description': 'Re-imports audio files without a row and removes rows without an audio file. Unchanged files are skipped.',
+    'responses': {
+        200: {
+            'description': 'Reconciliation report',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'tombstonesPurged': {'type': 'integer'},
+                    'records': {'type': 'object'},
+                    'messages': {'type': 'object'},
+                    'blobs': {'type': 'object'},
+                    'durationMs': {'type': 'number'}
+                }
+            }
+        },
+        202: JOB_RESPONSE
+    },
+    'tags': ['maintenance']
+})
+def run_reconcile():
+    return run_job('reconcile', reconcile, NORMAL)
+
+
+@maintenance_bp.route('/maintenance/deduplicate', methods=['POST'])
+@swag_from({
+    'summary': 'Move audio files stored before content addressing into the blob store',
+    'description': 'Hashes every record and message without a checksum. Files with content that is already stored are replaced by a link to the stored copy. Reads every such file once, so it can take a while.',
+    'responses': {
+        200: {
+            'description': 'Deduplication report',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'hashed': {'type': 'integer'},
+                    'linked': {'type': 'integer'},
+                    'bytesFreed': {'type': 'integer'},
+                    'durationMs': {'type': 'number'}
+                }
+            }
+        },
+        202: JOB_RESPONSE
+    },
+    'tags': ['maintenance']
+})
+def run_deduplicate():
+    return run_job('deduplicate', deduplicate_files, LOW)
+
+@maintenance_bp.route('/maintenance/backfillStats', methods=['POST'])
+@swag_from({
+    'summary': 'Recompute the record statistics from the stored records',
+    'description': 'Counts the records and their length per hour again, e.g. for records stored before the statistics existed. '
+                   'The call statistics (pick ups and rings) can not be recovered and are kept.',
+    'responses': {
+        200: {
+            'description': 'Backfill report',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'hours': {'type': 'integer'},
+                    'durationMs': {'type': 'number'}
+                }
+            }
+        },
+        202: JOB_RESPONSE
+    },
+    'tags': ['maintenance']
+})
+def run_backfill_stats():
+    return run_job('backfillStats', backfill, NORMAL)
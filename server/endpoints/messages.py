@@ -1,11 +1,13 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, send_file
 import os
-import uuid
-import time
-from werkzeug.utils import secure_filename
-from audio_utils import allowed_file, get_audio_length, validate_audio
+from audio_utils import allowed_file, get_audio_length, validate_audio, public_row
 from database import query_db, execute_db
-from flasgger import swag_from
+from blob_store import receive, commit_uploads, upload_result
+from apidocs import swag_from
+from batch_upload import import_batch, BatchError
+from bulk import bulk_get, bulk_delete, delete_records, BulkError
+from message_selector import selector, mode_from_config, MODES
+from message_cache import message_cache
 import zipfile
 import io
 
@@ -30,6 +32,19 @@ if not os.path.exists(UPLOAD_FOLDER):
         }
     ],
     'responses': {
+        200: {
+            'description': 'The same audio is already stored, the existing record is returned with duplicate set to true',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'string'},
+                    'recordTimestamp': {'type': 'integer'},
+                    'length': {'type': 'integer'},
+                    'checksum': {'type': 'string'},
+                    'duplicate': {'type': 'boolean'}
+                }
+            }
+        },
         201: {
             'description': 'Record created successfully',
             'schema': {
@@ -37,7 +52,9 @@ if not os.path.exists(UPLOAD_FOLDER):
                 'properties': {
                     'id': {'type': 'string'},
                     'recordTimestamp': {'type': 'integer'},
-                    'length': {'type': 'integer'}
+                    'length': {'type': 'integer'},
+                    'checksum': {'type': 'string'},
+                    'duplicate': {'type': 'boolean'}
                 }
             }
         },
@@ -60,33 +77,104 @@ def create_record():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file_id = str(uuid.uuid4())
-        file_path = os.path.join(UPLOAD_FOLDER, f"{file_id}.wav")
-        file.save(file_path)
+        # The upload is hashed while it is written, content that is already stored is not stored again
+        tmp_path, checksum, size = receive(file.stream)
 
-        if not validate_audio(file_path):
-            os.remove(file_path)
+        if not validate_audio(tmp_path):
+            os.remove(tmp_path)
             return jsonify({'error': 'Audio file does not meet requirements (32-bit, 96KHz)'}), 400
 
         try:
-            length = get_audio_length(file_path)
+            length = get_audio_length(tmp_path)
         except Exception as e:
-            os.remove(file_path)
+            os.remove(tmp_path)
             return jsonify({'error': 'Invalid audio file'}), 400
 
-        record_timestamp = int(time.time())
-
-        execute_db('''
-            INSERT INTO messages (id, recordTimestamp, length)
-            VALUES (?, ?, ?)
-        ''', (file_id, record_timestamp, length))
+        entry = {'tmp': tmp_path, 'checksum': checksum, 'size': size, 'length': length}
+        commit_uploads([entry], 'messages', UPLOAD_FOLDER)
+        message_cache.invalidate([entry['id']])
+        if not entry['duplicate']:
+            selector.add(upload_result(entry))
 
-        return jsonify({'id': file_id, 'recordTimestamp': record_timestamp, 'length': length}), 201
+        return jsonify(upload_result(entry)), 200 if entry['duplicate'] else 201
     else:
         return jsonify({'error': 'File type not allowed'}), 400
 
 
+# Upload many .wav files, or zip archives of .wav files, in one request
+# Every file is reported individually, valid files are stored even if others in the batch are rejected
+@messages_bp.route('/messages/batch', methods=['POST'])
+@swag_from({
+    'summary': 'Upload several .wav files or zip archives and create a record for every valid file',
+    'consumes': ['multipart/form-data'],
+    'parameters': [
+        {
+            'name': 'files',
+            'in': 'formData',
+            'type': 'array',
+            'items': {'type': 'file'},
+            'collectionFormat': 'multi',
+            'required': True,
+            'description': 'The .wav files or .zip archives containing .wav files to upload'
+        }
+    ],
+    'responses': {
+        201: {
+            'description': 'At least one record was created, the result of every file is listed',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'batchId': {'type': 'string'},
+                    'created': {'type': 'integer'},
+                    'duplicates': {'type': 'integer'},
+                    'failed': {'type': 'integer'},
+                    'files': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'file': {'type': 'string'},
+                                'id': {'type': 'string'},
+                                'recordTimestamp': {'type': 'integer'},
+                                'length': {'type': 'integer'},
+                                'checksum': {'type': 'string'},
+                                'duplicate': {'type': 'boolean'},
+                                'error': {'type': 'string'}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'No files were sent, none of them was valid or the batch exceeded a limit',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['messages']
+})
+def create_records_batch():
+    uploads = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+    if not uploads:
+        return jsonify({'error': 'No file part'}), 400
+    try:
+        batch_id, results = import_batch(uploads, 'messages', UPLOAD_FOLDER)
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    stored = [result for result in results if 'id' in result]
+    created = [result for result in stored if not result['duplicate']]
+    message_cache.invalidate([result['id'] for result in stored])
+    for result in created:
+        selector.add(result)
+    body = {'batchId': batch_id, 'created': len(created), 'duplicates': len(stored) - len(created),
+            'failed': len(results) - len(stored), 'files': results}
+    return jsonify(body), 201 if stored else 400
+
 @messages_bp.route('/messages', methods=['GET'])
 @swag_from({
     'summary': 'Retrieve all messages',
@@ -100,7 +188,8 @@ def create_record():
                     'properties': {
                         'id': {'type': 'string'},
                         'recordTimestamp': {'type': 'integer'},
-                        'length': {'type': 'integer'}
+                        'length': {'type': 'integer'},
+                        'checksum': {'type': 'string'}
                     }
                 }
             }
@@ -110,7 +199,242 @@ def create_record():
 })
 def get_messages():
     messages = query_db('SELECT * FROM messages')
-    return jsonify([dict(record) for record in messages]), 200
+    return jsonify([public_row(record) for record in messages]), 200
+
+# Get several messages at once, selected by ids and/or a time range
+@messages_bp.route('/messages/bulkGet', methods=['POST'])
+@swag_from({
+    'summary': 'Retrieve all messages matching a list of ids and/or a time range',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'description': 'Select messages by ids, by a recordTimestamp range or both. from and to are inclusive unix timestamps in seconds.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'ids': {'type': 'array', 'items': {'type': 'string'}},
+                    'from': {'type': 'integer'},
+                    'to': {'type': 'integer'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'The matching messages, ordered by recordTimestamp',
+            'schema': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'id': {'type': 'string'},
+                        'recordTimestamp': {'type': 'integer'},
+                        'length': {'type': 'integer'},
+                        'checksum': {'type': 'string'}
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid selection',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['messages']
+})
+def bulk_get_records():
+    try:
+        records = bulk_get('messages', request.get_json(silent=True))
+    except BulkError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify([public_row(record) for record in records]), 200
+
+# Delete several messages at once, selected by ids and/or a time range
+# All rows are deleted in one transaction, the files are removed afterwards
+@messages_bp.route('/messages/bulkDelete', methods=['POST'])
+@swag_from({
+    'summary': 'Delete all messages matching a list of ids and/or a time range',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'description': 'Select messages by ids, by a recordTimestamp range or both. from and to are inclusive unix timestamps in seconds.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'ids': {'type': 'array', 'items': {'type': 'string'}},
+                    'from': {'type': 'integer'},
+                    'to': {'type': 'integer'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'The ids of the deleted messages',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'deleted': {'type': 'array', 'items': {'type': 'string'}}
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid selection',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['messages']
+})
+def bulk_delete_records():
+    try:
+        deleted = bulk_delete('messages', UPLOAD_FOLDER, request.get_json(silent=True))
+    except BulkError as e:
+        return jsonify({'error': str(e)}), 400
+    selector.remove(deleted)
+    message_cache.invalidate(deleted)
+    return jsonify({'deleted': deleted}), 200
+
+# Pick the message to play on a pickup
+# The interface only needs the id and the checksum, the binary is cached on its side by checksum
+@messages_bp.route('/messages/next', methods=['GET'])
+@swag_from({
+    'summary': 'Pick the next message to play',
+    'description': 'Picks a message without reading the database. The sequential position and the shuffle round are persisted, '
+                   'so they continue after a restart.',
+    'parameters': [
+        {
+            'name': 'mode',
+            'in': 'query',
+            'type': 'string',
+            'enum': list(MODES),
+            'required': False,
+            'description': 'How the message is picked, defaults to the messageMode of the config'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'The picked message',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'string'},
+                    'recordTimestamp': {'type': 'integer'},
+                    'length': {'type': 'integer'},
+                    'checksum': {'type': 'string'},
+                    'weight': {'type': 'number'},
+                    'mode': {'type': 'string'}
+                }
+            }
+        },
+        400: {
+            'description': 'Unknown mode',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        404: {
+            'description': 'There are no messages',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['messages']
+})
+def get_next_message():
+    mode = request.args.get('mode') or mode_from_config(query_db('SELECT * FROM config WHERE id = 1', one=True))
+    if mode not in MODES:
+        return jsonify({'error': f"Unknown mode, use one of {', '.join(MODES)}"}), 400
+    message = selector.next(mode)
+    if message is None:
+        return jsonify({'error': 'No messages available'}), 404
+    return jsonify(dict(message, mode=mode)), 200
+
+# Change how often a message is picked in the weighted mode
+@messages_bp.route('/messages/<record_id>/weight', methods=['PUT'])
+@swag_from({
+    'summary': 'Set the weight of a message for the weighted mode',
+    'parameters': [
+        {
+            'name': 'record_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'The ID of the message'
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'weight': {'type': 'number', 'description': 'Relative weight, 0 excludes the message from the weighted mode'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Weight updated',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'string'},
+                    'weight': {'type': 'number'}
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid weight',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        404: {
+            'description': 'Record not found',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['messages']
+})
+def set_message_weight(record_id):
+    data = request.get_json(silent=True) or {}
+    weight = data.get('weight')
+    if not isinstance(weight, (int, float)) or isinstance(weight, bool) or weight < 0:
+        return jsonify({'error': "'weight' must be a number greater than or equal to 0"}), 400
+    if execute_db('UPDATE messages SET weight = ? WHERE id = ?', (weight, record_id)).rowcount == 0:
+        return jsonify({'error': 'Record not found'}), 404
+    selector.set_weight(record_id, weight)
+    return jsonify({'id': record_id, 'weight': weight}), 200
 
 @messages_bp.route('/messages/<record_id>', methods=['DELETE'])
 @swag_from({
@@ -141,12 +465,10 @@ def get_messages():
     'tags': ['messages']
 })
 def delete_record(record_id):
-    record = query_db('SELECT * FROM messages WHERE id = ?', [record_id], one=True)
-    if record:
-        file_path = os.path.join(UPLOAD_FOLDER, f"{record_id}.wav")
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        execute_db('DELETE FROM messages WHERE id = ?', [record_id])
+    # The row is removed first and the file afterwards, a tombstone covers a crash in between
+    if delete_records('messages', UPLOAD_FOLDER, 'id = ?', [record_id]):
+        selector.remove([record_id])
+        message_cache.invalidate([record_id])
         return '', 204
     else:
         return jsonify({'error': 'Record not found'}), 404
@@ -171,7 +493,8 @@ def delete_record(record_id):
                 'properties': {
                     'id': {'type': 'string'},
                     'recordTimestamp': {'type': 'integer'},
-                    'length': {'type': 'integer'}
+                    'length': {'type': 'integer'},
+                    'checksum': {'type': 'string'}
                 }
             }
         },
@@ -190,13 +513,15 @@ def delete_record(record_id):
 def get_record(record_id):
     record = query_db('SELECT * FROM messages WHERE id = ?', [record_id], one=True)
     if record:
-        return jsonify(dict(record)), 200
+        return jsonify(public_row(record)), 200
     else:
         return jsonify({'error': 'Record not found'}), 404
 
 @messages_bp.route('/messages/<record_id>/binary', methods=['GET'])
 @swag_from({
     'summary': 'Retrieve the binary data of a record by ID',
+    'description': 'Messages are served from memory once they were read, see message_cache.py. Range requests and '
+                   'If-None-Match with the checksum are supported.',
     'parameters': [
         {
             'name': 'record_id',
@@ -213,6 +538,12 @@ def get_record(record_id):
                 'type': 'file'
             }
         },
+        206: {
+            'description': 'The requested range of the binary'
+        },
+        304: {
+            'description': 'The binary did not change'
+        },
         404: {
             'description': 'Record not found',
             'schema': {
@@ -221,17 +552,30 @@ def get_record(record_id):
                     'error': {'type': 'string'}
                 }
             }
+        },
+        416: {
+            'description': 'The requested range is outside of the binary'
         }
     },
     'tags': ['messages']
 })
 def get_record_binary(record_id):
-    record = query_db('SELECT * FROM messages WHERE id = ?', [record_id], one=True)
-    if record:
-        file_path = os.path.join(UPLOAD_FOLDER, f"{record_id}.wav")
-        return open(file_path, 'rb').read(), 200, {'Content-Type': 'audio/wav'}
-    else:
+    # The selector keeps the messages in memory, a cached message is served without reading the database or the file
+    message = selector.get(record_id)
+    if message is None:
         return jsonify({'error': 'Record not found'}), 404
+    data = message_cache.get(record_id, message['checksum'])
+    if data is None:
+        file_path = os.path.join(UPLOAD_FOLDER, f"{record_id}.wav")
+        if not os.path.exists(file_path):
+            return jsonify({'error': 'Record not found'}), 404
+        data = message_cache.load(record_id, message['checksum'], file_path)
+        if data is None:
+            # Too large for the cache, the file is streamed instead
+            return send_file(os.path.abspath(file_path), mimetype='audio/wav', etag=message['checksum'] or True)
+    response = Response(data, 200, {'Content-Type': 'audio/wav'})
+    response.set_etag(message['checksum'])
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
 
 # Gets all binaries that exist and returns them as a zip file
 @messages_bp.route('/messages/allBinaries', methods=['GET'])
@@ -255,6 +599,9 @@ def get_all_binaries():
                 record_id = record['id']
                 record_timestamp = record['recordTimestamp']
                 file_path = os.path.join(UPLOAD_FOLDER, f"{record_id}.wav")
+                # Skip rows whose file is missing, the reconciler will clean them up
+                if not os.path.exists(file_path):
+                    continue
                 zip_file.write(file_path, f"{record_id}_{record_timestamp}.wav")
         zip_buffer.seek(0)
         return zip_buffer.read(), 200, {'Content-Type': 'application/zip', 'Content-Disposition': 'attachment; filename=all_binaries.zip'}
\ No newline at end of file
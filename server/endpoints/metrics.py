@@ -0,0 +1,19 @@
+from flask import Blueprint
+from apidocs import swag_from
+import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve server metrics in the Prometheus text format',
+    'produces': ['text/plain'],
+    'responses': {
+        200: {
+            'description': 'Request latencies, transferred bytes, database timings and websocket statistics'
+        }
+    },
+    'tags': ['metrics']
+})
+def get_metrics():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
@@ -1,18 +1,26 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, send_file
 import os
-import uuid
-import time
-from werkzeug.utils import secure_filename
-from audio_utils import allowed_file, get_audio_length, validate_audio
+from audio_utils import allowed_file, get_audio_length, validate_audio, wav_slice, stream_span, stored_header, SliceError, parse_quality, public_row
 from database import query_db, execute_db
-from flasgger import swag_from
+from blob_store import receive, commit_uploads, upload_result
+from apidocs import swag_from
+from batch_upload import import_batch, BatchError
+from bulk import bulk_get, bulk_delete, delete_records, BulkError
+from reel import build_reel, ReelError, ORDERS, MAX_GAP
+from websocket_utils import DEVICE_ID
+from scheduler import throttle
+from capture_health import count_recording
 import zipfile
 import io
+import itertools
 
 records_bp = Blueprint('records', __name__)
 
 UPLOAD_FOLDER = 'recordings'
 
+# Bytes read at once when the zip of all records is streamed
+ZIP_CHUNK_SIZE = 256 * 1024
+
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
@@ -27,9 +35,39 @@ if not os.path.exists(UPLOAD_FOLDER):
             'type': 'file',
             'required': True,
             'description': 'The .wav audio file to upload'
+        },
+        {
+            'name': 'quality',
+            'in': 'formData',
+            'type': 'string',
+            'required': False,
+            'description': 'Call quality measured while recording as JSON with rmsDb, peakDb, silenceMs, clippingMs, '
+                           'the capture report xruns, droppedFrames, durationMismatchMs, periodFrames and bufferFrames and '
+                           'quality ("ok" or the comma separated flags "silence", "clipping", "xrun" and "truncated"), '
+                           'stored with the record'
+        },
+        {
+            'name': 'device',
+            'in': 'formData',
+            'type': 'string',
+            'required': False,
+            'description': 'Id of the phone interface that recorded the file, stored with the record'
         }
     ],
     'responses': {
+        200: {
+            'description': 'The same audio is already stored, the existing record is returned with duplicate set to true',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'string'},
+                    'recordTimestamp': {'type': 'integer'},
+                    'length': {'type': 'integer'},
+                    'checksum': {'type': 'string'},
+                    'duplicate': {'type': 'boolean'}
+                }
+            }
+        },
         201: {
             'description': 'Record created successfully',
             'schema': {
@@ -37,7 +75,9 @@ if not os.path.exists(UPLOAD_FOLDER):
                 'properties': {
                     'id': {'type': 'string'},
                     'recordTimestamp': {'type': 'integer'},
-                    'length': {'type': 'integer'}
+                    'length': {'type': 'integer'},
+                    'checksum': {'type': 'string'},
+                    'duplicate': {'type': 'boolean'}
                 }
             }
         },
@@ -60,36 +100,120 @@ def create_record():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file_id = str(uuid.uuid4())
-        file_path = os.path.join(UPLOAD_FOLDER, f"{file_id}.wav")
-        file.save(file_path)
+        try:
+            quality = parse_quality(request.form.get('quality'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        device_id = request.form.get('device')
+        if device_id is not None and not DEVICE_ID.match(device_id):
+            return jsonify({'error': 'Invalid device id'}), 400
+        # The upload is hashed while it is written, content that is already stored is not stored again
+        tmp_path, checksum, size = receive(file.stream)
 
-        if not validate_audio(file_path):
-            os.remove(file_path)
+        if not validate_audio(tmp_path):
+            os.remove(tmp_path)
             return jsonify({'error': 'Audio file does not meet requirements (32-bit, 96KHz)'}), 400
 
         try:
-            length = get_audio_length(file_path)
+            length = get_audio_length(tmp_path)
         except Exception as e:
-            os.remove(file_path)
+            os.remove(tmp_path)
             return jsonify({'error': 'Invalid audio file'}), 400
 
-        record_timestamp = int(time.time())
-
-        execute_db('''
-            INSERT INTO records (id, recordTimestamp, length)
-            VALUES (?, ?, ?)
-        ''', (file_id, record_timestamp, length))
+        entry = {'tmp': tmp_path, 'checksum': checksum, 'size': size, 'length': length,
+                 'columns': dict(quality, deviceId=device_id) if device_id else quality}
+        commit_uploads([entry], 'records', UPLOAD_FOLDER)
+        if not entry['duplicate']:
+            count_recording(device_id, quality)
 
-        return jsonify({'id': file_id, 'recordTimestamp': record_timestamp, 'length': length}), 201
+        return jsonify(upload_result(entry)), 200 if entry['duplicate'] else 201
     else:
         return jsonify({'error': 'File type not allowed'}), 400
 
 
+# Upload many .wav files, or zip archives of .wav files, in one request
+# Every file is reported individually, valid files are stored even if others in the batch are rejected
+@records_bp.route('/records/batch', methods=['POST'])
+@swag_from({
+    'summary': 'Upload several .wav files or zip archives and create a record for every valid file',
+    'consumes': ['multipart/form-data'],
+    'parameters': [
+        {
+            'name': 'files',
+            'in': 'formData',
+            'type': 'array',
+            'items': {'type': 'file'},
+            'collectionFormat': 'multi',
+            'required': True,
+            'description': 'The .wav files or .zip archives containing .wav files to upload'
+        }
+    ],
+    'responses': {
+        201: {
+            'description': 'At least one record was created, the result of every file is listed',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'batchId': {'type': 'string'},
+                    'created': {'type': 'integer'},
+                    'duplicates': {'type': 'integer'},
+                    'failed': {'type': 'integer'},
+                    'files': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'file': {'type': 'string'},
+                                'id': {'type': 'string'},
+                                'recordTimestamp': {'type': 'integer'},
+                                'length': {'type': 'integer'},
+                                'checksum': {'type': 'string'},
+                                'duplicate': {'type': 'boolean'},
+                                'error': {'type': 'string'}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'No files were sent, none of them was valid or the batch exceeded a limit',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['records']
+})
+def create_records_batch():
+    uploads = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+    if not uploads:
+        return jsonify({'error': 'No file part'}), 400
+    try:
+        batch_id, results = import_batch(uploads, 'records', UPLOAD_FOLDER)
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    stored = [result for result in results if 'id' in result]
+    created = [result for result in stored if not result['duplicate']]
+    body = {'batchId': batch_id, 'created': len(created), 'duplicates': len(stored) - len(created),
+            'failed': len(results) - len(stored), 'files': results}
+    return jsonify(body), 201 if stored else 400
+
 @records_bp.route('/records', methods=['GET'])
 @swag_from({
     'summary': 'Retrieve all records',
+    'parameters': [
+        {
+            'name': 'device',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Only the records of this phone interface'
+        }
+    ],
     'responses': {
         200: {
             'description': 'A list of records',
@@ -100,7 +224,9 @@ def create_record():
                     'properties': {
                         'id': {'type': 'string'},
                         'recordTimestamp': {'type': 'integer'},
-                        'length': {'type': 'integer'}
+                        'length': {'type': 'integer'},
+                        'checksum': {'type': 'string'},
+                        'deviceId': {'type': 'string'}
                     }
                 }
             }
@@ -109,8 +235,117 @@ def create_record():
     'tags': ['records']
 })
 def get_records():
-    records = query_db('SELECT * FROM records')
-    return jsonify([dict(record) for record in records]), 200
+    device_id = request.args.get('device')
+    if device_id is not None:
+        records = query_db('SELECT * FROM records WHERE deviceId = ?', (device_id,))
+    else:
+        records = query_db('SELECT * FROM records')
+    return jsonify([public_row(record) for record in records]), 200
+
+# Get several records at once, selected by ids and/or a time range
+@records_bp.route('/records/bulkGet', methods=['POST'])
+@swag_from({
+    'summary': 'Retrieve all records matching a list of ids and/or a time range',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'description': 'Select records by ids, by a recordTimestamp range or both. from and to are inclusive unix timestamps in seconds.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'ids': {'type': 'array', 'items': {'type': 'string'}},
+                    'from': {'type': 'integer'},
+                    'to': {'type': 'integer'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'The matching records, ordered by recordTimestamp',
+            'schema': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'id': {'type': 'string'},
+                        'recordTimestamp': {'type': 'integer'},
+                        'length': {'type': 'integer'},
+                        'checksum': {'type': 'string'}
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid selection',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['records']
+})
+def bulk_get_records():
+    try:
+        records = bulk_get('records', request.get_json(silent=True))
+    except BulkError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify([public_row(record) for record in records]), 200
+
+# Delete several records at once, selected by ids and/or a time range
+# All rows are deleted in one transaction, the files are removed afterwards
+@records_bp.route('/records/bulkDelete', methods=['POST'])
+@swag_from({
+    'summary': 'Delete all records matching a list of ids and/or a time range',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'description': 'Select records by ids, by a recordTimestamp range or both. from and to are inclusive unix timestamps in seconds.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'ids': {'type': 'array', 'items': {'type': 'string'}},
+                    'from': {'type': 'integer'},
+                    'to': {'type': 'integer'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'The ids of the deleted records',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'deleted': {'type': 'array', 'items': {'type': 'string'}}
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid selection',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['records']
+})
+def bulk_delete_records():
+    try:
+        deleted = bulk_delete('records', UPLOAD_FOLDER, request.get_json(silent=True))
+    except BulkError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'deleted': deleted}), 200
 
 @records_bp.route('/records/<record_id>', methods=['DELETE'])
 @swag_from({
@@ -141,12 +376,8 @@ def get_records():
     'tags': ['records']
 })
 def delete_record(record_id):
-    record = query_db('SELECT * FROM records WHERE id = ?', [record_id], one=True)
-    if record:
-        file_path = os.path.join(UPLOAD_FOLDER, f"{record_id}.wav")
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        execute_db('DELETE FROM records WHERE id = ?', [record_id])
+    # The row is removed first and the file afterwards, a tombstone covers a crash in between
+    if delete_records('records', UPLOAD_FOLDER, 'id = ?', [record_id]):
         return '', 204
     else:
         return jsonify({'error': 'Record not found'}), 404
@@ -171,7 +402,20 @@ def delete_record(record_id):
                 'properties': {
                     'id': {'type': 'string'},
                     'recordTimestamp': {'type': 'integer'},
-                    'length': {'type': 'integer'}
+                    'length': {'type': 'integer'},
+                    'checksum': {'type': 'string'},
+                    'trimStart': {'type': 'integer'},
+                    'trimEnd': {'type': 'integer'},
+                    'rmsDb': {'type': 'number'},
+                    'peakDb': {'type': 'number'},
+                    'silenceMs': {'type': 'integer'},
+                    'clippingMs': {'type': 'integer'},
+                    'xruns': {'type': 'integer'},
+                    'droppedFrames': {'type': 'integer'},
+                    'durationMismatchMs': {'type': 'integer'},
+                    'periodFrames': {'type': 'integer'},
+                    'bufferFrames': {'type': 'integer'},
+                    'quality': {'type': 'string'}
                 }
             }
         },
@@ -190,7 +434,7 @@ def delete_record(record_id):
 def get_record(record_id):
     record = query_db('SELECT * FROM records WHERE id = ?', [record_id], one=True)
     if record:
-        return jsonify(dict(record)), 200
+        return jsonify(public_row(record)), 200
     else:
         return jsonify({'error': 'Record not found'}), 404
 
@@ -227,16 +471,250 @@ def get_record(record_id):
 })
 def get_record_binary(record_id):
     record = query_db('SELECT * FROM records WHERE id = ?', [record_id], one=True)
-    if record:
-        file_path = os.path.join(UPLOAD_FOLDER, f"{record_id}.wav")
-        return open(file_path, 'rb').read(), 200, {'Content-Type': 'audio/wav'}
+    file_path = os.path.join(UPLOAD_FOLDER, f"{record_id}.wav")
+    if record and os.path.exists(file_path):
+        # The file is streamed instead of read into memory, the checksum identifies its content
+        return send_file(os.path.abspath(file_path), mimetype='audio/wav', etag=record['checksum'] or True)
     else:
         return jsonify({'error': 'Record not found'}), 404
 
+@records_bp.route('/records/<record_id>/trim', methods=['PUT'])
+@swag_from({
+    'summary': 'Set the part of a record that is played in the reel',
+    'parameters': [
+        {
+            'name': 'record_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'The ID of the record'
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'trimStart': {'type': 'integer', 'description': 'Start in milliseconds, null for the beginning'},
+                    'trimEnd': {'type': 'integer', 'description': 'End in milliseconds, null for the end'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Trim offsets stored',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'string'},
+                    'trimStart': {'type': 'integer'},
+                    'trimEnd': {'type': 'integer'}
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid offsets',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        404: {
+            'description': 'Record not found',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['records']
+})
+def set_record_trim(record_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    trim_start = data.get('trimStart')
+    trim_end = data.get('trimEnd')
+    for value in (trim_start, trim_end):
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+            return jsonify({'error': 'trimStart and trimEnd must be milliseconds or null'}), 400
+    if trim_start is not None and trim_end is not None and trim_end <= trim_start:
+        return jsonify({'error': 'trimEnd must be after trimStart'}), 400
+    if not query_db('SELECT id FROM records WHERE id = ?', [record_id], one=True):
+        return jsonify({'error': 'Record not found'}), 404
+    execute_db('UPDATE records SET trimStart = ?, trimEnd = ? WHERE id = ?', (trim_start, trim_end, record_id))
+    return jsonify({'id': record_id, 'trimStart': trim_start, 'trimEnd': trim_end}), 200
+
+@records_bp.route('/records/<record_id>/slice', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve a part of a record as a wav file',
+    'description': 'Cuts the span between start and end out of the record without decoding it. '
+                   'The span is served from a memory map of the file with a new wav header, '
+                   'so the response time depends on the length of the span only.',
+    'parameters': [
+        {
+            'name': 'record_id',
+            'in': 'path',
+            'type': 'string',
+            'required': True,
+            'description': 'The ID of the record'
+        },
+        {
+            'name': 'start',
+            'in': 'query',
+            'type': 'integer',
+            'required': True,
+            'description': 'Start of the slice in milliseconds'
+        },
+        {
+            'name': 'end',
+            'in': 'query',
+            'type': 'integer',
+            'required': True,
+            'description': 'End of the slice in milliseconds, clamped to the length of the record'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Wav file holding the slice',
+            'schema': {
+                'type': 'file'
+            }
+        },
+        400: {
+            'description': 'Invalid start or end, or the slice is outside of the record',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        404: {
+            'description': 'Record not found',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['records']
+})
+def get_record_slice(record_id):
+    start = request.args.get('start', type=int)
+    end = request.args.get('end', type=int)
+    if start is None or end is None or start < 0 or end <= start:
+        return jsonify({'error': 'start and end must be milliseconds with 0 <= start < end'}), 400
+    record = query_db('SELECT * FROM records WHERE id = ?', [record_id], one=True)
+    file_path = os.path.join(UPLOAD_FOLDER, f"{record_id}.wav")
+    if not record or not os.path.exists(file_path):
+        return jsonify({'error': 'Record not found'}), 404
+    try:
+        # The format is stored with the record, the file is only opened to map the span
+        header, offset, size = wav_slice(stored_header(record, file_path), start, end)
+    except SliceError as e:
+        return jsonify({'error': str(e)}), 400
+    body = itertools.chain([header], stream_span(file_path, offset, size))
+    return Response(body, 200, {
+        'Content-Type': 'audio/wav',
+        'Content-Length': str(len(header) + size + size % 2),
+        'Content-Disposition': f'attachment; filename={record_id}_{start}-{end}.wav'
+    })
+
+@records_bp.route('/records/reel', methods=['GET'])
+@swag_from({
+    'summary': 'Stream all records of a time range back to back as one wav file',
+    'description': 'The reel is assembled on the fly from the stored files, so the memory use does not depend on '
+                   'the number of records. Range requests are supported, so players can seek in it. '
+                   'Records in a different audio format than the first one are skipped.',
+    'parameters': [
+        {'name': 'from', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'First recordTimestamp, inclusive'},
+        {'name': 'to', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Last recordTimestamp, inclusive'},
+        {'name': 'order', 'in': 'query', 'type': 'string', 'enum': list(ORDERS), 'default': 'asc'},
+        {'name': 'gap', 'in': 'query', 'type': 'integer', 'default': 0, 'description': f'Silence between two records in milliseconds, at most {MAX_GAP}'},
+        {'name': 'chime', 'in': 'query', 'type': 'string', 'required': False, 'description': 'ID of a message played between two records'},
+        {'name': 'trim', 'in': 'query', 'type': 'boolean', 'default': True, 'description': 'Apply the trim offsets stored for the records'}
+    ],
+    'responses': {
+        200: {
+            'description': 'The reel as a wav file',
+            'schema': {
+                'type': 'file'
+            }
+        },
+        206: {
+            'description': 'The requested range of the reel'
+        },
+        400: {
+            'description': 'Invalid parameters or the reel does not fit into a wav file',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        404: {
+            'description': 'No records in the time range'
+        },
+        416: {
+            'description': 'The requested range is outside of the reel'
+        }
+    },
+    'tags': ['records']
+})
+def get_reel():
+    start = request.args.get('from', type=int)
+    end = request.args.get('to', type=int)
+    order = request.args.get('order', 'asc')
+    gap = request.args.get('gap', 0, type=int)
+    trim = request.args.get('trim', 'true').lower() not in ('0', 'false', 'no')
+    if order not in ORDERS:
+        return jsonify({'error': f"order must be one of {', '.join(ORDERS)}"}), 400
+    if not 0 <= gap <= MAX_GAP:
+        return jsonify({'error': f'gap must be between 0 and {MAX_GAP} milliseconds'}), 400
+    try:
+        reel = build_reel(UPLOAD_FOLDER, start, end, order, gap, request.args.get('chime'), trim)
+    except ReelError as e:
+        return jsonify({'error': str(e)}), 400
+    if not reel.records:
+        return jsonify({'error': 'No records in the time range'}), 404
+
+    headers = {
+        'Content-Type': 'audio/wav',
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{reel.etag}"',
+        'Content-Disposition': 'attachment; filename=reel.wav',
+        'X-Reel-Records': str(len(reel.records)),
+        'X-Reel-Skipped': str(len(reel.skipped))
+    }
+    # A range is only served if the reel did not change since the client got the first part
+    if_range = request.headers.get('If-Range')
+    if request.range and (if_range is None or if_range.strip('"') == reel.etag):
+        span = request.range.range_for_length(reel.size)
+        if span is None:
+            headers['Content-Range'] = f'bytes */{reel.size}'
+            return Response(status=416, headers=headers)
+        first, stop = span
+        headers['Content-Range'] = f'bytes {first}-{stop - 1}/{reel.size}'
+        headers['Content-Length'] = str(stop - first)
+        return Response(reel.stream(first, stop), 206, headers)
+    headers['Content-Length'] = str(reel.size)
+    return Response(reel.stream(0, reel.size), 200, headers)
+
 # Gets all binaries that exist and returns them as a zip file
 @records_bp.route('/records/allBinaries', methods=['GET'])
 @swag_from({
     'summary': 'Retrieve all binary data of records as a zip file',
+    'description': 'The zip is streamed while it is written. While a guest is on the phone the download is slowed down.',
     'responses': {
         200: {
             'description': 'All binary data retrieved successfully',
@@ -248,13 +726,51 @@ def get_record_binary(record_id):
     'tags': ['records']
 })
 def get_all_binaries():
-    all_records = query_db('SELECT * FROM records')
-    with io.BytesIO() as zip_buffer:
-        with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-            for record in all_records:
-                record_id = record['id']
-                record_timestamp = record['recordTimestamp']
-                file_path = os.path.join(UPLOAD_FOLDER, f"{record_id}.wav")
-                zip_file.write(file_path, f"{record_id}_{record_timestamp}.wav")
-        zip_buffer.seek(0)
-        return zip_buffer.read(), 200, {'Content-Type': 'application/zip', 'Content-Disposition': 'attachment; filename=all_binaries.zip'}
\ No newline at end of file
+    files = [
+        (os.path.join(UPLOAD_FOLDER, f"{record['id']}.wav"), f"{record['id']}_{record['recordTimestamp']}.wav")
+        for record in query_db('SELECT id, recordTimestamp FROM records')
+    ]
+    return Response(stream_zip(files), 200, {'Content-Type': 'application/zip', 'Content-Disposition': 'attachment; filename=all_binaries.zip'})
+
+# Collects what zipfile writes, so the archive can be sent while it is written
+class ZipBuffer(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+# Stream a zip of (path, name) pairs without holding it in memory
+# The files are stored uncompressed, wav does not compress. During a call the download is throttled, see scheduler.py.
+def stream_zip(files):
+    buffer = ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w') as zip_file:
+        for file_path, name in files:
+            # Skip rows whose file is missing, the reconciler will clean them up
+            if not os.path.exists(file_path):
+                continue
+            with open(file_path, 'rb') as source, zip_file.open(zipfile.ZipInfo.from_file(file_path, name), 'w') as destination:
+                while True:
+                    chunk = source.read(ZIP_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    destination.write(chunk)
+                    yield from send(buffer)
+            yield from send(buffer)
+    # The central directory is written when the archive is closed
+    yield from send(buffer)
+
+def send(buffer):
+    data = buffer.take()
+    if data:
+        throttle('allBinaries', len(data))
+        yield data
\ No newline at end of file
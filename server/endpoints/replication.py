@@ -0,0 +1,96 @@
+from flask import Blueprint, request, jsonify
+from apidocs import swag_from
+from replication import changes_after, latest_change, get_status, PAGE_SIZE
+
+replication_bp = Blueprint('replication', __name__)
+
+# Most changes returned by a single request
+MAX_LIMIT = 1000
+
+@replication_bp.route('/replication/changes', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve the changes of the records after a sequence number',
+    'description': 'Read by replicas, see WEDDINGRING_REPLICATE_FROM. Every record is only listed with its last change, '
+                   'inserted and updated records carry their row. A replica is up to date once lastSeq reaches latestSeq.',
+    'parameters': [
+        {'name': 'after', 'in': 'query', 'type': 'integer', 'default': 0, 'description': 'Last sequence number the replica applied'},
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'default': PAGE_SIZE, 'description': f'Number of changes, at most {MAX_LIMIT}'}
+    ],
+    'responses': {
+        200: {
+            'description': 'Changes in the order they happened',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'changes': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'seq': {'type': 'integer'},
+                                'id': {'type': 'string'},
+                                'op': {'type': 'string', 'enum': ['insert', 'update', 'delete']},
+                                'changedAt': {'type': 'integer'},
+                                'record': {'type': 'object', 'description': 'The record, missing for deletions'}
+                            }
+                        }
+                    },
+                    'lastSeq': {'type': 'integer', 'description': 'Sequence number of the last returned change'},
+                    'latestSeq': {'type': 'integer', 'description': 'Sequence number of the latest change'},
+                    'latestAt': {'type': 'integer', 'description': 'Time of the latest change'}
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid parameters',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['replication']
+})
+def get_changes():
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    if after < 0 or not 0 < limit <= MAX_LIMIT:
+        return jsonify({'error': f"'after' must not be negative and 'limit' must be between 1 and {MAX_LIMIT}"}), 400
+    # The latest change is read first, everything up to it is in the changes returned or in later pages
+    latest_seq, latest_at = latest_change()
+    changes = changes_after(after, limit)
+    return jsonify({
+        'changes': changes,
+        'lastSeq': changes[-1]['seq'] if changes else after,
+        'latestSeq': max(latest_seq, changes[-1]['seq'] if changes else 0),
+        'latestAt': latest_at
+    }), 200
+
+@replication_bp.route('/replication', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve the state of the replication from the primary',
+    'description': "The state is 'disabled' unless the server was started with WEDDINGRING_REPLICATE_FROM.",
+    'responses': {
+        200: {
+            'description': 'Replication state',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'state': {'type': 'string', 'enum': ['disabled', 'starting', 'syncing', 'idle', 'failed']},
+                    'source': {'type': 'string', 'description': 'Base URL of the primary'},
+                    'lastSeq': {'type': 'integer', 'description': 'Last change of the primary that was applied'},
+                    'latestSeq': {'type': 'integer', 'description': 'Latest change of the primary seen'},
+                    'caughtUpAt': {'type': 'integer', 'description': 'Time the replica last held every change'},
+                    'lagSeconds': {'type': 'integer'},
+                    'lastSyncAt': {'type': 'integer'},
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['replication']
+})
+def get_replication_status():
+    return jsonify(get_status()), 200
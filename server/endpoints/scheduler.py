@@ -0,0 +1,54 @@
+from flask import Blueprint, jsonify
+from apidocs import swag_from
+from scheduler import get_status
+
+scheduler_bp = Blueprint('scheduler', __name__)
+
+@scheduler_bp.route('/scheduler', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve the calls in progress and the background jobs',
+    'description': 'Exports and maintenance run as jobs one at a time. While a phone is off-hook, and shortly after, '
+                   'jobs wait or pause and the zip of all recordings is slowed down.',
+    'responses': {
+        200: {
+            'description': 'Scheduler state',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'calls': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'deviceId': {'type': 'string'},
+                                'seconds': {'type': 'integer'}
+                            }
+                        }
+                    },
+                    'heavyWorkAllowed': {'type': 'boolean'},
+                    'resumesIn': {'type': 'number', 'description': 'Seconds until background work continues'},
+                    'jobs': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer'},
+                                'task': {'type': 'string'},
+                                'priority': {'type': 'integer'},
+                                'state': {'type': 'string', 'enum': ['queued', 'running', 'paused', 'finished', 'failed']},
+                                'submittedAt': {'type': 'integer'},
+                                'startedAt': {'type': 'integer'},
+                                'finishedAt': {'type': 'integer'},
+                                'result': {'type': 'object'},
+                                'error': {'type': 'string'}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    },
+    'tags': ['maintenance']
+})
+def get_scheduler():
+    return jsonify(get_status()), 200
@@ -0,0 +1,35 @@
+import mimetypes
+import os
+from flask import Blueprint, request, send_from_directory, current_app
+from werkzeug.security import safe_join
+from build_static import SOURCE_FOLDER, BUILD_FOLDER, FINGERPRINT
+
+# Serves the management UI when the server is reached without nginx, e.g. in development
+# In production nginx serves the built tree itself with the same headers, see system/nginx/default
+static_files_bp = Blueprint('static_files', __name__)
+
+# Fingerprinted assets never change, everything else is revalidated with its ETag
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# Precompressed variants in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+@static_files_bp.route('/static/<path:filename>', methods=['GET'])
+def serve_static(filename):
+    # In debug mode or without a build (python3 build_static.py) the source tree is served,
+    # revalidated on every request, so changes show up without building
+    folder = BUILD_FOLDER if os.path.isdir(BUILD_FOLDER) and not current_app.debug else SOURCE_FOLDER
+    response = None
+    for encoding, suffix in ENCODINGS:
+        variant = safe_join(folder, filename + suffix)
+        if request.accept_encodings[encoding] and variant and os.path.isfile(variant):
+            response = send_from_directory(folder, filename + suffix, mimetype=mimetypes.guess_type(filename)[0],
+                                           download_name=os.path.basename(filename))
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(folder, filename)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE if folder == BUILD_FOLDER and FINGERPRINT.search(filename) else REVALIDATE
+    return response
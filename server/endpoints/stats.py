@@ -0,0 +1,62 @@
+from flask import Blueprint, request, jsonify
+from apidocs import swag_from
+from stats import get_stats, BUCKETS
+
+stats_bp = Blueprint('stats', __name__)
+
+BUCKET_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'start': {'type': 'integer', 'description': 'Start of the bucket in seconds since the epoch'},
+        'label': {'type': 'string'},
+        'records': {'type': 'integer'},
+        'recordedMs': {'type': 'integer'},
+        'averageLengthMs': {'type': 'integer'},
+        'pickups': {'type': 'integer'},
+        'emptyPickups': {'type': 'integer'},
+        'rings': {'type': 'integer'},
+        'missedRings': {'type': 'integer'},
+        'autoRings': {'type': 'integer'},
+        'missedAutoRings': {'type': 'integer'}
+    }
+}
+
+@stats_bp.route('/stats', methods=['GET'])
+@swag_from({
+    'summary': 'Retrieve the statistics of the event per hour or per day',
+    'description': 'Served from hourly rollups that are updated with every record insert and delete and with the '
+                   'hook states reported by the interface. Days are local days.',
+    'parameters': [
+        {'name': 'bucket', 'in': 'query', 'type': 'string', 'enum': list(BUCKETS), 'default': 'hour'},
+        {'name': 'from', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'First timestamp, inclusive'},
+        {'name': 'to', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Last timestamp, inclusive'}
+    ],
+    'responses': {
+        200: {
+            'description': 'Statistics',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'bucket': {'type': 'string'},
+                    'buckets': {'type': 'array', 'items': BUCKET_SCHEMA},
+                    'totals': BUCKET_SCHEMA
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid bucket',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    },
+    'tags': ['stats']
+})
+def stats():
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in BUCKETS:
+        return jsonify({'error': f"bucket must be one of {', '.join(BUCKETS)}"}), 400
+    return jsonify(get_stats(bucket, request.args.get('from', type=int), request.args.get('to', type=int))), 200
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from database import get_db, transaction
+from blob_store import hash_file, CHUNK_SIZE
+from websocket_utils import broadcast
+from metrics import EXPORTED_BYTES
+from scheduler import scheduler, checkpoint, NORMAL
+from endpoints.records import UPLOAD_FOLDER as RECORDS_FOLDER
+
+# Export of the recordings to USB sticks
+# A journal in the database remembers which records were exported to which volume, keyed by the
+# filesystem UUID. An export only copies records that are not in the journal of the volume yet,
+# so its duration depends on the new recordings only. Every file is written to a .part file,
+# synced, read back and compared to its checksum before it is renamed and added to the journal.
+# A stick that is pulled in the middle of an export continues where it stopped on the next export.
+# Exports run as jobs of the scheduler and pause while a guest is on the phone, see scheduler.py.
+
+# Folder on the volume the recordings are exported to
+EXPORT_FOLDER = 'recordings'
+
+# Refuse to export into a directory that is not a mount point, so a missing stick never fills the SD card
+REQUIRE_MOUNT = os.environ.get('WEDDINGRING_EXPORT_REQUIRE_MOUNT', '1') == '1'
+
+# Directory holding a symlink per filesystem UUID to its block device
+DISK_BY_UUID = '/dev/disk/by-uuid'
+
+# Raised when an export can not be started or a single file can not be exported
+class ExportError(Exception):
+    pass
+
+# Raised when an export is started while another one is running
+class ExportRunning(ExportError):
+    pass
+
+# State of the current or last export, returned by GET /export
+status = {'state': 'idle'}
+status_lock = threading.Lock()
+
+# Find the filesystem UUID of the volume mounted at the mount point
+# The block device behind every UUID symlink is compared to the device of the mount point
+def volume_uuid(mount_point):
+    device = os.stat(mount_point).st_dev
+    try:
+        names = os.listdir(DISK_BY_UUID)
+    except OSError:
+        return None
+    for name in names:
+        try:
+            if os.stat(os.path.join(DISK_BY_UUID, name)).st_rdev == device:
+                return name
+        except OSError:
+            continue
+    return None
+
+# Evict the pages of a file from the page cache, so reading it back really reads the volume
+def drop_cache(fd):
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+# Sync a directory so a rename inside it is persisted
+# Not every filesystem supports this, e.g. some FAT drivers reject fsync on directories
+def fsync_directory(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# Read a file from the volume, bypassing the page cache as far as possible, and return its checksum
+def verify_file(path):
+    with open(path, 'rb') as f:
+        drop_cache(f.fileno())
+    return hash_file(path)
+
+# Copy a file to the volume and verify the copy
+# The copy is written to a .part file, synced and read back before it replaces the destination.
+# expected is the checksum of the record, None for records stored before content addressing.
+# Returns the checksum and the size of the copied file
+def copy_verified(source, destination, expected=None):
+    part = f"{destination}.part"
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(source, 'rb') as src, open(part, 'wb') as dst:
+        while True:
+            checkpoint('export')
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            dst.write(chunk)
+            size += len(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+        drop_cache(dst.fileno())
+    checksum = sha256.hexdigest()
+    if expected is not None and checksum != expected:
+        os.remove(part)
+        raise ExportError(f"{source} does not match its checksum")
+    if verify_file(part) != checksum:
+        os.remove(part)
+        raise ExportError(f"Verification of {destination} failed")
+    os.replace(part, destination)
+    fsync_directory(os.path.dirname(destination))
+    return checksum, size
+
+# Update the export status and send it to all websocket clients
+def publish(**changes):
+    with status_lock:
+        status.update(changes)
+        message = json.dumps(status)
+    broadcast('STATUS:EXPORT:' + message)
+
+# Get a copy of the export status
+def get_status():
+    with status_lock:
+        return dict(status)
+
+# Records that still have to be exported to a volume
+# With full set every record is checked again, files that are already on the volume are only verified
+def pending_records(volume, full=False):
+    cursor = get_db().cursor()
+    cursor.row_factory = None
+    if full:
+        rows = cursor.execute('SELECT id, checksum, sizeBytes FROM records ORDER BY recordTimestamp')
+    else:
+        rows = cursor.execute('''
+            SELECT id, checksum, sizeBytes FROM records
+            WHERE id NOT IN (SELECT recordId FROM exports WHERE volume = ?)
+            ORDER BY recordTimestamp
+        ''', (volume,))
+    return rows.fetchall()
+
+# Export a single record to the volume
+# A file already on the volume, e.g. copied by an earlier version, is verified instead of copied again
+# size is the stored size of the record, it is only read from the file for rows stored before it was kept
+# Returns the checksum and the number of bytes written
+def export_record(record_id, checksum, destination_folder, size=None):
+    source = os.path.join(RECORDS_FOLDER, f"{record_id}.wav")
+    destination = os.path.join(destination_folder, f"{record_id}.wav")
+    if not os.path.exists(source):
+        raise ExportError(f"{source} does not exist")
+    if os.path.exists(destination) and os.path.getsize(destination) == (size or os.path.getsize(source)):
+        expected = checksum or hash_file(source)
+        if verify_file(destination) == expected:
+            return expected, 0
+    return copy_verified(source, destination, checksum)
+
+# Export all records that are not in the journal of the volume yet
+# Runs in the app context of the caller, the progress is published after every file.
+# Files that fail are reported and skipped, an OSError (e.g. the stick was pulled) ends the export.
+def export_records(mount_point, volume, full=False):
+    destination_folder = os.path.join(mount_point, EXPORT_FOLDER)
+    pending = pending_records(volume, full)
+    publish(state='running', volume=volume, mountPoint=mount_point, total=len(pending), done=0, bytes=0,
+            failed=[], error=None, startedAt=int(time.time()), finishedAt=None)
+    written = 0
+    failed = []
+    try:
+        os.makedirs(destination_folder, exist_ok=True)
+        for done, (record_id, checksum, size_bytes) in enumerate(pending, 1):
+            try:
+                exported_checksum, size = export_record(record_id, checksum, destination_folder, size_bytes)
+            except ExportError as e:
+                failed.append({'id': record_id, 'error': str(e)})
+            else:
+                # One commit per file, everything in the journal is safe on the volume
+                with transaction() as db:
+                    db.execute('''
+                        INSERT OR REPLACE INTO exports (volume, recordId, checksum, exportedAt)
+                        VALUES (?, ?, ?, ?)
+                    ''', (volume, record_id, exported_checksum, int(time.time())))
+                written += size
+                EXPORTED_BYTES.inc(size)
+            publish(done=done, bytes=written, file=record_id, failed=failed)
+    except OSError as e:
+        publish(state='failed', error=str(e), finishedAt=int(time.time()))
+        return get_status()
+    publish(state='finished', finishedAt=int(time.time()))
+    return get_status()
+
+# Check the mount point and resolve the volume, then queue the export as a job of the scheduler
+# Returns the status of the queued export
+def start_export(mount_point, volume=None, full=False):
+    if not os.path.isdir(mount_point):
+        raise ExportError(f"{mount_point} does not exist")
+    if REQUIRE_MOUNT and not os.path.ismount(mount_point):
+        raise ExportError(f"Nothing is mounted at {mount_point}")
+    volume = volume or volume_uuid(mount_point)
+    if not volume:
+        raise ExportError(f"Could not determine the filesystem UUID of {mount_point}")
+    with status_lock:
+        if status['state'] in ('queued', 'running'):
+            raise ExportRunning('An export is already running')
+        status.update(state='queued', volume=volume, mountPoint=mount_point)
+
+    def run():
+        try:
+            return export_records(mount_point, volume, full)
+        except Exception as e:
+            publish(state='failed', error=str(e), finishedAt=int(time.time()))
+            raise
+
+    publish(job=scheduler.submit('export', run, NORMAL)['id'])
+    return get_status()
+
+# Number of records in the journal of every volume
+def journal_summary():
+    rows = get_db().execute('SELECT volume, COUNT(*) AS records, MAX(exportedAt) AS lastExport FROM exports GROUP BY volume')
+    return [dict(row) for row in rows]
+
+# Forget the journal of a volume, the next export checks every record again
+def forget_volume(volume):
+    with transaction() as db:
+        return db.execute('DELETE FROM exports WHERE volume = ?', (volume,)).rowcount
@@ -0,0 +1,56 @@
+# Production configuration for gunicorn
+# Start with: gunicorn -c gunicorn.conf.py app:app (see setup.sh start)
+#
+# The gthread worker serves every request and every websocket in its own thread, so a long
+# /records/allBinaries download or a big upload does not block the /socket connection of the interface.
+# All settings can be overridden with environment variables.
+import os
+import signal
+
+bind = f"0.0.0.0:{os.environ.get('WEDDINGRING_PORT', '8080')}"
+worker_class = 'gthread'
+# Exactly one worker: the websocket relay, the call tracking of the scheduler, the replication and the message
+# cache live in the worker process. A second worker would run the background work twice on the same database and
+# only see its own /socket clients. Threads give the concurrency instead
+workers = int(os.environ.get('WEDDINGRING_WORKERS', 1))
+if workers != 1:
+    raise RuntimeError(f"WEDDINGRING_WORKERS={workers} is not supported, the server runs a single worker. "
+                       "Use WEDDINGRING_THREADS for more concurrent requests")
+# Every open websocket holds a thread for its whole lifetime, keep enough threads for the interface,
+# a few browsers and concurrent downloads
+threads = int(os.environ.get('WEDDINGRING_THREADS', 16))
+# Seconds in-flight requests get to finish after SIGTERM
+graceful_timeout = int(os.environ.get('WEDDINGRING_GRACEFUL_TIMEOUT', 30))
+# Worker heartbeat timeout, requests run in threads and are not bound by it
+timeout = 60
+keepalive = 5
+accesslog = os.environ.get('WEDDINGRING_ACCESS_LOG')
+errorlog = '-'
+
+# Runs once in the master before any worker is forked
+# The database is initialized here so the workers do not race on it
+def on_starting(server):
+    from app import startup
+    startup()
+
+# The heartbeat LED is driven by the master, exactly one process owns the GPIO pin
+def when_ready(server):
+    from app import start_heartbeat
+    start_heartbeat()
+
+# Websockets never finish on their own, close them on SIGTERM so the graceful shutdown does not
+# have to wait for the timeout. The handler installed by gunicorn is called afterwards.
+def post_worker_init(worker):
+    from websocket_utils import close_all
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        close_all()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+    # Background jobs and the replication run in threads of the worker, see scheduler.py and replication.py
+    from app import start_background_work
+    start_background_work()
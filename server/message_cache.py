@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from database import query_db
+from scheduler import checkpoint
+from metrics import MESSAGE_CACHE_REQUESTS, MESSAGE_CACHE_BYTES, MESSAGE_CACHE_ENTRIES, MESSAGE_CACHE_BUDGET, MESSAGE_CACHE_EVICTIONS
+
+# Audio of the messages kept in memory
+# The greeting messages are a handful of files that are read on every pickup and by every preview in a browser.
+# GET /messages/<id>/binary serves them from memory, including Range requests, once they were read. The entries
+# are kept in least recently used order within a budget of bytes that follows the memory the Raspberry Pi has
+# available. Every entry is stored with the checksum of its audio and only served if the message still has it,
+# so an entry can never outlive its message. Deletes and uploads drop their entries, the reconciler all of them.
+
+# Fixed budget in bytes, 0 disables the cache, without it the budget follows the available memory
+FIXED_BUDGET = os.environ.get('WEDDINGRING_MESSAGE_CACHE_BYTES')
+
+# Share of the available memory the cache may use
+AVAILABLE_SHARE = 0.1
+
+# Bounds of the budget that follows the available memory
+MIN_BUDGET = 8 * 1024 * 1024
+MAX_BUDGET = 128 * 1024 * 1024
+
+# Budget on systems without /proc/meminfo
+DEFAULT_BUDGET = 32 * 1024 * 1024
+
+# Seconds between two checks of the available memory
+BUDGET_INTERVAL = 30
+
+MEMINFO = '/proc/meminfo'
+
+# Memory the kernel can give to processes without swapping in bytes, None if it is not known
+def available_memory():
+    try:
+        with open(MEMINFO) as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+class MessageCache:
+    def __init__(self, fixed_budget=None):
+        self.fixed_budget = fixed_budget
+        # Message id to (checksum, audio), the least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.budget = 0
+        self.budget_checked = None
+        self.lock = threading.Lock()
+
+    # Follow the available memory, at most every BUDGET_INTERVAL seconds
+    # The memory held by the cache itself counts as available, otherwise the cache would shrink by filling up.
+    # Entries beyond a smaller budget are evicted. The caller holds the lock
+    def update_budget(self):
+        now = time.monotonic()
+        if self.budget_checked is not None and now - self.budget_checked < BUDGET_INTERVAL:
+            return
+        self.budget_checked = now
+        if self.fixed_budget is not None:
+            self.budget = self.fixed_budget
+        else:
+            available = available_memory()
+            if available is None:
+                self.budget = DEFAULT_BUDGET
+            else:
+                self.budget = int(min(max((available + self.size) * AVAILABLE_SHARE, MIN_BUDGET), MAX_BUDGET))
+        MESSAGE_CACHE_BUDGET.set(self.budget)
+        self.evict(0)
+
+    # Drop the least recently used entries until size more bytes fit into the budget, the caller holds the lock
+    def evict(self, size):
+        while self.entries and self.size + size > self.budget:
+            checksum, data = self.entries.popitem(last=False)[1]
+            self.size -= len(data)
+            MESSAGE_CACHE_EVICTIONS.inc()
+        self.publish()
+
+    def publish(self):
+        MESSAGE_CACHE_BYTES.set(self.size)
+        MESSAGE_CACHE_ENTRIES.set(len(self.entries))
+
+    # The audio of a message if it is cached with the checksum the message has, otherwise None
+    def get(self, message_id, checksum):
+        with self.lock:
+            # A cache that is only read from still shrinks when the memory gets short
+            self.update_budget()
+            entry = self.entries.get(message_id)
+            if entry is not None and entry[0] == checksum:
+                self.entries.move_to_end(message_id)
+                MESSAGE_CACHE_REQUESTS.inc(1, 'hit')
+                return entry[1]
+        return None
+
+    # Keep the audio of a message, returns False if it does not fit into the budget
+    # Without evict, other entries are never dropped for it, e.g. while warming up
+    def put(self, message_id, checksum, data, evict=True):
+        if not checksum:
+            # Without a checksum a changed file could not be told apart
+            return False
+        with self.lock:
+            self.update_budget()
+            if len(data) > self.budget or (not evict and self.size + len(data) > self.budget):
+                return False
+            previous = self.entries.pop(message_id, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self.evict(len(data))
+            self.entries[message_id] = (checksum, data)
+            self.size += len(data)
+            self.publish()
+        return True
+
+    # Read the audio of a message and keep it
+    # Returns the audio, or None if it is not cached, e.g. because it is larger than the budget, then the caller
+    # streams the file instead of holding all of it in memory
+    def load(self, message_id, checksum, file_path):
+        size = os.path.getsize(file_path)
+        with self.lock:
+            self.update_budget()
+            fits = checksum and size <= self.budget
+        if not fits:
+            MESSAGE_CACHE_REQUESTS.inc(1, 'bypass')
+            return None
+        MESSAGE_CACHE_REQUESTS.inc(1, 'miss')
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        return data if self.put(message_id, checksum, data) else None
+
+    # Drop the entries of messages, e.g. because they were deleted
+    def invalidate(self, message_ids):
+        with self.lock:
+            for message_id in message_ids:
+                entry = self.entries.pop(message_id, None)
+                if entry is not None:
+                    self.size -= len(entry[1])
+            self.publish()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.publish()
+
+    # Read the messages into the cache until the budget is full, the ones picked most often in the weighted mode
+    # and then the latest ones first. Runs as a background job after the start, see app.py
+    def warm(self, folder):
+        rows = query_db('SELECT id, checksum FROM messages WHERE checksum IS NOT NULL ORDER BY weight DESC, recordTimestamp DESC')
+        warmed = 0
+        for row in rows:
+            file_path = os.path.join(folder, f"{row['id']}.wav")
+            with self.lock:
+                self.update_budget()
+                cached = row['id'] in self.entries
+                remaining = self.budget - self.size
+            if cached or not os.path.exists(file_path) or os.path.getsize(file_path) > remaining:
+                continue
+            # Reading the files waits while a guest is on the phone
+            checkpoint('messageCache')
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            if self.put(row['id'], row['checksum'], data, evict=False):
+                warmed += 1
+        with self.lock:
+            return {'warmed': warmed, 'entries': len(self.entries), 'bytes': self.size, 'budget': self.budget}
+
+message_cache = MessageCache(int(FIXED_BUDGET) if FIXED_BUDGET else None)
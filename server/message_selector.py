@@ -0,0 +1,143 @@
+import json
+import random
+import bisect
+import threading
+from database import get_db, execute_db
+
+# Ways a message can be picked
+# random: any message, sequential: in recording order, weighted: random by the weight of the message,
+# shuffle: random, but every message is played once before any is repeated
+MODES = ('random', 'sequential', 'weighted', 'shuffle')
+
+# Mode used when the config does not set messageMode, older configs only know randomMessages
+def mode_from_config(config):
+    if config['messageMode'] in MODES:
+        return config['messageMode']
+    return 'random' if config['randomMessages'] else 'sequential'
+
+# Picks the message that is played on a pickup
+# The messages are kept in memory in recording order, so picking one does not need to read the database.
+# The endpoints update it on inserts and deletes, bulk changes like the reconciler invalidate it instead.
+# The sequential position and the remaining shuffle bag are persisted in the message_cursor table,
+# so the order continues after a restart.
+class MessageSelector:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    # Load the messages and the persisted cursors, the caller holds the lock
+    def load(self):
+        db = get_db()
+        rows = db.execute('SELECT id, recordTimestamp, length, checksum, weight FROM messages ORDER BY recordTimestamp, id').fetchall()
+        self.messages = {row['id']: dict(row) for row in rows}
+        self.ids = [row['id'] for row in rows]
+        self.rebuild_weights()
+        cursors = {row['mode']: row for row in db.execute('SELECT mode, position, state FROM message_cursor').fetchall()}
+        self.position = cursors['sequential']['position'] % len(self.ids) if 'sequential' in cursors and self.ids else 0
+        bag = json.loads(cursors['shuffle']['state'] or '[]') if 'shuffle' in cursors else []
+        self.bag = [message_id for message_id in bag if message_id in self.messages]
+        self.last = None
+        self.loaded = True
+
+    # Cumulative weights for the weighted mode, picking is a binary search in it
+    def rebuild_weights(self):
+        self.cumulative = []
+        total = 0
+        for message_id in self.ids:
+            total += max(0, self.messages[message_id]['weight'] or 0)
+            self.cumulative.append(total)
+
+    # Store the cursor of a mode
+    def persist(self, mode, position=0, state=None):
+        execute_db('INSERT OR REPLACE INTO message_cursor (mode, position, state) VALUES (?, ?, ?)', (mode, position, state))
+
+    # Drop the messages, they are loaded again on the next pick
+    def invalidate(self):
+        with self.lock:
+            self.loaded = False
+
+    # Add a new message
+    # New messages are the latest recordings, so they are appended. In shuffle mode they are
+    # played in the current round, at a random point of it.
+    def add(self, message):
+        with self.lock:
+            if not self.loaded or message['id'] in self.messages:
+                return
+            message = {key: message.get(key) for key in ('id', 'recordTimestamp', 'length', 'checksum')}
+            message['weight'] = 1
+            self.messages[message['id']] = message
+            key = (message['recordTimestamp'], message['id'])
+            index = len(self.ids)
+            if self.ids and key < (self.messages[self.ids[-1]]['recordTimestamp'], self.ids[-1]):
+                index = bisect.bisect([(self.messages[i]['recordTimestamp'], i) for i in self.ids], key)
+                if index < self.position:
+                    self.position += 1
+            self.ids.insert(index, message['id'])
+            self.rebuild_weights()
+            if self.bag:
+                self.bag.insert(random.randint(0, len(self.bag)), message['id'])
+
+    # Remove deleted messages
+    # The sequential position moves along, so the message after a deleted one is still played next
+    def remove(self, message_ids):
+        with self.lock:
+            if not self.loaded:
+                return
+            for message_id in message_ids:
+                if message_id not in self.messages:
+                    continue
+                index = self.ids.index(message_id)
+                if index < self.position:
+                    self.position -= 1
+                del self.ids[index]
+                del self.messages[message_id]
+            if self.ids:
+                self.position %= len(self.ids)
+            else:
+                self.position = 0
+            self.bag = [message_id for message_id in self.bag if message_id in self.messages]
+            self.rebuild_weights()
+
+    # Change the weight of a message in the weighted mode
+    def set_weight(self, message_id, weight):
+        with self.lock:
+            if self.loaded and message_id in self.messages:
+                self.messages[message_id]['weight'] = weight
+                self.rebuild_weights()
+
+    # A message by id, None if there is no such message
+    def get(self, message_id):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            message = self.messages.get(message_id)
+            return dict(message) if message else None
+
+    # Pick the next message, returns None if there are no messages
+    def next(self, mode):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            if not self.ids:
+                return None
+            if mode == 'sequential':
+                message_id = self.ids[self.position]
+                self.position = (self.position + 1) % len(self.ids)
+                self.persist('sequential', self.position)
+            elif mode == 'shuffle':
+                if not self.bag:
+                    self.bag = list(self.ids)
+                    random.shuffle(self.bag)
+                    # Do not start the new round with the message that ended the last one
+                    if len(self.bag) > 1 and self.bag[-1] == self.last:
+                        self.bag[0], self.bag[-1] = self.bag[-1], self.bag[0]
+                message_id = self.bag.pop()
+                self.persist('shuffle', state=json.dumps(self.bag))
+            elif mode == 'weighted' and self.cumulative[-1] > 0:
+                message_id = self.ids[bisect.bisect(self.cumulative, random.random() * self.cumulative[-1])]
+            else:
+                message_id = random.choice(self.ids)
+            self.last = message_id
+            return dict(self.messages[message_id])
+
+selector = MessageSelector()
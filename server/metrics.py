@@ -0,0 +1,170 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# All metrics that are exposed on /metrics, in registration order
+registry = []
+
+# Format a label set as used by the Prometheus text format
+def format_labels(labelnames, labelvalues, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+# Base class for all metrics
+# Values are kept per label combination, a single lock keeps updates consistent across request threads
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            items = list(self.values.items())
+        for labelvalues, value in items:
+            lines.extend(self.render_value(labelvalues, value))
+        return lines
+
+    def render_value(self, labelvalues, value):
+        return [f'{self.name}{format_labels(self.labelnames, labelvalues)} {value}']
+
+# A monotonically increasing counter
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+# A value that can go up and down
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = value
+
+    def inc(self, amount=1, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def dec(self, amount=1, *labelvalues):
+        self.inc(-amount, *labelvalues)
+
+# A histogram with fixed buckets
+# Every observation is a bisect and three additions, so it is cheap enough for every request
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labelvalues)
+            if state is None:
+                # Bucket counts (the last one is +Inf), sum and count
+                state = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render_value(self, labelvalues, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            labels = format_labels(self.labelnames, labelvalues, f'le="{bound}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = format_labels(self.labelnames, labelvalues)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+# Render all registered metrics in the Prometheus text format
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# Time a block of code and observe the duration on a histogram
+class timed:
+    def __init__(self, histogram, *labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+        return False
+
+# Metrics of the server
+REQUEST_LATENCY = Histogram('weddingring_request_duration_seconds', 'HTTP request latency per blueprint', ('blueprint', 'method'))
+REQUESTS = Counter('weddingring_requests_total', 'HTTP requests per blueprint and status code', ('blueprint', 'method', 'status'))
+BYTES_INGESTED = Counter('weddingring_bytes_ingested_total', 'Request body bytes received per blueprint', ('blueprint',))
+BYTES_SERVED = Counter('weddingring_bytes_served_total', 'Response body bytes sent per blueprint', ('blueprint',))
+DB_LATENCY = Histogram('weddingring_db_duration_seconds', 'Database call latency', ('operation',), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+EXPORTED_BYTES = Counter('weddingring_exported_bytes_total', 'Bytes of recordings copied to USB volumes')
+REPLICATION_LAG_SECONDS = Gauge('weddingring_replication_lag_seconds', 'Seconds since the replica last held every change of its primary')
+REPLICATION_LAG_CHANGES = Gauge('weddingring_replication_lag_changes', 'Changes of the primary the replica has not applied yet')
+REPLICATED_BYTES = Counter('weddingring_replicated_bytes_total', 'Bytes of recordings downloaded from the primary')
+ACTIVE_CALLS = Gauge('weddingring_active_calls', 'Phones that are off-hook')
+SCHEDULER_QUEUED = Gauge('weddingring_scheduler_queued_jobs', 'Background jobs waiting to run')
+SCHEDULER_DECISIONS = Counter('weddingring_scheduler_decisions_total', 'Decisions about background work per task: run, pause, resume, throttle or reduce', ('task', 'decision'))
+SCHEDULER_PAUSED = Counter('weddingring_scheduler_paused_seconds_total', 'Seconds background work waited for calls to end', ('task',))
+SCHEDULER_THROTTLED = Counter('weddingring_scheduler_throttled_seconds_total', 'Seconds transfers were slowed down during calls', ('task',))
+CAPTURE_RECORDINGS = Counter('weddingring_capture_recordings_total', 'Uploaded recordings per device and quality flag, ok if it has none', ('device', 'quality'))
+CAPTURE_XRUNS = Counter('weddingring_capture_xruns_total', 'Overruns arecord reported while recording', ('device',))
+CAPTURE_DROPPED_FRAMES = Counter('weddingring_capture_dropped_frames_total', 'Frames lost to overruns while recording', ('device',))
+CAPTURE_DURATION_MISMATCH = Histogram('weddingring_capture_duration_mismatch_seconds', 'Time of a call missing from its recording', ('device',), buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+CAPTURE_FAILURES = Counter('weddingring_capture_failures_total', 'Recorders that stopped shortly after they were started', ('device',))
+MESSAGE_CACHE_REQUESTS = Counter('weddingring_message_cache_requests_total', 'Message binaries served from memory (hit), read into it (miss) or streamed from the file (bypass)', ('result',))
+MESSAGE_CACHE_BYTES = Gauge('weddingring_message_cache_bytes', 'Bytes of message audio held in memory')
+MESSAGE_CACHE_ENTRIES = Gauge('weddingring_message_cache_entries', 'Messages held in memory')
+MESSAGE_CACHE_BUDGET = Gauge('weddingring_message_cache_budget_bytes', 'Bytes the message cache may hold, follows the available memory')
+MESSAGE_CACHE_EVICTIONS = Counter('weddingring_message_cache_evictions_total', 'Messages dropped from memory to stay within the budget')
+WEBSOCKET_CONNECTIONS = Gauge('weddingring_websocket_connections', 'Open websocket connections')
+WEBSOCKET_FANOUT = Histogram('weddingring_websocket_fanout_seconds', 'Time to send one message to all websocket clients', buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+
+# Record the start of a request
+def start_request_timer():
+    g._metrics_start = time.perf_counter()
+
+# Record latency, status and transferred bytes of a request
+# The websocket route is skipped, its "request" lasts as long as the connection
+def record_request(response):
+    start = g.pop('_metrics_start', None)
+    if start is None or request.endpoint == 'socket':
+        return response
+    blueprint = request.blueprint or 'app'
+    REQUEST_LATENCY.observe(time.perf_counter() - start, blueprint, request.method)
+    REQUESTS.inc(1, blueprint, request.method, str(response.status_code))
+    if request.content_length:
+        BYTES_INGESTED.inc(request.content_length, blueprint)
+    if response.content_length:
+        BYTES_SERVED.inc(response.content_length, blueprint)
+    return response
+
+# Register the request hooks on the app
+def register_request_hooks(app):
+    app.before_request(start_request_timer)
+    app.after_request(record_request)
@@ -0,0 +1,277 @@
+import os
+import time
+from database import add_column
+from audio_utils import read_wav_header, audio_metadata, AUDIO_COLUMNS
+
+# Versioned schema migrations
+# Every migration runs once per database, in order, and is recorded in the schema_version table.
+# All pending migrations run at startup in one transaction, so a device that loses power half way
+# keeps its old schema and simply migrates again on the next start.
+# Add new migrations at the end of MIGRATIONS and never change one that was released.
+
+# Tables holding audio files and the folder of their files
+AUDIO_TABLES = {'records': 'recordings', 'messages': 'messages'}
+
+# 1: the schema as it was built by init_db before migrations existed
+# Databases of that time are at any of its steps, so every statement is idempotent
+def baseline(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS records (
+            id TEXT PRIMARY KEY,
+            recordTimestamp INTEGER,
+            length INTEGER
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id TEXT PRIMARY KEY,
+            recordTimestamp INTEGER,
+            length INTEGER
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS config (
+            id INTEGER PRIMARY KEY,
+            autoRing BOOLEAN DEFAULT 0,
+            autoRingMinSpan INTEGER DEFAULT 60,
+            autoRingMaxSpan INTEGER DEFAULT 600,
+            ringOnTime INTEGER DEFAULT 1,
+            ringOffTime INTEGER DEFAULT 1,
+            messages BOOLEAN DEFAULT 1,
+            randomMessages BOOLEAN DEFAULT 1,
+            ringCount INTEGER DEFAULT 4
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO config (id) VALUES (1)
+    ''')
+    # Index of the audio files seen by the reconciler, keyed by folder and file name
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_index (
+            folder TEXT,
+            name TEXT,
+            inode INTEGER,
+            mtime INTEGER,
+            size INTEGER,
+            status TEXT,
+            PRIMARY KEY (folder, name)
+        )
+    ''')
+    # Records whose row is deleted but whose file might still exist, see bulk.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tombstones (
+            folder TEXT,
+            id TEXT,
+            PRIMARY KEY (folder, id)
+        )
+    ''')
+    # Content addressed storage, see blob_store.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            checksum TEXT PRIMARY KEY,
+            size INTEGER,
+            refCount INTEGER
+        )
+    ''')
+    for table in ('records', 'messages'):
+        add_column(cursor, table, 'checksum', 'TEXT')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_checksum ON {table} (checksum)')
+    # Journal of the records exported to every USB volume, see export.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exports (
+            volume TEXT,
+            recordId TEXT,
+            checksum TEXT,
+            exportedAt INTEGER,
+            PRIMARY KEY (volume, recordId)
+        )
+    ''')
+    # Message selection, see message_selector.py
+    add_column(cursor, 'messages', 'weight', 'REAL DEFAULT 1')
+    add_column(cursor, 'config', 'messageMode', 'TEXT')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_cursor (
+            mode TEXT PRIMARY KEY,
+            position INTEGER,
+            state TEXT
+        )
+    ''')
+    # Quiet hours of the automated ring as "HH:MM" in local time
+    add_column(cursor, 'config', 'autoRingQuietStart', 'TEXT')
+    add_column(cursor, 'config', 'autoRingQuietEnd', 'TEXT')
+    # Part of a record that is played in the reel, offsets in milliseconds, see reel.py
+    add_column(cursor, 'records', 'trimStart', 'INTEGER')
+    add_column(cursor, 'records', 'trimEnd', 'INTEGER')
+    # Hourly statistics, see stats.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_hourly (
+            hour INTEGER PRIMARY KEY,
+            records INTEGER DEFAULT 0,
+            recordedMs INTEGER DEFAULT 0,
+            pickups INTEGER DEFAULT 0,
+            rings INTEGER DEFAULT 0,
+            missedRings INTEGER DEFAULT 0,
+            autoRings INTEGER DEFAULT 0,
+            missedAutoRings INTEGER DEFAULT 0
+        )
+    ''')
+    # The triggers run in the transaction of the insert or delete, so the rollup never drifts from the records
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_record_insert AFTER INSERT ON records BEGIN
+            INSERT OR IGNORE INTO stats_hourly (hour) VALUES (NEW.recordTimestamp - NEW.recordTimestamp % 3600);
+            UPDATE stats_hourly SET records = records + 1, recordedMs = recordedMs + COALESCE(NEW.length, 0)
+            WHERE hour = NEW.recordTimestamp - NEW.recordTimestamp % 3600;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_record_delete AFTER DELETE ON records BEGIN
+            UPDATE stats_hourly SET records = records - 1, recordedMs = recordedMs - COALESCE(OLD.length, 0)
+            WHERE hour = OLD.recordTimestamp - OLD.recordTimestamp % 3600;
+        END
+    ''')
+    # Call quality measured by the interface while recording, see parse_quality in audio_utils.py
+    add_column(cursor, 'records', 'rmsDb', 'REAL')
+    add_column(cursor, 'records', 'peakDb', 'REAL')
+    add_column(cursor, 'records', 'silenceMs', 'INTEGER')
+    add_column(cursor, 'records', 'clippingMs', 'INTEGER')
+    add_column(cursor, 'records', 'quality', 'TEXT')
+    # Records stored before the statistics existed are counted once, the backfill is idempotent
+    from stats import backfill_records
+    backfill_records(cursor)
+
+# 2: the format of every audio file, stored with its row
+# Slices, reels and exports take the format from the row instead of opening the file for it.
+# Existing rows are filled in from the header of their file, the audio data is never read.
+def audio_metadata_columns(cursor):
+    for table, folder in AUDIO_TABLES.items():
+        add_column(cursor, table, 'sizeBytes', 'INTEGER')
+        add_column(cursor, table, 'sampleRate', 'INTEGER')
+        add_column(cursor, table, 'channels', 'INTEGER')
+        add_column(cursor, table, 'bitDepth', 'INTEGER')
+        add_column(cursor, table, 'blockAlign', 'INTEGER')
+        add_column(cursor, table, 'dataOffset', 'INTEGER')
+        add_column(cursor, table, 'dataSize', 'INTEGER')
+        add_column(cursor, table, 'fmtChunk', 'BLOB')
+        # Time ranges are selected by the reel, the statistics, bulk operations and the export
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_recordTimestamp ON {table} (recordTimestamp)')
+        updates = []
+        for (row_id,) in cursor.execute(f'SELECT id FROM {table} WHERE sizeBytes IS NULL').fetchall():
+            try:
+                header = read_wav_header(os.path.join(folder, f"{row_id}.wav"))
+            except OSError:
+                continue
+            if header:
+                updates.append((*audio_metadata(header).values(), row_id))
+        assignments = ', '.join(f'{column} = ?' for column in AUDIO_COLUMNS)
+        cursor.executemany(f'UPDATE {table} SET {assignments} WHERE id = ?', updates)
+
+# 3: several phone interfaces per server, see devices.py
+# Records remember the interface that recorded them, older records have no device id
+def devices(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS devices (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            config TEXT,
+            firstSeen INTEGER,
+            lastSeen INTEGER
+        )
+    ''')
+    add_column(cursor, 'records', 'deviceId', 'TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS records_deviceId ON records (deviceId)')
+
+# 4: change sequence of the records, read by replicas, see replication.py
+# Every insert, delete and trim of a record is appended by triggers in the transaction of the change.
+# Existing records are added as inserts in the order they were recorded.
+def record_changes(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            recordId TEXT NOT NULL,
+            op TEXT NOT NULL,
+            changedAt INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS changes_recordId ON changes (recordId)')
+    for op, event, row in (('insert', 'INSERT', 'NEW'), ('delete', 'DELETE', 'OLD'), ('update', 'UPDATE OF trimStart, trimEnd', 'NEW')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS changes_record_{op} AFTER {event} ON records BEGIN
+                INSERT INTO changes (recordId, op, changedAt) VALUES ({row}.id, '{op}', CAST(strftime('%s', 'now') AS INTEGER));
+            END
+        ''')
+    cursor.execute('''
+        INSERT INTO changes (recordId, op, changedAt)
+        SELECT id, 'insert', COALESCE(recordTimestamp, 0) FROM records
+        WHERE id NOT IN (SELECT recordId FROM changes) ORDER BY recordTimestamp, id
+    ''')
+    # Position of a replica in the change sequence of its primary
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS replication_state (
+            source TEXT PRIMARY KEY,
+            lastSeq INTEGER DEFAULT 0,
+            caughtUpAt INTEGER
+        )
+    ''')
+
+# Health of the capture pipeline reported by the interfaces with every recording, see interface/capture.py
+# The period and buffer time of arecord are in microseconds, NULL keeps the defaults of ALSA
+def capture_health(cursor):
+    for column in ('xruns', 'droppedFrames', 'durationMismatchMs', 'periodFrames', 'bufferFrames'):
+        add_column(cursor, 'records', column, 'INTEGER')
+    add_column(cursor, 'config', 'capturePeriodTime', 'INTEGER')
+    add_column(cursor, 'config', 'captureBufferTime', 'INTEGER')
+
+# Migrations as (version, name, function), the function gets a cursor inside the migration transaction
+MIGRATIONS = [
+    (1, 'baseline', baseline),
+    (2, 'audio metadata columns', audio_metadata_columns),
+    (3, 'devices', devices),
+    (4, 'record changes', record_changes),
+    (5, 'capture health', capture_health)
+]
+
+# Latest version of the schema
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Version the database is at, 0 for a new database
+def current_version(db):
+    exists = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'").fetchone()
+    if not exists:
+        return 0
+    return db.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+# Run all pending migrations in one transaction
+# Returns the names of the migrations that ran, empty if the schema was up to date
+def migrate(db):
+    if current_version(db) == LATEST_VERSION:
+        return []
+    applied = []
+    cursor = db.cursor()
+    # sqlite3 does not open a transaction for schema changes by itself
+    cursor.execute('BEGIN')
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                appliedAt INTEGER,
+                durationMs REAL
+            )
+        ''')
+        version = current_version(db)
+        for migration_version, name, function in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            started = time.perf_counter()
+            function(cursor)
+            cursor.execute(
+                'INSERT INTO schema_version (version, name, appliedAt, durationMs) VALUES (?, ?, ?, ?)',
+                (migration_version, name, int(time.time()), round((time.perf_counter() - started) * 1000, 3))
+            )
+            applied.append(name)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    print(f"Migrated the database to version {LATEST_VERSION}: {', '.join(applied)}")
+    return applied
@@ -0,0 +1,141 @@
+import os
+import time
+from database import get_db
+from bulk import purge_tombstones
+from blob_store import BLOB_FOLDER, reconcile_blobs, deduplicate
+from message_selector import selector
+from message_cache import message_cache
+from scheduler import checkpoint
+from audio_utils import read_wav_header, header_meets_requirements, audio_metadata, AUDIO_COLUMNS
+from endpoints.records import UPLOAD_FOLDER as RECORDS_FOLDER
+from endpoints.messages import UPLOAD_FOLDER as MESSAGES_FOLDER
+
+# Tables that are reconciled and the folder holding their audio files
+FOLDERS = {
+    'records': RECORDS_FOLDER,
+    'messages': MESSAGES_FOLDER
+}
+
+# Files younger than this are skipped, they might belong to an upload that is still in progress
+GRACE_PERIOD = 60
+
+# Reconcile a single table with its folder
+# Every file is indexed by inode, mtime and size. Files that did not change since the last run
+# and still have a row are skipped without any further work, so repeated runs only cost one stat per file.
+# Orphan files (file without row) are re-imported after parsing their header only.
+# Dangling rows (row without file) are removed.
+def reconcile_table(table, folder):
+    db = get_db()
+    report = {
+        'scanned': 0,
+        'unchanged': 0,
+        'orphansImported': [],
+        'orphansInvalid': [],
+        'danglingRemoved': []
+    }
+
+    if not os.path.isdir(folder):
+        # Without the folder we can not tell missing files from a missing mount, so nothing is removed
+        return report
+
+    cursor = db.cursor()
+    # Plain tuples are a lot cheaper than sqlite3.Row when loading thousands of rows
+    cursor.row_factory = None
+    rows = {row[0] for row in cursor.execute(f'SELECT id FROM {table}')}
+    index = {
+        row[0]: row[1:]
+        for row in cursor.execute('SELECT name, inode, mtime, size, status FROM file_index WHERE folder = ?', (table,))
+    }
+    cursor.close()
+
+    now = time.time()
+    seen = set()
+    index_updates = []
+    imports = []
+
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.wav') or not entry.is_file(follow_symlinks=False):
+                continue
+            report['scanned'] += 1
+            record_id = entry.name[:-4]
+            seen.add(entry.name)
+            stat = entry.stat(follow_symlinks=False)
+            key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            known = index.get(entry.name)
+            unchanged = known is not None and known[:3] == key
+
+            if record_id in rows:
+                if unchanged and known[3] == 'ok':
+                    report['unchanged'] += 1
+                else:
+                    index_updates.append((table, entry.name, *key, 'ok'))
+                continue
+
+            # The file has no row, skip it if we already know it is invalid
+            if unchanged and known[3] == 'invalid':
+                report['unchanged'] += 1
+                continue
+            if now - stat.st_mtime < GRACE_PERIOD:
+                continue
+
+            try:
+                header = read_wav_header(entry.path)
+            except OSError:
+                header = None
+            if header_meets_requirements(header):
+                imports.append((record_id, int(stat.st_mtime), header['length'], *audio_metadata(header).values()))
+                index_updates.append((table, entry.name, *key, 'ok'))
+                report['orphansImported'].append(record_id)
+            else:
+                index_updates.append((table, entry.name, *key, 'invalid'))
+                report['orphansInvalid'].append(record_id)
+
+    dangling = [record_id for record_id in rows if f"{record_id}.wav" not in seen]
+    vanished = [name for name in index if name not in seen]
+    report['danglingRemoved'] = dangling
+
+    if imports or dangling or index_updates or vanished:
+        db.executemany(
+            f"INSERT OR IGNORE INTO {table} (id, recordTimestamp, length, {', '.join(AUDIO_COLUMNS)}) VALUES ({', '.join('?' * (3 + len(AUDIO_COLUMNS)))})",
+            imports
+        )
+        db.executemany(f'DELETE FROM {table} WHERE id = ?', [(record_id,) for record_id in dangling])
+        db.executemany(
+            'INSERT OR REPLACE INTO file_index (folder, name, inode, mtime, size, status) VALUES (?, ?, ?, ?, ?, ?)',
+            index_updates
+        )
+        db.executemany(
+            'DELETE FROM file_index WHERE folder = ? AND name = ?',
+            [(table, name) for name in vanished]
+        )
+        db.commit()
+
+    return report
+
+# Reconcile all tables with their folders
+# Deletes interrupted by a crash are finished first, so their files are not re-imported as orphans.
+# The blob store is checked last, after dangling rows have released their blobs.
+# Returns a report per table and the overall duration in milliseconds
+def reconcile():
+    start = time.perf_counter()
+    report = {'tombstonesPurged': purge_tombstones(dict(FOLDERS, blobs=BLOB_FOLDER))}
+    for table, folder in FOLDERS.items():
+        # Every table is scanned in one go, a call that starts in between is waited for before the next one
+        checkpoint('reconcile')
+        report[table] = reconcile_table(table, folder)
+    report['blobs'] = reconcile_blobs(list(FOLDERS), GRACE_PERIOD)
+    # Messages might have been imported or removed, the selector loads them again
+    selector.invalidate()
+    message_cache.clear()
+    report['durationMs'] = round((time.perf_counter() - start) * 1000, 3)
+    return report
+
+# Move all files stored before content addressing into the blob store, see blob_store.deduplicate
+def deduplicate_files():
+    start = time.perf_counter()
+    report = deduplicate(FOLDERS)
+    # The checksums of messages might have been filled in
+    selector.invalidate()
+    report['durationMs'] = round((time.perf_counter() - start) * 1000, 3)
+    return report
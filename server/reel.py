@@ -0,0 +1,167 @@
+import os
+import bisect
+import hashlib
+from database import query_db
+from audio_utils import stored_header, build_wav_header, AUDIO_COLUMNS, SLICE_CHUNK_SIZE
+from endpoints.messages import UPLOAD_FOLDER as MESSAGES_FOLDER
+
+# The guestbook reel: all records of a time range played back to back as one wav file
+# The reel is never written to disk. It is laid out as a list of segments (the header, spans of the
+# record files and silence) whose sizes are known up front, so the Content-Length is exact, any byte
+# range can be served by seeking into the right segment and the memory use does not depend on the
+# number or the length of the records.
+
+# Largest data chunk a wav file can describe, the RIFF size field has 32 bits
+MAX_DATA_SIZE = 0xFFFFFFFF - 256
+
+# Sort orders of the reel by recordTimestamp
+ORDERS = {'asc': 'ASC', 'desc': 'DESC'}
+
+# Longest gap between two records in milliseconds
+MAX_GAP = 10000
+
+# Silence is streamed from this buffer
+SILENCE = bytes(SLICE_CHUNK_SIZE)
+
+# Raised when a reel can not be built, e.g. because the chime does not exist
+class ReelError(Exception):
+    pass
+
+# Format of a wav file that has to match for two files to be concatenated
+def audio_format(header):
+    return header['sampleRate'], header['channels'], header['bitDepth'], header['blockAlign']
+
+# Span of the data chunk of a wav file, limited to the stored trim offsets in milliseconds
+# Returns the offset and the size of the span in the file, the size is 0 if nothing is left
+def trimmed_span(header, trim_start=None, trim_end=None):
+    frames = header['dataSize'] // header['blockAlign']
+    start = min(frames, (trim_start or 0) * header['sampleRate'] // 1000)
+    end = frames if trim_end is None else min(frames, trim_end * header['sampleRate'] // 1000)
+    return header['dataOffset'] + start * header['blockAlign'], max(0, end - start) * header['blockAlign']
+
+class Reel:
+    def __init__(self):
+        # Segments as (size, source, offset), source is bytes, a file path or None for silence
+        self.segments = []
+        self.starts = []
+        self.size = 0
+        self.records = []
+        self.skipped = []
+        self.etag = None
+
+    def append(self, size, source, offset=0):
+        if size:
+            self.starts.append(self.size)
+            self.segments.append((size, source, offset))
+            self.size += size
+
+    # Stream the bytes from start up to, but not including, end
+    # A file that became shorter since the reel was built is padded with silence, so the
+    # promised length is always kept
+    def stream(self, start, end):
+        index = bisect.bisect_right(self.starts, start) - 1
+        position = start
+        while position < end:
+            size, source, offset = self.segments[index]
+            within = position - self.starts[index]
+            length = min(size - within, end - position)
+            if isinstance(source, bytes):
+                yield source[within:within + length]
+            elif source is None:
+                remaining = length
+                while remaining:
+                    yield SILENCE[:min(remaining, len(SILENCE))]
+                    remaining -= min(remaining, len(SILENCE))
+            else:
+                remaining = length
+                try:
+                    with open(source, 'rb') as f:
+                        f.seek(offset + within)
+                        while remaining:
+                            chunk = f.read(min(remaining, SLICE_CHUNK_SIZE))
+                            if not chunk:
+                                break
+                            remaining -= len(chunk)
+                            yield chunk
+                except FileNotFoundError:
+                    pass
+                while remaining:
+                    yield SILENCE[:min(remaining, len(SILENCE))]
+                    remaining -= min(remaining, len(SILENCE))
+            position += length
+            index += 1
+
+# Lay out the reel of all records between the timestamps from and to (inclusive, both optional)
+# gap is the silence in milliseconds between two records, chime the id of a message played between them.
+# With trim set, the trimStart/trimEnd offsets stored for a record are applied.
+# Records whose file is missing or whose format differs from the first record are skipped.
+def build_reel(folder, start=None, end=None, order='asc', gap=0, chime=None, trim=True):
+    clauses = []
+    args = []
+    if start is not None:
+        clauses.append('recordTimestamp >= ?')
+        args.append(start)
+    if end is not None:
+        clauses.append('recordTimestamp <= ?')
+        args.append(end)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    columns = ', '.join(AUDIO_COLUMNS)
+    rows = query_db(f'SELECT id, checksum, trimStart, trimEnd, {columns} FROM records {where} ORDER BY recordTimestamp {ORDERS[order]}, id', args)
+
+    reel = Reel()
+    entries = []
+    reference = None
+    for row in rows:
+        file_path = os.path.join(folder, f"{row['id']}.wav")
+        # The format is stored with the record, so laying out the reel does not open the files
+        try:
+            header = stored_header(row, file_path) if os.path.exists(file_path) else None
+        except OSError:
+            header = None
+        if header is None or (reference is not None and audio_format(header) != audio_format(reference)):
+            reel.skipped.append(row['id'])
+            continue
+        offset, size = trimmed_span(header, row['trimStart'], row['trimEnd']) if trim else trimmed_span(header)
+        if size == 0:
+            continue
+        if reference is None:
+            reference = header
+        entries.append((file_path, offset, size))
+        reel.records.append(row['id'])
+    if reference is None:
+        return reel
+
+    separator = []
+    block_align = reference['blockAlign']
+    gap_size = gap * reference['sampleRate'] // 1000 * block_align
+    if chime:
+        chime_path = os.path.join(MESSAGES_FOLDER, f"{chime}.wav")
+        chime_row = query_db(f'SELECT {columns} FROM messages WHERE id = ?', [chime], one=True)
+        chime_header = stored_header(chime_row, chime_path) if chime_row and os.path.exists(chime_path) else None
+        if chime_header is None:
+            raise ReelError('The chime message does not exist')
+        if audio_format(chime_header) != audio_format(reference):
+            raise ReelError('The chime message has a different audio format than the records')
+        chime_offset, chime_size = trimmed_span(chime_header)
+        separator = [(gap_size, None, 0), (chime_size, chime_path, chime_offset), (gap_size, None, 0)]
+    elif gap_size:
+        separator = [(gap_size, None, 0)]
+
+    data_size = sum(size for _, _, size in entries) + sum(size for size, _, _ in separator) * (len(entries) - 1)
+    if data_size > MAX_DATA_SIZE:
+        raise ReelError('The reel is larger than a wav file can be, select a shorter time range')
+    header = build_wav_header(reference['fmtChunk'], data_size)
+    reel.append(len(header), header)
+    for index, (file_path, offset, size) in enumerate(entries):
+        if index:
+            for segment in separator:
+                reel.append(*segment)
+        reel.append(size, file_path, offset)
+
+    # The reel changes if a record, its trim offsets or the parameters change
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(f"{row['id']}:{row['checksum']}:{row['trimStart']}:{row['trimEnd']};".encode())
+    digest.update(f"{order}:{gap}:{chime}:{trim}:{reel.size}".encode())
+    reel.etag = digest.hexdigest()
+    return reel
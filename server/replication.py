@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+from database import query_db, transaction
+from blob_store import hash_file, commit_uploads, BLOB_FOLDER
+from bulk import delete_records
+from audio_utils import public_row, QUALITY_FIELDS
+from scheduler import TokenBucket, checkpoint
+from metrics import REPLICATION_LAG_SECONDS, REPLICATION_LAG_CHANGES, REPLICATED_BYTES
+from endpoints.records import UPLOAD_FOLDER as RECORDS_FOLDER
+
+# Replication of the records to a second server
+# Every insert, delete and trim of a record is appended to the changes table by triggers (see migrations.py).
+# A replica started with WEDDINGRING_REPLICATE_FROM pulls the changes after the last one it applied from
+# GET /replication/changes of its primary and applies them one by one. The binary of a new record is
+# downloaded in Range requests into a .part file that survives restarts, so an interrupted download continues
+# where it stopped, and it is only stored once it matches the checksum of the primary. The position in the
+# change sequence is stored after every applied change, so a replica that lost its primary for a while
+# (or was restarted) converges once the primary is reachable again.
+
+# Base URL of the primary, e.g. http://weddingring-1.local:8080, replication is off without it
+SOURCE = os.environ.get('WEDDINGRING_REPLICATE_FROM')
+
+# Bandwidth limit of the downloads in bytes per second, 0 for no limit
+# The default keeps enough of the WiFi of the Raspberry Pi for the interface and the browsers
+RATE_LIMIT = int(os.environ.get('WEDDINGRING_REPLICATION_RATE', 512 * 1024))
+
+# Seconds between two polls of the primary
+POLL_INTERVAL = float(os.environ.get('WEDDINGRING_REPLICATION_INTERVAL', 5))
+
+# Longest pause after failed polls, the pause doubles with every failure up to this
+MAX_BACKOFF = 60
+
+# Changes fetched per request
+PAGE_SIZE = 100
+
+# Bytes fetched per Range request, an interrupted download loses at most the chunk in flight
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Bytes read from the response at once, the bandwidth limit is applied per read
+READ_SIZE = 16 * 1024
+
+# Seconds to wait for the primary before a request fails
+TIMEOUT = 30
+
+# Partial downloads, kept apart from the blob folder whose stale temporary files are removed by the reconciler
+PART_FOLDER = 'replica'
+
+# Columns of a record that are copied from the primary in addition to the audio and its metadata
+REPLICATED_COLUMNS = ('deviceId', 'trimStart', 'trimEnd', *QUALITY_FIELDS)
+
+# Raised when a change can not be applied, it is retried on the next poll
+class ReplicationError(Exception):
+    pass
+
+# State of the replica, returned by GET /replication
+status = {'state': 'disabled', 'source': None}
+status_lock = threading.Lock()
+
+def publish(**changes):
+    with status_lock:
+        status.update(changes)
+
+def get_status():
+    with status_lock:
+        return dict(status)
+
+# Latest change of every record after a sequence number, at most limit of them
+# A record that changed several times is only listed with its last change, whose op is replaced by delete if the
+# record no longer exists. Inserted and updated records carry their row, see public_row.
+def changes_after(after, limit):
+    rows = query_db('''
+        SELECT c.seq, c.recordId, c.op, c.changedAt, r.id IS NOT NULL AS present
+        FROM changes c LEFT JOIN records r ON r.id = c.recordId
+        WHERE c.seq > ? AND c.seq = (SELECT MAX(seq) FROM changes WHERE recordId = c.recordId)
+        ORDER BY c.seq LIMIT ?
+    ''', (after, limit))
+    ids = [row['recordId'] for row in rows if row['present']]
+    records = {}
+    if ids:
+        records = {row['id']: row for row in query_db(f"SELECT * FROM records WHERE id IN ({', '.join('?' * len(ids))})", ids)}
+    changes = []
+    for row in rows:
+        change = {'seq': row['seq'], 'id': row['recordId'], 'op': row['op'], 'changedAt': row['changedAt']}
+        if row['recordId'] in records:
+            change['record'] = public_row(records[row['recordId']])
+        else:
+            change['op'] = 'delete'
+        changes.append(change)
+    return changes
+
+# Highest sequence number and the time of that change
+def latest_change():
+    row = query_db('SELECT seq, changedAt FROM changes ORDER BY seq DESC LIMIT 1', one=True)
+    return (row['seq'], row['changedAt']) if row else (0, None)
+
+# Pulls the changes of a primary in a background thread
+class Replicator:
+    def __init__(self, app, source, rate=RATE_LIMIT, interval=POLL_INTERVAL):
+        if '://' not in source:
+            source = f"http://{source}"
+        self.app = app
+        self.source = source.rstrip('/')
+        self.interval = interval
+        self.bucket = TokenBucket(rate)
+        self.stopping = threading.Event()
+        self.thread = None
+        self.started_at = int(time.time())
+
+    def start(self):
+        publish(state='starting', source=self.source, error=None)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+
+    # Poll the primary until stopped
+    # Failed polls are retried with a growing pause, the lag keeps being updated in between
+    def run(self):
+        failures = 0
+        next_poll = 0
+        while not self.stopping.is_set():
+            with self.app.app_context():
+                if time.monotonic() >= next_poll:
+                    try:
+                        self.sync()
+                        failures = 0
+                    except (OSError, ValueError, ReplicationError) as e:
+                        # URLError and HTTPError are OSErrors, e.g. while the primary is unreachable
+                        failures += 1
+                        publish(state='failed', error=str(e))
+                        print(f"Replication from {self.source} failed: {e}")
+                    next_poll = time.monotonic() + min(self.interval * 2 ** failures, MAX_BACKOFF)
+                self.update_lag()
+            self.stopping.wait(self.interval)
+
+    def fetch(self, path, headers=None):
+        request = urllib.request.Request(self.source + path, headers=headers or {})
+        return urllib.request.urlopen(request, timeout=TIMEOUT)
+
+    # Apply all changes the primary has after the stored position
+    def sync(self):
+        publish(state='syncing', error=None)
+        while not self.stopping.is_set():
+            last_seq = self.load_state()['lastSeq']
+            with self.fetch(f"/replication/changes?after={last_seq}&limit={PAGE_SIZE}") as response:
+                page = json.loads(response.read())
+            publish(latestSeq=page['latestSeq'])
+            for change in page['changes']:
+                if self.stopping.is_set():
+                    return
+                # Copying waits while a guest is on the phone, see scheduler.py
+                checkpoint('replication')
+                self.apply(change)
+                last_seq = change['seq']
+                self.save_state(lastSeq=last_seq)
+                REPLICATION_LAG_CHANGES.set(max(page['latestSeq'] - last_seq, 0))
+            if not page['changes'] or last_seq >= page['latestSeq']:
+                # Everything the primary had when it answered is applied
+                self.save_state(lastSeq=max(last_seq, page['latestSeq']), caughtUpAt=int(time.time()))
+                REPLICATION_LAG_CHANGES.set(0)
+                publish(state='idle', lastSyncAt=int(time.time()))
+                return
+
+    # Apply a single change, applying it twice has no further effect
+    def apply(self, change):
+        record_id = change['id']
+        if change['op'] == 'delete':
+            # A download the record was deleted in the middle of is not continued
+            part = os.path.join(PART_FOLDER, f"{record_id}.part")
+            if os.path.exists(part):
+                os.remove(part)
+            if delete_records('records', RECORDS_FOLDER, 'id = ?', (record_id,)):
+                print(f"Replicated deletion of record {record_id}")
+            return
+        record = change['record']
+        existing = query_db('SELECT * FROM records WHERE id = ?', (record_id,), one=True)
+        if existing is None:
+            self.copy_record(record)
+            existing = query_db('SELECT * FROM records WHERE id = ?', (record_id,), one=True)
+            if existing is None:
+                # The audio is already stored under another id, see copy_record
+                return
+        changed = {column: record.get(column) for column in REPLICATED_COLUMNS if existing[column] != record.get(column)}
+        if changed:
+            with transaction() as db:
+                db.execute(f"UPDATE records SET {', '.join(f'{column} = ?' for column in changed)} WHERE id = ?",
+                           (*changed.values(), record_id))
+
+    # Download a new record and store it with the id and the timestamp it has on the primary
+    def copy_record(self, record):
+        checksum = record.get('checksum')
+        if checksum and query_db('SELECT 1 FROM records WHERE checksum = ?', (checksum,), one=True):
+            # Identical audio, e.g. uploaded to both servers, is only stored once
+            print(f"Record {record['id']} is already stored under another id")
+            return
+        part = self.download(record)
+        columns = {column: record.get(column) for column in REPLICATED_COLUMNS if record.get(column) is not None}
+        commit_uploads([{
+            'tmp': part,
+            'checksum': checksum or hash_file(part),
+            'size': os.path.getsize(part),
+            'length': record.get('length'),
+            'id': record['id'],
+            'recordTimestamp': record.get('recordTimestamp'),
+            'columns': columns
+        }], 'records', RECORDS_FOLDER)
+        print(f"Replicated record {record['id']}")
+
+    # Download the binary of a record into its .part file and verify it
+    # A .part file left by an earlier attempt is continued
+    def download(self, record):
+        os.makedirs(PART_FOLDER, exist_ok=True)
+        os.makedirs(BLOB_FOLDER, exist_ok=True)
+        part = os.path.join(PART_FOLDER, f"{record['id']}.part")
+        total = record.get('sizeBytes')
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if total is not None and offset > total:
+            offset = 0
+            os.remove(part)
+        with open(part, 'ab') as f:
+            while total is None or offset < total:
+                checkpoint('replication')
+                end = offset + DOWNLOAD_CHUNK_SIZE - 1
+                try:
+                    response = self.fetch(f"/records/{record['id']}/binary", {'Range': f"bytes={offset}-{end}"})
+                except urllib.error.HTTPError as e:
+                    if e.code == 416 and total is None and offset > 0:
+                        # The .part file already holds the whole file
+                        break
+                    raise
+                with response:
+                    if response.status != 206:
+                        raise ReplicationError(f"Primary answered {response.status} to a Range request")
+                    # Content-Range: bytes <start>-<end>/<total>
+                    total = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+                    while True:
+                        data = response.read(READ_SIZE)
+                        if not data:
+                            break
+                        self.bucket.consume(len(data))
+                        f.write(data)
+                        offset += len(data)
+                        REPLICATED_BYTES.inc(len(data))
+            f.flush()
+            os.fsync(f.fileno())
+        if record.get('checksum') and hash_file(part) != record['checksum']:
+            # Start over on the next attempt
+            os.remove(part)
+            raise ReplicationError(f"Download of record {record['id']} does not match its checksum")
+        return part
+
+    # Position of the replica in the change sequence of its primary
+    def load_state(self):
+        row = query_db('SELECT * FROM replication_state WHERE source = ?', (self.source,), one=True)
+        return dict(row) if row else {'source': self.source, 'lastSeq': 0, 'caughtUpAt': None}
+
+    def save_state(self, **changes):
+        state = dict(self.load_state(), **changes)
+        with transaction() as db:
+            db.execute('INSERT OR REPLACE INTO replication_state (source, lastSeq, caughtUpAt) VALUES (?, ?, ?)',
+                       (self.source, state['lastSeq'], state['caughtUpAt']))
+        publish(lastSeq=state['lastSeq'], caughtUpAt=state['caughtUpAt'])
+
+    # The lag is the time since the replica last held every change of its primary
+    # It grows while the primary is unreachable or a backlog is copied and drops to zero once the replica caught up
+    def update_lag(self):
+        caught_up_at = self.load_state()['caughtUpAt']
+        if caught_up_at is None:
+            # Never caught up, the lag counts from the start of the replica
+            caught_up_at = self.started_at
+        lag = max(int(time.time()) - caught_up_at, 0)
+        REPLICATION_LAG_SECONDS.set(lag)
+        publish(lagSeconds=lag)
+
+# The running replicator, None if this server is not a replica
+replicator = None
+
+# Start replicating from WEDDINGRING_REPLICATE_FROM if it is set
+# app is the Flask app, the thread needs its own app context for the database
+def start_replication(app):
+    global replicator
+    if not SOURCE or replicator is not None:
+        return replicator
+    replicator = Replicator(app, SOURCE)
+    replicator.start()
+    print(f"Replicating records from {replicator.source}")
+    return replicator
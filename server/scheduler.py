@@ -0,0 +1,250 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+from websocket_utils import subscribe
+from metrics import ACTIVE_CALLS, SCHEDULER_QUEUED, SCHEDULER_DECISIONS, SCHEDULER_PAUSED, SCHEDULER_THROTTLED
+
+# Background work that steps back while a guest is on the phone
+# The server follows the hook states the interfaces report (STATUS:OFF_HOOK and STATUS:ON_HOOK). While any phone is
+# off-hook, and for RESUME_DELAY seconds after the last one was hung up so the recording can be uploaded, heavy work
+# must not compete with arecord for the SD card and the CPU:
+# - jobs (exports, maintenance) run one at a time by priority on a single worker thread with a lower CPU priority,
+#   a job is only started outside of calls and pauses at its next checkpoint when a call starts
+# - code that runs in other threads (replication, batch imports) calls checkpoint between its units of work
+# - transfers that answer a request (the zip of all recordings) are throttled to THROTTLE_RATE instead of paused,
+#   so the browser keeps receiving data
+# Requests that are not part of these are never held back.
+
+# Priorities of jobs, lower ones run first
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+# Seconds after the last call ended before heavy work resumes
+RESUME_DELAY = float(os.environ.get('WEDDINGRING_RESUME_DELAY', 10))
+
+# A phone reported off-hook for longer than this is no longer counted as a call, so a state that was never
+# followed by ON_HOOK (e.g. the interface restarted without reconnecting) does not hold back the work forever
+MAX_CALL_SECONDS = 15 * 60
+
+# Bytes per second of all throttled transfers together during a call
+THROTTLE_RATE = int(os.environ.get('WEDDINGRING_THROTTLE_RATE', 256 * 1024))
+
+# Niceness of the worker thread, the interface and the request threads keep precedence on the CPU
+WORKER_NICENESS = 10
+
+# Finished jobs that are kept for GET /scheduler
+KEEP_FINISHED = 20
+
+# Paces transfers to a number of bytes per second
+# Bytes taken beyond the budget are paid back by sleeping, a burst of up to one second is allowed after a pause.
+# Returns the seconds slept
+class TokenBucket:
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate) - amount
+            self.updated = now
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+        return delay
+
+# Calls in progress by device id (None for interfaces without one) with the time they started
+calls = {}
+# Time the last call ended
+last_call_ended = None
+calls_changed = threading.Condition()
+
+# Follow the hook states reported by the interfaces
+# A repeated OFF_HOOK keeps the start of the call, unless that call is no longer counted: then the interface missed
+# its ON_HOOK (e.g. it restarted) and this is a new call
+def track_call(status, device_id):
+    if status not in ('OFF_HOOK', 'ON_HOOK', 'RINGING'):
+        return
+    if status != 'OFF_HOOK':
+        end_call(device_id)
+        return
+    now = time.monotonic()
+    with calls_changed:
+        started = calls.get(device_id)
+        if started is None or now - started >= MAX_CALL_SECONDS:
+            calls[device_id] = now
+        ACTIVE_CALLS.set(len(calls))
+        calls_changed.notify_all()
+
+subscribe('STATUS:', track_call)
+
+# The call of an interface ended, also called when it disconnected since it can not report ON_HOOK anymore
+def end_call(device_id):
+    global last_call_ended
+    with calls_changed:
+        if calls.pop(device_id, None) is not None:
+            last_call_ended = time.monotonic()
+        ACTIVE_CALLS.set(len(calls))
+        calls_changed.notify_all()
+
+# Seconds until heavy work may run, 0 if no call is in progress or just ended
+def busy_for():
+    now = time.monotonic()
+    with calls_changed:
+        ongoing = [started for started in calls.values() if now - started < MAX_CALL_SECONDS]
+        ended = last_call_ended
+    if ongoing:
+        # Checked again at the latest when the oldest call is no longer counted
+        return min(MAX_CALL_SECONDS - (now - started) for started in ongoing) + RESUME_DELAY
+    if ended is not None and now - ended < RESUME_DELAY:
+        return RESUME_DELAY - (now - ended)
+    return 0
+
+def call_active():
+    return busy_for() > 0
+
+# Block until no call is in progress
+# Called by heavy work between its units of work, e.g. per file or per chunk of a file. Returns the seconds waited.
+def checkpoint(task):
+    if not call_active():
+        return 0
+    started = time.monotonic()
+    SCHEDULER_DECISIONS.inc(1, task, 'pause')
+    job = getattr(current, 'job', None)
+    if job:
+        job['state'] = 'paused'
+    with calls_changed:
+        while True:
+            remaining = busy_for()
+            if not remaining:
+                break
+            # Woken up by every hook state change, the resume delay is waited out with the timeout
+            calls_changed.wait(remaining)
+    if job:
+        job['state'] = 'running'
+    waited = time.monotonic() - started
+    SCHEDULER_DECISIONS.inc(1, task, 'resume')
+    SCHEDULER_PAUSED.inc(waited, task)
+    return waited
+
+# Shared by all throttled transfers
+bucket = TokenBucket(THROTTLE_RATE)
+
+# Account for bytes of a transfer, during a call this sleeps to keep all transfers at THROTTLE_RATE
+def throttle(task, size):
+    if not call_active():
+        return 0
+    delay = bucket.consume(size)
+    if delay:
+        SCHEDULER_DECISIONS.inc(1, task, 'throttle')
+        SCHEDULER_THROTTLED.inc(delay, task)
+    return delay
+
+# Record a decision of code that adapts itself instead of waiting, e.g. a smaller thread pool during a call
+def record_decision(task, decision):
+    SCHEDULER_DECISIONS.inc(1, task, decision)
+
+# The job of the worker thread, see checkpoint
+current = threading.local()
+
+# Runs jobs one at a time by priority, in the order they were submitted within a priority
+class Scheduler:
+    def __init__(self):
+        self.queue = []
+        self.jobs = {}
+        self.counter = itertools.count(1)
+        self.lock = threading.Condition()
+        self.app = None
+        self.thread = None
+
+    # Start the worker thread, app is the Flask app whose context the jobs run in
+    def start(self, app):
+        with self.lock:
+            self.app = app
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+                self.thread.start()
+
+    # Queue a job, fn is called without arguments in an app context
+    # Returns the job, a dict with its id and state that is updated while it runs
+    def submit(self, task, fn, priority=NORMAL):
+        job_id = next(self.counter)
+        job = {'id': job_id, 'task': task, 'priority': priority, 'state': 'queued', 'submittedAt': int(time.time()),
+               'startedAt': None, 'finishedAt': None, 'result': None, 'error': None, 'done': threading.Event()}
+        with self.lock:
+            self.jobs[job_id] = job
+            heapq.heappush(self.queue, (priority, job_id, fn))
+            SCHEDULER_QUEUED.set(len(self.queue))
+            self.lock.notify()
+        return job
+
+    def run(self):
+        try:
+            # Only lowers the priority of this thread, the other threads of the process keep theirs
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WORKER_NICENESS)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            with self.lock:
+                while not self.queue:
+                    self.lock.wait()
+                priority, job_id, fn = heapq.heappop(self.queue)
+                SCHEDULER_QUEUED.set(len(self.queue))
+            job = self.jobs[job_id]
+            # A job is not started during a call, it might hold locks a paused job would keep
+            if checkpoint(job['task']) == 0:
+                SCHEDULER_DECISIONS.inc(1, job['task'], 'run')
+            current.job = job
+            job.update(state='running', startedAt=int(time.time()))
+            try:
+                with self.app.app_context():
+                    job['result'] = fn()
+                job['state'] = 'finished'
+            except Exception as e:
+                job.update(state='failed', error=str(e))
+                print(f"Job {job_id} ({job['task']}) failed: {e}")
+            finally:
+                current.job = None
+                job['finishedAt'] = int(time.time())
+                job['done'].set()
+                self.forget_finished()
+
+    def forget_finished(self):
+        with self.lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job['done'].is_set()]
+            for job_id in finished[:-KEEP_FINISHED]:
+                del self.jobs[job_id]
+
+    def describe(self, job):
+        return {key: value for key, value in job.items() if key != 'done'}
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        return self.describe(job) if job else None
+
+    def list_jobs(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [self.describe(job) for job in jobs]
+
+scheduler = Scheduler()
+
+# Calls in progress and the state of the scheduler, returned by GET /scheduler
+def get_status():
+    now = time.monotonic()
+    with calls_changed:
+        ongoing = {device_id: round(now - started) for device_id, started in calls.items()}
+    return {
+        'calls': [{'deviceId': device_id, 'seconds': seconds} for device_id, seconds in ongoing.items()],
+        'heavyWorkAllowed': not call_active(),
+        'resumesIn': round(busy_for(), 1),
+        'jobs': scheduler.list_jobs()
+    }
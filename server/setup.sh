@@ -3,8 +3,10 @@ help() {
     echo "Usage: setup.sh [command]"
     echo "Commands:"
     echo "  help: Display this help message"
-    echo "  start: Start the web server"
+    echo "  start: Start the web server in production mode (gunicorn)"
+    echo "  dev: Start the web server in development mode (Werkzeug with debugger and reloader)"
     echo "  install: Install the python dependencies using the requirements.txt"
+    echo "  build: Fingerprint and precompress the static files into static_build"
 }
 
 # Function to install the python dependencies
@@ -22,10 +24,25 @@ install() {
     echo "Python dependencies installed successfully"
 }
 
+# Fingerprint and precompress the static files, nginx serves the result
+build() {
+    echo "Building the static files..."
+    . .venv/bin/activate
+    python3 build_static.py
+}
+
 start() {
     echo "Starting the web server..."
     export PYTHONPATH="$PYTHONPATH:$PWD"
     . .venv/bin/activate
+    python3 build_static.py
+    exec gunicorn -c gunicorn.conf.py app:app
+}
+
+dev() {
+    echo "Starting the web server in development mode..."
+    export PYTHONPATH="$PYTHONPATH:$PWD"
+    . .venv/bin/activate
     python3 -u app.py
 }
 
@@ -47,6 +64,12 @@ case $1 in
     start)
         start
         ;;
+    dev)
+        dev
+        ;;
+    build)
+        build
+        ;;
     *)
         echo "Error: Invalid command"
         help
@@ -6,11 +6,16 @@ function loadSettings() {
       document.getElementById('autoRing').checked = data.autoRing;
       document.getElementById('autoRingMinSpan').value = data.autoRingMinSpan;
       document.getElementById('autoRingMaxSpan').value = data.autoRingMaxSpan;
+      document.getElementById('autoRingQuietStart').value = data.autoRingQuietStart || '';
+      document.getElementById('autoRingQuietEnd').value = data.autoRingQuietEnd || '';
       document.getElementById('ringOnTime').value = data.ringOnTime;
       document.getElementById('ringOffTime').value = data.ringOffTime;
       document.getElementById('messages').checked = data.messages;
-      document.getElementById('randomMessages').checked = data.randomMessages;
+      // Configs saved before the message order existed only know randomMessages
+      document.getElementById('messageMode').value = data.messageMode || (data.randomMessages ? 'random' : 'sequential');
       document.getElementById('ringCount').value = data.ringCount;
+      document.getElementById('capturePeriodTime').value = data.capturePeriodTime || '';
+      document.getElementById('captureBufferTime').value = data.captureBufferTime || '';
     })
     .catch((error) => {
       console.error('Error:', error);
@@ -24,14 +29,26 @@ function saveSettings() {
   const data = {};
 
   // Handle checkbox fields separately
-  const checkboxes = ['autoRing', 'messages', 'randomMessages'];
+  const checkboxes = ['autoRing', 'messages'];
   checkboxes.forEach(key => {
     data[key] = formData.has(key) ? true : false;
   });
 
-  // Handle number fields
+  // Handle time fields separately, an empty time disables the quiet hours
+  const times = ['autoRingQuietStart', 'autoRingQuietEnd'];
+  times.forEach(key => {
+    data[key] = formData.get(key) || null;
+  });
+
+  // Handle the capture times separately, an empty time keeps the default of the sound card
+  const captureTimes = ['capturePeriodTime', 'captureBufferTime'];
+  captureTimes.forEach(key => {
+    data[key] = formData.get(key) ? Number(formData.get(key)) : null;
+  });
+
+  // Handle number and select fields
   formData.forEach((value, key) => {
-    if (!checkboxes.includes(key)) {
+    if (!checkboxes.includes(key) && !times.includes(key) && !captureTimes.includes(key)) {
       data[key] = !isNaN(Number(value)) ? Number(value) : value;
     }
   });
@@ -50,4 +67,28 @@ function saveSettings() {
     .catch((error) => {
       console.error('Error:', error);
     });
-}
\ No newline at end of file
+}
+// Show the next automated ring
+// The status is the JSON reported by an interface via STATUS:NEXT_RING, the earliest of all phones
+function renderNextRing(status) {
+  const label = document.getElementById('nextRing');
+  if (!label) {
+    return;
+  }
+  if (!status.nextRing) {
+    label.textContent = 'No automated ring planned';
+    return;
+  }
+  label.textContent = new Date(status.nextRing * 1000).toLocaleString() + (status.quiet ? ' (after the quiet hours)' : '') +
+    (status.deviceId ? ' on ' + status.deviceId : '');
+}
+
+// Get the next automated ring last reported by the interfaces
+function loadNextRing() {
+  fetch('/config/nextRing')
+    .then(response => response.json())
+    .then(data => renderNextRing(data))
+    .catch((error) => {
+      console.error('Error:', error);
+    });
+}
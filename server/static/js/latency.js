@@ -0,0 +1,20 @@
+// Render the call latency summary sent by the interface
+// The summary is a JSON object keyed by "<kind>.<stage>" with count, percentiles and maximum in milliseconds
+function renderLatency(summary) {
+  const tableBody = document.querySelector('#latencyTable tbody');
+  if (!tableBody) {
+    return;
+  }
+  tableBody.innerHTML = ''; // Clear any existing rows
+
+  Object.keys(summary).sort().forEach(key => {
+    const entry = summary[key];
+    const row = document.createElement('tr');
+    [key, entry.count, entry.p50, entry.p90, entry.p99, entry.max].forEach(value => {
+      const cell = document.createElement('td');
+      cell.textContent = value;
+      row.appendChild(cell);
+    });
+    tableBody.appendChild(row);
+  });
+}
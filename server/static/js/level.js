@@ -0,0 +1,33 @@
+// Lowest level shown by the meters in dBFS
+const LEVEL_MIN = -60;
+
+// Time in milliseconds without a level frame after which the meter is reset
+const LEVEL_TIMEOUT = 1000;
+
+var levelTimeout = null;
+
+// Render a level frame sent by the interface while recording
+// The frame is "<rms>,<peak>" in dBFS
+function renderLevel(frame) {
+  const [rms, peak] = frame.split(',').map(Number);
+  setLevel('levelRms', rms);
+  setLevel('levelPeak', peak);
+  document.getElementById('levelState').textContent = peak >= -0.1 ? 'Clipping' : rms < LEVEL_MIN ? 'Silence' : 'Recording';
+  clearTimeout(levelTimeout);
+  levelTimeout = setTimeout(resetLevel, LEVEL_TIMEOUT);
+}
+
+// Show a level on a meter and its label
+function setLevel(id, level) {
+  document.getElementById(id).value = Math.max(LEVEL_MIN, level);
+  document.getElementById(id + 'Label').textContent = level.toFixed(1) + ' dBFS';
+}
+
+// No level frames arrive while the phone is not recording
+function resetLevel() {
+  setLevel('levelRms', LEVEL_MIN);
+  setLevel('levelPeak', LEVEL_MIN);
+  document.getElementById('levelRmsLabel').textContent = '-';
+  document.getElementById('levelPeakLabel').textContent = '-';
+  document.getElementById('levelState').textContent = 'Not recording';
+}
@@ -0,0 +1,68 @@
+// Columns of the statistics table as (key, heading)
+const STATS_COLUMNS = [
+  ['label', 'Time'],
+  ['records', 'Recordings'],
+  ['averageLengthMs', 'Avg. length (s)'],
+  ['pickups', 'Pick ups'],
+  ['emptyPickups', 'Without recording'],
+  ['rings', 'Rings'],
+  ['missedRings', 'Missed rings'],
+  ['autoRings', 'Automated rings'],
+  ['missedAutoRings', 'Missed automated rings']
+];
+
+// Format a value of the statistics for display
+function formatStat(key, value) {
+  if (value === null || value === undefined) {
+    return '-';
+  }
+  if (key === 'averageLengthMs' || key === 'recordedMs') {
+    return (value / 1000).toFixed(1);
+  }
+  return value;
+}
+
+// Add a row of statistics to the table body
+function appendStatsRow(tableBody, entry) {
+  const row = document.createElement('tr');
+  STATS_COLUMNS.forEach(([key]) => {
+    const cell = document.createElement('td');
+    cell.textContent = formatStat(key, entry[key]);
+    row.appendChild(cell);
+  });
+  tableBody.appendChild(row);
+}
+
+// Render the totals and the buckets returned by GET /stats, newest bucket first
+function renderStats(data) {
+  const totals = document.getElementById('statsTotals');
+  totals.textContent = `${data.totals.records} recordings with ${formatStat('recordedMs', data.totals.recordedMs)} s in total, ` +
+    `${data.totals.pickups} pick ups and ${data.totals.rings} rings of which ${data.totals.missedRings} were missed.`;
+
+  const tableBody = document.querySelector('#statsTable tbody');
+  tableBody.innerHTML = ''; // Clear any existing rows
+  data.buckets.slice().reverse().forEach(entry => appendStatsRow(tableBody, entry));
+}
+
+// Get the statistics per hour or per day
+function loadStats(bucket) {
+  fetch(`/stats?bucket=${bucket}`)
+    .then(response => response.json())
+    .then(data => renderStats(data))
+    .catch((error) => {
+      console.error('Error:', error);
+    });
+}
+
+// Create the table heading once
+function initStats() {
+  const heading = document.querySelector('#statsTable thead tr');
+  STATS_COLUMNS.forEach(([, title]) => {
+    const cell = document.createElement('th');
+    cell.textContent = title;
+    heading.appendChild(cell);
+  });
+  const bucket = document.getElementById('statsBucket');
+  bucket.addEventListener('change', () => loadStats(bucket.value));
+  loadStats(bucket.value);
+}
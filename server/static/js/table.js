@@ -49,6 +49,14 @@ function populateTable(data, path) {
 
       const lengthCell = document.createElement('td');
       lengthCell.textContent = (item.length / 1000).toFixed(2);
+      // Recordings the level meter or the recorder flagged, e.g. because the microphone captured nothing
+      if (item.quality && item.quality !== 'ok') {
+        lengthCell.textContent += ' ⚠️ ' + item.quality;
+        lengthCell.title = `RMS ${item.rmsDb} dBFS, peak ${item.peakDb} dBFS, longest silence ${item.silenceMs} ms, clipping ${item.clippingMs} ms`;
+        if (item.xruns !== null && item.xruns !== undefined) {
+          lengthCell.title += `, ${item.xruns} overruns dropped ${item.droppedFrames} frames, ${item.durationMismatchMs} ms of the call missing`;
+        }
+      }
       row.appendChild(lengthCell);
 
       const recordDateCell = document.createElement('td');
@@ -0,0 +1,70 @@
+// Get the controls of the upload form
+const uploadInput = document.getElementById('uploadInput');
+const uploadBtn = document.getElementById('uploadBtn');
+const uploadProgress = document.getElementById('uploadProgress');
+const uploadResults = document.getElementById('uploadResults');
+
+// Add listener to the upload button
+// All selected files are sent in a single request to /messages/batch
+uploadBtn.addEventListener('click', () => {
+  if (uploadInput.files.length === 0) {
+    alert('Please select at least one file');
+    return;
+  }
+  const formData = new FormData();
+  for (const file of uploadInput.files) {
+    formData.append('files', file, file.name);
+  }
+  uploadBtn.disabled = true;
+  uploadResults.innerHTML = '';
+  uploadProgress.value = 0;
+
+  // XMLHttpRequest is used instead of fetch since it reports the upload progress
+  // The first half of the bar is the transfer, the second half the validation reported over the websocket
+  const xhr = new XMLHttpRequest();
+  xhr.open('POST', '/messages/batch');
+  xhr.upload.onprogress = (event) => {
+    if (event.lengthComputable) {
+      uploadProgress.value = event.loaded / event.total / 2;
+    }
+  };
+  xhr.onload = () => {
+    uploadBtn.disabled = false;
+    uploadProgress.value = 1;
+    let result;
+    try {
+      result = JSON.parse(xhr.responseText);
+    } catch (e) {
+      alert('Upload failed');
+      return;
+    }
+    if (!result.files) {
+      alert(result.error || 'Upload failed');
+      return;
+    }
+    // List the result of every file
+    result.files.forEach(file => {
+      const item = document.createElement('li');
+      item.textContent = file.error ? `${file.file}: ${file.error}` : `${file.file}: uploaded`;
+      if (file.error) {
+        item.className = 'error';
+      }
+      uploadResults.appendChild(item);
+    });
+    uploadInput.value = '';
+    getMessagesData();
+  };
+  xhr.onerror = () => {
+    uploadBtn.disabled = false;
+    alert('Upload failed');
+  };
+  xhr.send(formData);
+});
+
+// Show the validation progress sent by the server over the websocket
+function renderUploadProgress(progress) {
+  if (progress.table !== 'messages' || !uploadBtn.disabled) {
+    return;
+  }
+  uploadProgress.value = 0.5 + progress.done / progress.total / 2;
+}
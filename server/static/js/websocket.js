@@ -1,10 +1,23 @@
 // Connect to WebSocket server
 var socket = new WebSocket("wss://" + window.location.host + "/socket");
 
+// Messages of a phone interface arrive as "DEVICE:<id>:<message>"
+const DEVICE_MESSAGE = /^DEVICE:([A-Za-z0-9._-]+):([\s\S]*)$/;
+
+// Phone selected on the debug page, empty for all phones
+function selectedDevice() {
+    var select = document.getElementById("device");
+    return select ? select.value : "";
+}
+
 // Send message to WebSocket server
+// A message for a single phone is sent with its DEVICE: prefix, the server only passes it on to that phone
 function sendWebSocketMessage() {
     var message = document.getElementById("message").value;
     var messages = document.getElementById("webSocketMessages");
+    if (message && selectedDevice()) {
+        message = "DEVICE:" + selectedDevice() + ":" + message;
+    }
     socket.send(message);
     if (message) {
         messages.innerHTML += "<br><span class='localMessage'>" + message + "</span>";
@@ -13,8 +26,64 @@ function sendWebSocketMessage() {
 
 // Receive message from WebSocket server
 socket.onmessage = function(event) {
+    var data = event.data;
+    var device = "";
+    var match = DEVICE_MESSAGE.exec(data);
+    if (match) {
+        device = match[1];
+        data = match[2];
+    }
+    // Reports of the phones are only shown for the selected phone
+    var shown = !device || !selectedDevice() || device === selectedDevice();
+    // Latency reports are rendered as a table instead of being listed
+    if (data.startsWith("STATUS:LATENCY:") && typeof renderLatency === "function") {
+        if (shown) {
+            renderLatency(JSON.parse(data.substring("STATUS:LATENCY:".length)));
+        }
+        return;
+    }
+    // Input levels are shown by the meters of the debug page and never listed, they arrive several times per second
+    if (data.startsWith("STATUS:LEVEL:")) {
+        if (shown && typeof renderLevel === "function") {
+            renderLevel(data.substring("STATUS:LEVEL:".length));
+        }
+        return;
+    }
+    // Progress of batch uploads is shown by the upload form
+    if (data.startsWith("STATUS:UPLOAD:") && typeof renderUploadProgress === "function") {
+        renderUploadProgress(JSON.parse(data.substring("STATUS:UPLOAD:".length)));
+        return;
+    }
+    // The configuration page shows the earliest next automated ring of all phones
+    if (data.startsWith("STATUS:NEXT_RING:") && typeof loadNextRing === "function") {
+        loadNextRing();
+        return;
+    }
     var messages = document.getElementById("webSocketMessages");
     if (messages) {
-        messages.innerHTML += "<br><span class='remoteMessage'>" + event.data + "</span>";
+        messages.innerHTML += "<br><span class='remoteMessage'>" + (device ? "[" + device + "] " : "") + data + "</span>";
     }
-}
\ No newline at end of file
+}
+
+// Fill the phone selection of the debug page with the registered phones
+function loadDevices() {
+    var select = document.getElementById("device");
+    if (!select) {
+        return;
+    }
+    fetch('/devices')
+        .then(response => response.json())
+        .then(devices => {
+            devices.forEach(device => {
+                var option = document.createElement("option");
+                option.value = device.id;
+                option.textContent = (device.name || device.id) + (device.online ? "" : " (offline)");
+                select.appendChild(option);
+            });
+        })
+        .catch((error) => {
+            console.error('Error:', error);
+        });
+}
+
+document.addEventListener('DOMContentLoaded', loadDevices);
\ No newline at end of file
@@ -0,0 +1,138 @@
+import time
+import threading
+from datetime import datetime
+from database import query_db, transaction
+from websocket_utils import subscribe
+
+# Statistics of the event, rolled up per hour in the stats_hourly table
+# The record columns (records, recordedMs) are maintained by triggers on the records table, so every
+# insert and delete updates them in its own transaction, whichever code path it comes from.
+# The call columns are counted from the hook states the interface reports over the websocket.
+# Days are summed up from the 24 hours of the local day, so every bucket costs a constant number of rows.
+
+BUCKETS = ('hour', 'day')
+
+# Columns of stats_hourly, besides the hour
+COLUMNS = ('records', 'recordedMs', 'pickups', 'rings', 'missedRings', 'autoRings', 'missedAutoRings')
+
+# A ring that follows a COMMAND:RING within this many seconds was triggered by hand
+MANUAL_RING_WINDOW = 10
+
+# Hook states reported by the interface as STATUS:<state>
+HOOK_STATES = ('ON_HOOK', 'OFF_HOOK', 'RINGING')
+
+# Per interface by device id: last reported hook state and whether the current ring is automated
+# Interfaces without a device id share the entry of None
+hooks = {}
+hook_lock = threading.Lock()
+
+# Time of the last COMMAND:RING per device id, None is a command for all interfaces
+ring_commands = {}
+
+# Start of the hour a timestamp belongs to
+def hour_of(timestamp):
+    return int(timestamp) - int(timestamp) % 3600
+
+# Recompute the record columns from the records table
+# Used for data stored before the statistics existed, the call columns can not be recovered and are kept.
+# cursor is an open cursor, the caller commits
+def backfill_records(cursor):
+    cursor.execute('UPDATE stats_hourly SET records = 0, recordedMs = 0')
+    cursor.execute('''
+        INSERT INTO stats_hourly (hour, records, recordedMs)
+        SELECT recordTimestamp - recordTimestamp % 3600 AS bucket, COUNT(*), COALESCE(SUM(length), 0)
+        FROM records WHERE recordTimestamp IS NOT NULL GROUP BY bucket
+        ON CONFLICT (hour) DO UPDATE SET records = excluded.records, recordedMs = excluded.recordedMs
+    ''')
+    return cursor.execute('SELECT COUNT(*) FROM stats_hourly WHERE records > 0').fetchone()[0]
+
+# Backfill the record columns, see backfill_records
+def backfill():
+    start = time.perf_counter()
+    with transaction() as db:
+        hours = backfill_records(db.cursor())
+    return {'hours': hours, 'durationMs': round((time.perf_counter() - start) * 1000, 3)}
+
+# Add one to the given call columns of the current hour
+def count_events(columns, timestamp=None):
+    hour = hour_of(timestamp or time.time())
+    with transaction() as db:
+        db.execute('INSERT OR IGNORE INTO stats_hourly (hour) VALUES (?)', (hour,))
+        db.execute(f"UPDATE stats_hourly SET {', '.join(f'{column} = {column} + 1' for column in columns)} WHERE hour = ?", (hour,))
+
+# Count the hook state changes reported by the interfaces
+# A pick up is every change to OFF_HOOK, a missed ring a change from RINGING to ON_HOOK.
+# Repeated states, e.g. answers to COMMAND:SEND_STATUS, are not counted again.
+def handle_status(status, device_id):
+    if status not in HOOK_STATES:
+        return
+    with hook_lock:
+        hook = hooks.setdefault(device_id, {'state': None, 'autoRing': True})
+        previous = hook['state']
+        if status == previous:
+            return
+        hook['state'] = status
+        if status == 'RINGING':
+            ring_command = max(ring_commands.get(device_id, 0), ring_commands.get(None, 0))
+            hook['autoRing'] = time.time() - ring_command > MANUAL_RING_WINDOW
+        auto = hook['autoRing']
+    columns = []
+    if status == 'OFF_HOOK':
+        columns.append('pickups')
+    elif status == 'RINGING':
+        columns += ['rings', 'autoRings'] if auto else ['rings']
+    elif previous == 'RINGING':
+        columns += ['missedRings', 'missedAutoRings'] if auto else ['missedRings']
+    if columns:
+        count_events(columns)
+
+# Remember when a ring was requested by hand, the following ring of that interface is not an automated one
+def handle_ring_command(rest, device_id):
+    if rest == '':
+        with hook_lock:
+            ring_commands[device_id] = time.time()
+
+subscribe('STATUS:', handle_status)
+subscribe('COMMAND:RING', handle_ring_command)
+
+# Derived values of a bucket
+# The average length is over the kept records, a pick up without a recording is one whose
+# recording was never uploaded or was deleted afterwards
+def complete_bucket(bucket):
+    bucket['averageLengthMs'] = round(bucket['recordedMs'] / bucket['records']) if bucket['records'] else None
+    bucket['emptyPickups'] = max(0, bucket['pickups'] - bucket['records'])
+    return bucket
+
+# Get the statistics per hour or per local day between the timestamps start and end (inclusive, both optional)
+# Returns the buckets in chronological order and the totals over all of them
+def get_stats(bucket='hour', start=None, end=None):
+    clauses = []
+    args = []
+    if start is not None:
+        clauses.append('hour >= ?')
+        args.append(hour_of(start))
+    if end is not None:
+        clauses.append('hour <= ?')
+        args.append(end)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    sums = ', '.join(f'SUM({column}) AS {column}' for column in COLUMNS)
+    if bucket == 'day':
+        rows = query_db(f'''
+            SELECT date(hour, 'unixepoch', 'localtime') AS day, {sums}
+            FROM stats_hourly {where} GROUP BY day ORDER BY day
+        ''', args)
+        buckets = []
+        for row in rows:
+            entry = dict(row)
+            day = entry.pop('day')
+            entry = {'start': int(datetime.strptime(day, '%Y-%m-%d').timestamp()), 'label': day, **entry}
+            buckets.append(entry)
+    else:
+        rows = query_db(f"SELECT hour AS start, {', '.join(COLUMNS)} FROM stats_hourly {where} ORDER BY hour", args)
+        buckets = [dict(row, label=datetime.fromtimestamp(row['start']).strftime('%Y-%m-%d %H:00')) for row in rows]
+    totals = {column: sum(entry[column] or 0 for entry in buckets) for column in COLUMNS}
+    return {
+        'bucket': bucket,
+        'buckets': [complete_bucket(entry) for entry in buckets],
+        'totals': complete_bucket(totals)
+    }
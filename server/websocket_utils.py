@@ -1,9 +1,111 @@
 # websocket_utils.py
+import re
+from metrics import WEBSOCKET_FANOUT, timed
 
 # List to store active WebSocket connections
 connections = []
 
+# Connections of the phone interfaces by device id, all other connections are browsers
+# An interface identifies itself by opening /socket?device=<id>
+devices = {}
+
+# Device ids are used in URLs and in the DEVICE: prefix, so they must not contain a colon
+DEVICE_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Prefix of a message that concerns a single device: "DEVICE:<id>:<message>"
+# Browsers receive the messages of an interface with it and send commands for a single interface with it
+DEVICE_PREFIX = 'DEVICE:'
+
+# Callbacks for messages received from the clients, as (prefix, callback)
+listeners = []
+
+# Call callback with the rest of the message and the device id for every received message that starts with prefix
+# The device id is the interface that sent a status or the one a command is for, None for all of them
+# Used to keep the latest status of the interfaces on the server, e.g. for clients that connect later
+def subscribe(prefix, callback):
+    listeners.append((prefix, callback))
+
+# Hand a received message to the listeners of its prefix
+# A failing listener must not keep the message from being relayed
+def dispatch(data, device_id=None):
+    for prefix, callback in listeners:
+        if isinstance(data, str) and data.startswith(prefix):
+            try:
+                callback(data[len(prefix):], device_id)
+            except Exception as e:
+                print(f"Failed to handle websocket message: {e}")
+
+# Split a "DEVICE:<id>:<message>" message into the device id and the message
+# Returns None as the device id for any other message
+def parse_device_message(data):
+    if isinstance(data, str) and data.startswith(DEVICE_PREFIX):
+        device_id, separator, message = data[len(DEVICE_PREFIX):].partition(':')
+        if separator and DEVICE_ID.match(device_id):
+            return device_id, message
+    return None, data
+
+# Remember the connection of an interface, a reconnecting interface replaces its old connection
+def register_device(device_id, conn):
+    devices[device_id] = conn
+
+# Forget the connection of an interface unless it was already replaced by a newer one
+def unregister_device(device_id, conn):
+    if devices.get(device_id) is conn:
+        del devices[device_id]
+
+# Handle a message received on /socket
+# A message of an interface goes to the browsers only, prefixed with the device id.
+# A browser message with the DEVICE: prefix goes to that interface only, without the prefix, and to the other
+# browsers as it is. Any other browser message goes to all other clients, so a plain command reaches every interface.
+def route(data, sender, device_id=None):
+    if device_id is not None:
+        dispatch(data, device_id)
+        relay(DEVICE_PREFIX + device_id + ':' + data, sender, browsers_only=True)
+        return
+    target, message = parse_device_message(data)
+    dispatch(message, target)
+    if target is None:
+        relay(data, sender)
+        return
+    send_to_device(target, message)
+    relay(data, sender, browsers_only=True)
+
+# Send a message to a single interface
+# Returns False if the interface is not connected
+def send_to_device(device_id, data):
+    conn = devices.get(device_id)
+    if conn is None:
+        return False
+    with timed(WEBSOCKET_FANOUT):
+        try:
+            conn.send(data)
+        except Exception as e:
+            print(f"Failed to send websocket message: {e}")
+            return False
+    return True
+
+# Send a message to all connected clients except the sender, or only to the browsers
+# The list is copied since connections are added and removed from other request threads
+# A client that went away must not keep the message from reaching the others
+def relay(data, sender=None, browsers_only=False):
+    with timed(WEBSOCKET_FANOUT):
+        interfaces = set(map(id, devices.values())) if browsers_only else ()
+        for conn in list(connections):
+            if conn is sender or id(conn) in interfaces:
+                continue
+            try:
+                conn.send(data)
+            except Exception as e:
+                print(f"Failed to send websocket message: {e}")
+
 # Expose a function that can be used to send a message to all connected clients
 def broadcast(data):
-    for conn in connections:
-        conn.send(data)
\ No newline at end of file
+    relay(data)
+
+# Close all connections, used on shutdown so the request threads serving them can finish
+def close_all():
+    for conn in list(connections):
+        try:
+            conn.close(1001, 'Server shutting down')
+        except Exception:
+            pass
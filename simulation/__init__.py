@@ -0,0 +1,20 @@
+# Hardware-free simulation of the weddingRing phone
+# The fake RPi.GPIO backend lives in shims/, fake arecord and aplay executables in bin/.
+import os
+
+SIMULATION_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SIMULATION_DIR)
+SHIMS_DIR = os.path.join(SIMULATION_DIR, 'shims')
+BIN_DIR = os.path.join(SIMULATION_DIR, 'bin')
+SERVER_DIR = os.path.join(REPO_DIR, 'server')
+INTERFACE_DIR = os.path.join(REPO_DIR, 'interface')
+
+# Build the environment for a simulated process
+# The shims shadow RPi.GPIO and the fake binaries shadow arecord and aplay
+def simulation_env(extra_paths=(), **variables):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([SHIMS_DIR, *extra_paths] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    env['PATH'] = BIN_DIR + os.pathsep + env.get('PATH', '')
+    env['PYTHONUNBUFFERED'] = '1'
+    env.update({key: str(value) for key, value in variables.items()})
+    return env
@@ -0,0 +1,105 @@
+# Simulates the auto ring scheduler of the interface on a virtual clock
+# Runs the real AutoRingScheduler over a number of days, changes the config in between and checks that
+# no ring falls into the quiet hours, every ring respects the configured span, exactly one timer is pending
+# while auto ring is enabled and none after it was disabled. Reports the rings per day and the gaps between them.
+# Usage (from the repository root): python3 -m simulation.autoring --days 7 --quiet-start 22:00 --quiet-end 08:00
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime
+
+from simulation import INTERFACE_DIR
+from simulation.clock import VirtualClock
+
+sys.path.insert(0, INTERFACE_DIR)
+from scheduler import AutoRingScheduler, quiet_until
+
+# Start of the simulation, midnight in local time, so the quiet hours are hit at known points
+def local_midnight():
+    return datetime(2024, 6, 1).timestamp()
+
+def run(args):
+    clock = VirtualClock(local_midnight())
+    rings = []
+    plans = []
+    scheduler = AutoRingScheduler(clock, lambda: rings.append(clock.now()),
+                                  lambda next_ring, quiet: plans.append((clock.now(), next_ring, quiet)),
+                                  rng=random.Random(args.seed))
+    config = {
+        'autoRing': True,
+        'autoRingMinSpan': args.min_span,
+        'autoRingMaxSpan': args.max_span,
+        'autoRingQuietStart': args.quiet_start,
+        'autoRingQuietEnd': args.quiet_end
+    }
+    errors = []
+    started = time.perf_counter()
+    scheduler.configure(config)
+
+    # First half with the configured span
+    clock.advance(args.days * 86400 / 2)
+    if clock.pending() != 1:
+        errors.append(f"{clock.pending()} timers pending while auto ring is enabled")
+
+    # A config change takes effect right away, the pending ring is replaced
+    planned = scheduler.next_ring
+    changed = dict(config, autoRingMinSpan=args.min_span * 2, autoRingMaxSpan=args.max_span * 2)
+    scheduler.configure(changed)
+    if clock.pending() != 1 or (planned is not None and scheduler.next_ring == planned):
+        errors.append("Config change did not replace the pending ring")
+    # An unrelated change keeps the plan
+    planned = scheduler.next_ring
+    scheduler.configure(dict(changed, ringCount=2))
+    if scheduler.next_ring != planned:
+        errors.append("Unrelated config change moved the pending ring")
+    clock.advance(args.days * 86400 / 2)
+
+    # Disabling auto ring cancels the pending ring
+    scheduler.configure(dict(changed, autoRing=False))
+    rings_before = len(rings)
+    clock.advance(86400)
+    if clock.pending() != 0 or len(rings) != rings_before or scheduler.next_ring is not None:
+        errors.append("Rings still planned after auto ring was disabled")
+    elapsed = time.perf_counter() - started
+
+    for ring in rings:
+        if quiet_until(ring, args.quiet_start, args.quiet_end) is not None:
+            errors.append(f"Ring at {datetime.fromtimestamp(ring)} is within the quiet hours")
+    gaps = [b - a for a, b in zip(rings, rings[1:])]
+    if gaps and min(gaps) < args.min_span * 60:
+        errors.append(f"Two rings only {min(gaps) / 60:.1f} minutes apart")
+    per_day = {}
+    for ring in rings:
+        day = datetime.fromtimestamp(ring).date().isoformat()
+        per_day[day] = per_day.get(day, 0) + 1
+    return {
+        'settings': vars(args),
+        'rings': len(rings),
+        'ringsPerDay': per_day,
+        'movedOutOfQuietHours': sum(1 for _, _, quiet in plans if quiet),
+        'gapMinutes': {
+            'min': round(min(gaps) / 60, 1) if gaps else None,
+            'max': round(max(gaps) / 60, 1) if gaps else None
+        },
+        'simulationMs': round(elapsed * 1000, 3),
+        'errors': errors
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate the auto ring scheduler on a virtual clock')
+    parser.add_argument('--days', type=int, default=7, help='Simulated days')
+    parser.add_argument('--min-span', type=int, default=60, help='autoRingMinSpan in minutes')
+    parser.add_argument('--max-span', type=int, default=180, help='autoRingMaxSpan in minutes')
+    parser.add_argument('--quiet-start', default='22:00', help='Start of the quiet hours, empty to disable')
+    parser.add_argument('--quiet-end', default='08:00', help='End of the quiet hours, empty to disable')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if report['errors']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
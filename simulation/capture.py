@@ -0,0 +1,106 @@
+# Health checks of the recorder of the interface
+# Runs the real Recorder against the fake arecord with injected faults: overruns that drop audio, a device that
+# can not be opened and a recorder that stops in the middle of a call. Checks that the capture report counts the
+# overruns and the dropped frames, that the audio missing from the file matches the faults, that the period and
+# buffer time reach arecord and that a recorder that exits early is detected.
+# Usage (from the repository root): python3 -m simulation.capture --seconds 4
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from simulation import INTERFACE_DIR, simulation_env
+
+sys.path.insert(0, INTERFACE_DIR)
+from capture import Recorder, RATE, STARTUP_CHECK, TRUNCATED_MS
+
+# Scenarios as (name, settings of Recorder, fault variables of the fake arecord)
+def scenarios(seconds):
+    return [
+        ('clean', {}, {}),
+        ('xruns', {}, {'FAKE_ARECORD_XRUNS': f'{seconds / 4}:50,{seconds / 2}:120'}),
+        ('periods', {'period_time': 10000, 'buffer_time': 40000}, {}),
+        ('stalled', {}, {'FAKE_ARECORD_EXIT_AFTER': seconds / 4}),
+        ('busy', {}, {'FAKE_ARECORD_FAIL': 'Device or resource busy'})
+    ]
+
+# Record for a number of seconds with the faults set in the environment of the fake arecord
+# Returns the capture report, the failure seen after the startup check and the failure seen when stopping
+def run_scenario(workdir, name, seconds, settings, faults):
+    # Recorder starts arecord with the environment of this process
+    environ = dict(os.environ)
+    env = simulation_env(**faults)
+    os.environ.clear()
+    os.environ.update(env)
+    try:
+        recorder = Recorder(os.path.join(workdir, f"{name}.wav"), **settings)
+        recorder.start()
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+    time.sleep(STARTUP_CHECK)
+    startup_failure = recorder.failure()
+    time.sleep(max(seconds - STARTUP_CHECK, 0))
+    report, failure = recorder.stop()
+    return report, startup_failure, failure
+
+# Expected outcome of a scenario, returns the errors
+def check(name, seconds, report, startup_failure, failure):
+    errors = []
+    # Starting the fake arecord takes a moment that counts as missing audio like opening a real device does
+    tolerance = 500
+    if name in ('clean', 'periods', 'xruns'):
+        if startup_failure or failure:
+            errors.append(f"{name}: the recorder failed: {startup_failure or failure}")
+    if name in ('clean', 'periods'):
+        if report['xruns'] or report['flags']:
+            errors.append(f"{name}: expected a clean report, got {report}")
+        if abs(report['durationMismatchMs']) > tolerance:
+            errors.append(f"{name}: {report['durationMismatchMs']} ms of the call are missing")
+    if name == 'clean' and (report['periodFrames'], report['bufferFrames']) != (RATE * 125 // 1000, RATE * 500 // 1000):
+        errors.append(f"clean: the default period and buffer are {report['periodFrames']} and {report['bufferFrames']} frames")
+    if name == 'periods' and (report['periodFrames'], report['bufferFrames']) != (RATE * 10 // 1000, RATE * 40 // 1000):
+        errors.append(f"periods: the period and buffer are {report['periodFrames']} and {report['bufferFrames']} frames")
+    if name == 'xruns':
+        dropped = RATE * 170 // 1000
+        if report['xruns'] != 2 or abs(report['droppedFrames'] - dropped) > 2 or report['flags'] != ['xrun']:
+            errors.append(f"xruns: expected 2 overruns dropping {dropped} frames, got {report}")
+        if abs(report['durationMismatchMs'] - 170) > tolerance:
+            errors.append(f"xruns: {report['durationMismatchMs']} ms of the call are missing, 170 ms were dropped")
+    if name == 'stalled':
+        missing = seconds * 750
+        if startup_failure or not failure or failure['exitCode'] != 1 or 'read error' not in (failure['error'] or ''):
+            errors.append(f"stalled: expected the read error when stopping, got {startup_failure} and {failure}")
+        if 'truncated' not in report['flags'] or abs(report['durationMismatchMs'] - missing) > tolerance:
+            errors.append(f"stalled: expected about {missing} ms missing and the truncated flag, got {report}")
+    if name == 'busy':
+        if not startup_failure or 'busy' not in (startup_failure['error'] or ''):
+            errors.append(f"busy: the failed start was not detected: {startup_failure}")
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the capture report of the recorder with injected faults')
+    parser.add_argument('--seconds', type=float, default=4, help='Length of every recording, at least 4 seconds')
+    parser.add_argument('--dir', help='Directory the recordings are written to, defaults to a temporary one')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='weddingring-capture-', dir=args.dir)
+    errors = []
+    results = {}
+    try:
+        for name, settings, faults in scenarios(args.seconds):
+            report, startup_failure, failure = run_scenario(workdir, name, args.seconds, settings, faults)
+            results[name] = {'report': report, 'startupFailure': startup_failure, 'failure': failure}
+            errors.extend(check(name, args.seconds, report, startup_failure, failure))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps({'settings': vars(args), 'results': results, 'truncatedMs': TRUNCATED_MS, 'errors': errors}, indent=2))
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
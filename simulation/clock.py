@@ -0,0 +1,46 @@
+import heapq
+import itertools
+
+# A timer of the virtual clock, cancelled timers are skipped when they expire
+class VirtualTimer:
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+# Clock with the interface of interface/scheduler.py LoopClock whose time only moves on advance()
+# Days of automated ringing can be simulated in milliseconds and the result does not depend on the load of the machine.
+class VirtualClock:
+    def __init__(self, start=0.0):
+        self.current = start
+        self.timers = []
+        self.counter = itertools.count()
+
+    # Current time in seconds since the epoch
+    def now(self):
+        return self.current
+
+    # Call callback once the clock was advanced by delay seconds
+    def call_later(self, delay, callback):
+        timer = VirtualTimer(self.current + max(0, delay), callback)
+        heapq.heappush(self.timers, (timer.when, next(self.counter), timer))
+        return timer
+
+    # Move the time forward, expired timers run in order at their own time
+    # Timers added by a callback run in the same call if they expire before the target
+    def advance(self, seconds):
+        target = self.current + seconds
+        while self.timers and self.timers[0][0] <= target:
+            when, _, timer = heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+            self.current = when
+            timer.callback()
+        self.current = target
+
+    # Number of timers that are still pending
+    def pending(self):
+        return sum(1 for _, _, timer in self.timers if not timer.cancelled)
@@ -0,0 +1,30 @@
+import asyncio
+import random
+import RPi.GPIO as GPIO
+from gpioConstants import GPIO_LA_UPPER, GPIO_LA_LOWER
+
+# Scripts hook edges on the fake GPIO backend
+# The line interface reports on-hook as upper and lower threshold HIGH, off-hook as upper LOW and lower HIGH.
+# Every edge can bounce a few times with random timing jitter before it settles, like a real hook switch.
+class HookScript:
+    def __init__(self, jitter=0.005, bounces=2, seed=None):
+        self.jitter = jitter
+        self.bounces = bounces
+        self.random = random.Random(seed)
+
+    async def settle(self, upper):
+        for _ in range(self.random.randint(0, self.bounces)):
+            GPIO.set_input(GPIO_LA_UPPER, upper)
+            await asyncio.sleep(self.random.uniform(0, self.jitter))
+            GPIO.set_input(GPIO_LA_UPPER, not upper)
+            await asyncio.sleep(self.random.uniform(0, self.jitter))
+        GPIO.set_input(GPIO_LA_LOWER, GPIO.HIGH)
+        GPIO.set_input(GPIO_LA_UPPER, upper)
+
+    # Lift the handset
+    async def pick_up(self):
+        await self.settle(GPIO.LOW)
+
+    # Put the handset back
+    async def hang_up(self):
+        await self.settle(GPIO.HIGH)
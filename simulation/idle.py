@@ -0,0 +1,83 @@
+# Idle resource use of the server and the interface
+# Starts the real server and the real interface entry point on top of the fake GPIO backend and leaves
+# the phone on-hook. After a warm up, the CPU time, context switches, RSS and thread count of both
+# processes are sampled over the measurement window. Context switches per second approximate the
+# wakeups of the process: a sleeping thread switches out voluntarily every time it wakes up.
+# Usage (from the repository root): python3 -m simulation.idle --duration 60
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from simulation import INTERFACE_DIR, simulation_env
+from simulation.resources import process_usage
+from simulation.runner import start_server, wait_for_server
+
+# Start the interface entry point, it connects to the server and stays idle
+def start_interface(workdir, port, log):
+    interface_dir = os.path.join(workdir, 'interface')
+    os.makedirs(interface_dir)
+    env = simulation_env([INTERFACE_DIR], WEDDINGRING_SERVER=f'localhost:{port}')
+    return subprocess.Popen([sys.executable, os.path.join(INTERFACE_DIR, 'app.py')], cwd=interface_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+# Difference of two process_usage samples, normalized to the measurement window
+def idle_usage(before, after, seconds):
+    switches = lambda usage: usage.get('voluntary_ctxt_switches', 0) + usage.get('nonvoluntary_ctxt_switches', 0)
+    return {
+        'cpuPercent': round((after.get('cpuSeconds', 0) - before.get('cpuSeconds', 0)) / seconds * 100, 3),
+        'wakeupsPerSecond': round((switches(after) - switches(before)) / seconds, 2),
+        'rssKb': after.get('VmRSS'),
+        'threads': after.get('Threads')
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the idle resource use of the server and the interface')
+    parser.add_argument('--duration', type=float, default=60, help='Measurement window in seconds')
+    parser.add_argument('--warmup', type=float, default=10, help='Seconds to wait before measuring')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--output', help='File the JSON report is written to')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='weddingring-idle-')
+    log = open(os.path.join(workdir, 'idle.log'), 'w')
+    server = start_server(workdir, args.port, log)
+    interface = None
+    succeeded = False
+    try:
+        wait_for_server(args.port)
+        interface = start_interface(workdir, args.port, log)
+        time.sleep(args.warmup)
+        if interface.poll() is not None:
+            raise RuntimeError(f"Interface exited, see {log.name}")
+        before = {'server': process_usage(server.pid), 'interface': process_usage(interface.pid)}
+        time.sleep(args.duration)
+        after = {'server': process_usage(server.pid), 'interface': process_usage(interface.pid)}
+        report = {
+            'settings': vars(args),
+            'server': idle_usage(before['server'], after['server'], args.duration),
+            'interface': idle_usage(before['interface'], after['interface'], args.duration)
+        }
+        succeeded = True
+    finally:
+        for process in (interface, server):
+            if process:
+                process.terminate()
+                process.wait()
+        log.close()
+        # The working directory is kept on failure so the log can be inspected
+        if succeeded:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"Measurement failed, logs are kept in {workdir}", file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
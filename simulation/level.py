@@ -0,0 +1,106 @@
+# Overhead and flags of the level meter of the interface
+# Writes synthetic recordings in the format of the interface (32-bit, 96kHz, stereo) the way arecord does,
+# one block at a time, and polls the real RecordingMeter after every block. Reports the time spent metering
+# per poll and as a share of the recorded audio, and checks that the quality flags match the scenario:
+# a tone, a dead microphone and a clipping one.
+# Usage (from the repository root): python3 -m simulation.level --seconds 30 --target 1.0
+import argparse
+import json
+import os
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from simulation import INTERFACE_DIR
+
+sys.path.insert(0, INTERFACE_DIR)
+from capture import RecordingMeter, BLOCK_SECONDS, SILENCE_SECONDS
+
+RATE = 96000
+CHANNELS = 2
+SAMPLE_WIDTH = 4
+
+# Header as arecord writes it at the start of a recording, the sizes are only patched at the end
+def wav_header():
+    block_align = CHANNELS * SAMPLE_WIDTH
+    return b'RIFF' + struct.pack('<I', 0) + b'WAVE' + \
+        b'fmt ' + struct.pack('<IHHIIHH', 16, 1, CHANNELS, RATE, RATE * block_align, block_align, SAMPLE_WIDTH * 8) + \
+        b'data' + struct.pack('<I', 0)
+
+# Audio of a block as bytes, level is the amplitude relative to full scale
+# A level above 1 overdrives the input, the tone is clipped at full scale
+def tone(level, start, frames):
+    t = (np.arange(frames) + start) / RATE
+    samples = np.clip(level * np.sin(2 * np.pi * 440 * t), -1, 1) * (2 ** 31 - 1)
+    return np.repeat(np.round(samples).astype('<i4'), CHANNELS).tobytes()
+
+# Scenarios as (name, expected quality, level of the block starting at a second)
+def scenarios(seconds):
+    clip_start = seconds / 2
+    return [
+        ('tone', 'ok', lambda second: 0.1),
+        ('dead', 'silence', lambda second: 0.0),
+        ('clipping', 'clipping', lambda second: 4.0 if clip_start <= second < clip_start + 1 else 0.1)
+    ]
+
+# Write a recording block by block and poll the meter after each block
+# Returns the poll durations in seconds and the quality
+def run_scenario(workdir, name, seconds, level_at):
+    file_path = os.path.join(workdir, f"{name}.wav")
+    frames = int(RATE * BLOCK_SECONDS)
+    meter = RecordingMeter(file_path)
+    durations = []
+    with open(file_path, 'wb') as f:
+        f.write(wav_header())
+        for block in range(int(seconds / BLOCK_SECONDS)):
+            f.write(tone(level_at(block * BLOCK_SECONDS), block * frames, frames))
+            f.flush()
+            started = time.perf_counter()
+            meter.poll()
+            durations.append(time.perf_counter() - started)
+    quality = meter.quality()
+    meter.close()
+    return durations, quality
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the overhead of the level meter and check its quality flags')
+    parser.add_argument('--seconds', type=float, default=max(30, SILENCE_SECONDS * 2), help='Length of every recording')
+    parser.add_argument('--target', type=float, default=1.0, help='Maximum time spent metering in percent of the recorded audio')
+    parser.add_argument('--dir', help='Directory the recordings are written to, defaults to a temporary one')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='weddingring-level-', dir=args.dir)
+    errors = []
+    results = {}
+    try:
+        for name, expected, level_at in scenarios(args.seconds):
+            durations, quality = run_scenario(workdir, name, args.seconds, level_at)
+            overhead = sum(durations) / args.seconds * 100
+            results[name] = {
+                'polls': len(durations),
+                'pollUs': {
+                    'p50': round(statistics.median(durations) * 1e6, 1),
+                    'p99': round(sorted(durations)[int(len(durations) * 0.99) - 1] * 1e6, 1),
+                    'max': round(max(durations) * 1e6, 1)
+                },
+                'overheadPercent': round(overhead, 3),
+                'quality': quality
+            }
+            if quality['quality'] != expected:
+                errors.append(f"{name}: quality is {quality['quality']}, expected {expected}")
+            if overhead > args.target:
+                errors.append(f"{name}: metering took {overhead:.3f}% of the audio time, the target is {args.target}%")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps({'settings': vars(args), 'results': results, 'errors': errors}, indent=2))
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
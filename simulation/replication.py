@@ -0,0 +1,199 @@
+# Replication between two servers on localhost
+# Starts a primary and a replica (WEDDINGRING_REPLICATE_FROM) in their own working directories and checks that the
+# replica converges: after the first copy, after a download that is cut off by killing the replica, after the replica
+# was stopped while records were uploaded, trimmed and deleted on the primary and after the primary was unreachable.
+# Reports the time every phase took to converge, the download rate against the limit and the replication lag metric.
+# Usage (from the repository root): python3 -m simulation.replication --records 6 --rate 2097152
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import urllib.request
+
+from simulation.runner import start_server, wait_for_server, post_file, request_json
+from simulation.wav import build_wav
+
+# Value of a metric without labels from /metrics, None if it is not exposed
+def metric(port, name):
+    with urllib.request.urlopen(f'http://localhost:{port}/metrics') as response:
+        for line in response.read().decode().splitlines():
+            if line.startswith(name + ' '):
+                return float(line.split()[1])
+    return None
+
+# The replicated state of all records: checksum, trim offsets and device
+def snapshot(port):
+    return {
+        record['id']: (record['checksum'], record['trimStart'], record['trimEnd'], record['deviceId'])
+        for record in request_json(f'http://localhost:{port}/records')
+    }
+
+# Checksums of the binaries as served by a server
+def binary_checksums(port, ids):
+    checksums = {}
+    for record_id in ids:
+        with urllib.request.urlopen(f'http://localhost:{port}/records/{record_id}/binary') as response:
+            checksums[record_id] = hashlib.sha256(response.read()).hexdigest()
+    return checksums
+
+# Wait until the replica holds every record of the primary, returns the seconds it took and the highest lag seen
+def wait_for_convergence(primary_port, replica_port, timeout):
+    started = time.monotonic()
+    max_lag = 0
+    while time.monotonic() - started < timeout:
+        max_lag = max(max_lag, metric(replica_port, 'weddingring_replication_lag_seconds') or 0)
+        try:
+            status = request_json(f'http://localhost:{replica_port}/replication')
+            latest = request_json(f'http://localhost:{primary_port}/replication/changes?limit=1')['latestSeq']
+            if status.get('lastSeq') == latest and snapshot(primary_port) == snapshot(replica_port):
+                return time.monotonic() - started, max_lag
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Replica did not converge within {timeout} seconds")
+
+# Upload a record, the frequency of its tone makes its content unique
+def upload(port, seconds, frequency):
+    return post_file(f'http://localhost:{port}/records', 'file', f'{frequency}.wav', build_wav(seconds, frequency=frequency))['id']
+
+# Stop a server, SIGKILL simulates a power loss
+def stop(process, sig=signal.SIGTERM):
+    process.send_signal(sig)
+    process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the replication between two servers')
+    parser.add_argument('--records', type=int, default=6, help='Records uploaded before the replica starts')
+    parser.add_argument('--seconds', type=float, default=2, help='Length of every record in seconds')
+    parser.add_argument('--large', type=float, default=8, help='Length of the record whose download is cut off')
+    parser.add_argument('--rate', type=int, default=2 * 1024 * 1024, help='Bandwidth limit of the replica in bytes per second')
+    parser.add_argument('--interval', type=float, default=0.5, help='Seconds between two polls of the replica')
+    parser.add_argument('--port', type=int, default=8095, help='Port of the primary, the replica uses the next one')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds every phase may take to converge')
+    parser.add_argument('--output', help='File the JSON report is written to')
+    parser.add_argument('--keep', action='store_true', help='Keep the working directory with logs and databases')
+    args = parser.parse_args()
+
+    primary_port, replica_port = args.port, args.port + 1
+    workdir = tempfile.mkdtemp(prefix='weddingring-replication-')
+    log = open(os.path.join(workdir, 'simulation.log'), 'w')
+    replica_env = {
+        'WEDDINGRING_REPLICATE_FROM': f'localhost:{primary_port}',
+        'WEDDINGRING_REPLICATION_RATE': args.rate,
+        'WEDDINGRING_REPLICATION_INTERVAL': args.interval
+    }
+
+    def start_primary():
+        return start_server(workdir, primary_port, log, 'primary')
+
+    def start_replica():
+        return start_server(workdir, replica_port, log, 'replica', **replica_env)
+
+    primary = start_primary()
+    replica = None
+    report = {'phases': {}, 'errors': []}
+    errors = report['errors']
+    frequency = iter(range(200, 20000, 10))
+    succeeded = False
+    try:
+        wait_for_server(primary_port)
+
+        # Initial copy, paced by the bandwidth limit
+        ids = [upload(primary_port, args.seconds, next(frequency)) for _ in range(args.records)]
+        replica = start_replica()
+        wait_for_server(replica_port)
+        seconds, max_lag = wait_for_convergence(primary_port, replica_port, args.timeout)
+        copied = metric(replica_port, 'weddingring_replicated_bytes_total') or 0
+        rate = copied / seconds
+        report['phases']['initial'] = {'records': len(ids), 'seconds': round(seconds, 2), 'bytes': int(copied),
+                                       'bytesPerSecond': int(rate), 'maxLagSeconds': max_lag}
+        # One second of burst is allowed on top of the limit
+        if rate > args.rate * (seconds + 1) / seconds * 1.1:
+            errors.append(f"Initial copy ran at {int(rate)} bytes/s, above the limit of {args.rate}")
+
+        # A download that is cut off by killing the replica continues from its .part file
+        stop(replica)
+        large = upload(primary_port, args.large, next(frequency))
+        size = request_json(f'http://localhost:{primary_port}/records/{large}')['sizeBytes']
+        part = os.path.join(workdir, 'replica', 'replica', f'{large}.part')
+        replica = start_replica()
+        deadline = time.monotonic() + args.timeout
+        while not (os.path.exists(part) and os.path.getsize(part) > size // 3) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        stop(replica, signal.SIGKILL)
+        partial = os.path.getsize(part) if os.path.exists(part) else 0
+        replica = start_replica()
+        wait_for_server(replica_port)
+        seconds, max_lag = wait_for_convergence(primary_port, replica_port, args.timeout)
+        resumed = metric(replica_port, 'weddingring_replicated_bytes_total') or 0
+        report['phases']['resume'] = {'size': size, 'partial': partial, 'downloadedAfterRestart': int(resumed),
+                                      'seconds': round(seconds, 2), 'maxLagSeconds': max_lag}
+        if not 0 < partial < size:
+            errors.append(f"The download was not cut off: {partial} of {size} bytes")
+        elif resumed > size - partial + 64 * 1024:
+            errors.append(f"Resumed download fetched {int(resumed)} bytes, {size - partial} were missing")
+
+        # Changes on the primary while the replica is down
+        stop(replica)
+        ids.append(large)
+        for record_id in ids[:2]:
+            urllib.request.urlopen(urllib.request.Request(f'http://localhost:{primary_port}/records/{record_id}', method='DELETE')).close()
+        request_json(f'http://localhost:{primary_port}/records/{ids[2]}/trim', 'PUT', {'trimStart': 100, 'trimEnd': 900})
+        ids = ids[2:] + [upload(primary_port, args.seconds, next(frequency)) for _ in range(2)]
+        replica = start_replica()
+        wait_for_server(replica_port)
+        seconds, max_lag = wait_for_convergence(primary_port, replica_port, args.timeout)
+        report['phases']['replicaDown'] = {'deleted': 2, 'trimmed': 1, 'uploaded': 2, 'seconds': round(seconds, 2),
+                                           'maxLagSeconds': max_lag}
+
+        # The primary is unreachable for a while, the lag grows until the replica caught up again
+        stop(primary)
+        outage = max(3, args.interval * 8)
+        time.sleep(outage)
+        lag_during_outage = metric(replica_port, 'weddingring_replication_lag_seconds')
+        state_during_outage = request_json(f'http://localhost:{replica_port}/replication')['state']
+        primary = start_primary()
+        wait_for_server(primary_port)
+        ids.append(upload(primary_port, args.seconds, next(frequency)))
+        seconds, max_lag = wait_for_convergence(primary_port, replica_port, args.timeout)
+        lag_after = metric(replica_port, 'weddingring_replication_lag_seconds')
+        report['phases']['primaryDown'] = {'outageSeconds': outage, 'stateDuringOutage': state_during_outage,
+                                           'lagDuringOutage': lag_during_outage, 'seconds': round(seconds, 2),
+                                           'lagAfter': lag_after}
+        if state_during_outage != 'failed' or not lag_during_outage or lag_during_outage < outage - 2 * args.interval - 1:
+            errors.append(f"Replica did not report the outage: state {state_during_outage}, lag {lag_during_outage}")
+
+        # Both servers serve the same audio for every record
+        primary_checksums = binary_checksums(primary_port, sorted(ids))
+        replica_checksums = binary_checksums(replica_port, sorted(ids))
+        report['records'] = len(ids)
+        if primary_checksums != replica_checksums:
+            errors.append('The binaries of the replica differ from the primary')
+        if set(snapshot(replica_port)) != set(ids):
+            errors.append('The replica does not hold exactly the records of the primary')
+        succeeded = True
+    finally:
+        for process in (primary, replica):
+            if process and process.poll() is None:
+                stop(process)
+        log.close()
+        # The working directory is kept on failure so the log can be inspected
+        if succeeded and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif not succeeded:
+            print(f"Simulation failed, logs are kept in {workdir}", file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if report['errors']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
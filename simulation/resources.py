@@ -0,0 +1,39 @@
+import os
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+# Context switches of the process are only reported per thread, sum them over all threads
+SWITCH_COUNTERS = ('voluntary_ctxt_switches', 'nonvoluntary_ctxt_switches')
+
+def thread_switches(pid):
+    totals = dict.fromkeys(SWITCH_COUNTERS, 0)
+    for task in os.listdir(f'/proc/{pid}/task'):
+        try:
+            with open(f'/proc/{pid}/task/{task}/status') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in totals:
+                        totals[key] += int(value.split()[0])
+        except FileNotFoundError:
+            # The thread ended while it was read
+            continue
+    return totals
+
+# Read the resource usage of a running process from /proc
+# Returns CPU time in seconds, current and peak RSS in kB and the context switch counters of all threads
+def process_usage(pid):
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name can contain spaces, the fields start after the closing parenthesis
+            fields = f.read().rsplit(')', 1)[1].split()
+        usage['cpuSeconds'] = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM', 'Threads'):
+                    usage[key] = int(value.split()[0])
+        usage.update(thread_switches(pid))
+    except (FileNotFoundError, ProcessLookupError, IndexError):
+        pass
+    return usage
@@ -0,0 +1,287 @@
+# End-to-end call cycle benchmark without hardware
+# Starts the real Flask server and one or more simulated phone units on top of the fake GPIO backend,
+# drives pick up, talk and hang up cycles and reports calls per minute, latency percentiles and resource use.
+# With several units it also checks the coordination of the server: every unit registers with its own
+# device id, gets its own configuration, only receives the commands meant for it and its records carry its id.
+# Usage (from the repository root): python3 -m simulation.runner --cycles 1000 --talk 1 --idle 0.5 --units 3
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from websockets.sync.client import connect
+
+from simulation import SERVER_DIR, INTERFACE_DIR, REPO_DIR, simulation_env
+from simulation.resources import process_usage
+from simulation.wav import build_wav
+
+# Wait until the server answers HTTP requests
+def wait_for_server(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://localhost:{port}/config', timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not come up")
+
+# Upload a file as multipart form data
+def post_file(url, field, filename, content):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: audio/wav\r\n\r\n'
+    ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+# Send a JSON request and return the decoded response
+def request_json(url, method='GET', body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+# Listens on /socket like a browser and keeps the arrival time of every message per device
+class Observer:
+    def __init__(self, port):
+        self.connection = connect(f'ws://localhost:{port}/socket')
+        self.messages = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.listen, daemon=True)
+        self.thread.start()
+
+    def listen(self):
+        try:
+            for message in self.connection:
+                with self.lock:
+                    self.messages.append((time.monotonic(), message))
+        except Exception:
+            pass
+
+    # Arrival times of the messages of a device that start with prefix, after the given time
+    def arrivals(self, device_id, prefix, since=0):
+        expected = f'DEVICE:{device_id}:{prefix}'
+        with self.lock:
+            return [arrived for arrived, message in self.messages if arrived >= since and message.startswith(expected)]
+
+    # Devices that sent a message starting with prefix after the given time
+    def senders(self, prefix, since=0):
+        with self.lock:
+            messages = [message for arrived, message in self.messages if arrived >= since]
+        return {message.split(':')[1] for message in messages if message.startswith('DEVICE:') and message.split(':', 2)[2].startswith(prefix)}
+
+    # Messages of units that arrived without a device id
+    def anonymous(self):
+        with self.lock:
+            return sum(1 for _, message in self.messages if message.startswith('STATUS:') and not message.startswith(('STATUS:UPLOAD:', 'STATUS:EXPORT:')))
+
+    def close(self):
+        self.connection.close()
+
+# Wait until all units are registered and connected
+def wait_for_devices(port, device_ids, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        online = {device['id'] for device in request_json(f'http://localhost:{port}/devices') if device['online']}
+        if online >= set(device_ids):
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"Not all units registered, online: {sorted(online)}")
+
+# Give the first unit its own settings and check that only it is told to fetch its configuration
+# The other units have to keep the default configuration
+def check_device_config(port, observer, device_ids):
+    errors = []
+    started = time.monotonic()
+    target = device_ids[0]
+    request_json(f'http://localhost:{port}/devices/{target}/config', 'PATCH', {'ringCount': 2})
+    time.sleep(1)
+    for device_id in device_ids:
+        config = request_json(f'http://localhost:{port}/config?device={device_id}')
+        expected = 2 if device_id == target else request_json(f'http://localhost:{port}/config')['ringCount']
+        if config['ringCount'] != expected:
+            errors.append(f"{device_id}: ringCount is {config['ringCount']}, expected {expected}")
+    updated = observer.senders('STATUS:CONFIG_UPDATED', started)
+    if updated != {target}:
+        errors.append(f"Config update of {target} was acknowledged by {sorted(updated)}")
+    return errors
+
+# Send COMMAND:DUMP_LATENCY to one unit after the other while the calls are running
+# Every unit answers a dump with STATUS:LATENCY_DUMPED, so the answers show where the commands went
+# Returns the send times of the commands per device and the commands the server refused
+def send_probes(port, device_ids, interval, running):
+    probes = {device_id: [] for device_id in device_ids}
+    refused = []
+    index = 0
+    while running():
+        device_id = device_ids[index % len(device_ids)]
+        sent = time.monotonic()
+        try:
+            request_json(f'http://localhost:{port}/devices/{device_id}/command', 'POST', {'command': 'COMMAND:DUMP_LATENCY'})
+            probes[device_id].append(sent)
+        except urllib.error.HTTPError as e:
+            # A unit that just finished its cycles disconnects before its process ends
+            if e.code != 409:
+                refused.append(f"Command for {device_id} was refused with {e.code}")
+        index += 1
+        time.sleep(interval)
+    return probes, refused
+
+# Match the answers of the units to the probes
+# A unit that answered more often than it was asked received commands meant for another unit
+def routing_report(observer, probes, refused, started):
+    round_trips = []
+    errors = list(refused)
+    for device_id, sent in probes.items():
+        answers = observer.arrivals(device_id, 'STATUS:LATENCY_DUMPED:', started)
+        if len(answers) != len(sent):
+            errors.append(f"{device_id} answered {len(answers)} of {len(sent)} commands")
+        round_trips += [(answer - probe) * 1000 for probe, answer in zip(sent, answers)]
+    report = {'commands': sum(map(len, probes.values())), 'errors': errors}
+    if round_trips:
+        round_trips.sort()
+        report['roundTripMs'] = {
+            'p50': round(statistics.median(round_trips), 1),
+            'p99': round(round_trips[max(0, int(len(round_trips) * 0.99) - 1)], 1),
+            'max': round(round_trips[-1], 1)
+        }
+    return report
+
+# Start the server in its own working directory so the database and the audio folders are isolated
+# A server started again with the same name keeps its database and folders
+def start_server(workdir, port, log, name='server', **variables):
+    server_dir = os.path.join(workdir, name)
+    os.makedirs(server_dir, exist_ok=True)
+    env = simulation_env([SERVER_DIR], WEDDINGRING_PORT=port, WEDDINGRING_DEBUG=0, **variables)
+    return subprocess.Popen([sys.executable, os.path.join(SERVER_DIR, 'app.py')], cwd=server_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+# Start a simulated phone unit in its own working directory
+def start_unit(workdir, name, port, args, log, **variables):
+    unit_dir = os.path.join(workdir, name)
+    os.makedirs(unit_dir)
+    env = simulation_env([REPO_DIR, INTERFACE_DIR], WEDDINGRING_SERVER=f'localhost:{port}', **variables)
+    command = [
+        sys.executable, '-m', 'simulation.unit',
+        '--cycles', str(args.cycles), '--talk', str(args.talk), '--idle', str(args.idle),
+        '--jitter', str(args.jitter), '--bounces', str(args.bounces),
+        '--result', os.path.join(unit_dir, 'result.json')
+    ]
+    if args.seed is not None:
+        command += ['--seed', str(args.seed)]
+    return subprocess.Popen(command, cwd=unit_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the end-to-end call cycle benchmark')
+    parser.add_argument('--cycles', type=int, default=100)
+    parser.add_argument('--talk', type=float, default=1.0, help='Seconds the handset stays off-hook')
+    parser.add_argument('--idle', type=float, default=0.5, help='Seconds between two calls')
+    parser.add_argument('--jitter', type=float, default=0.005, help='Maximum bounce duration of a hook edge in seconds')
+    parser.add_argument('--bounces', type=int, default=2, help='Maximum number of bounces per hook edge')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--units', type=int, default=1, help='Number of simulated phones sharing the server')
+    parser.add_argument('--probe-interval', type=float, default=1.0, help='Seconds between two commands sent to a single unit')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--greeting', type=float, default=0.5, help='Length of the greeting message in seconds')
+    parser.add_argument('--output', help='File the JSON report is written to')
+    parser.add_argument('--keep', action='store_true', help='Keep the working directory with logs and recordings')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='weddingring-sim-')
+    log = open(os.path.join(workdir, 'simulation.log'), 'w')
+    server = start_server(workdir, args.port, log)
+    observer = None
+    succeeded = False
+    try:
+        wait_for_server(args.port)
+        post_file(f'http://localhost:{args.port}/messages', 'file', 'greeting.wav', build_wav(args.greeting))
+        observer = Observer(args.port)
+
+        device_ids = [f'unit-{number}' for number in range(1, args.units + 1)]
+        started = time.monotonic()
+        units = {
+            device_id: start_unit(workdir, device_id, args.port, args, log, WEDDINGRING_DEVICE=device_id)
+            for device_id in device_ids
+        }
+        wait_for_devices(args.port, device_ids)
+        errors = check_device_config(args.port, observer, device_ids)
+
+        running = lambda: any(unit.poll() is None for unit in units.values())
+        # Probing stops once the first unit is done, a unit that disconnects can not answer anymore
+        all_running = lambda: all(unit.poll() is None for unit in units.values())
+        probe_result = {}
+        prober = threading.Thread(target=lambda: probe_result.update(zip(('probes', 'refused'), send_probes(args.port, device_ids, args.probe_interval, all_running))), daemon=True)
+        prober.start()
+        peak = {}
+        while running():
+            peak = process_usage(server.pid) or peak
+            time.sleep(1)
+        prober.join()
+        # Give the last answers time to arrive
+        time.sleep(1)
+
+        results = {}
+        for device_id, unit in units.items():
+            if unit.returncode != 0:
+                raise RuntimeError(f"Simulated unit {device_id} failed, see {log.name}")
+            with open(os.path.join(workdir, device_id, 'result.json')) as f:
+                results[device_id] = json.load(f)
+        # Identical recordings, e.g. empty ones of a starved machine, are stored once, so a unit can have fewer records than uploads
+        stored = {}
+        for device_id in device_ids:
+            stored[device_id] = len(request_json(f'http://localhost:{args.port}/records?device={device_id}'))
+            if not 0 < stored[device_id] <= results[device_id]['uploaded']:
+                errors.append(f"{device_id} uploaded {results[device_id]['uploaded']} recordings, {stored[device_id]} are stored with its id")
+        unassigned = len(request_json(f'http://localhost:{args.port}/records')) - sum(stored.values())
+        if unassigned:
+            errors.append(f"{unassigned} records are not stored with the id of their unit")
+        routing = routing_report(observer, probe_result['probes'], probe_result['refused'], started)
+        errors += routing.pop('errors')
+        if observer.anonymous():
+            errors.append(f"{observer.anonymous()} status messages of the units arrived without a device id")
+
+        wall_seconds = time.monotonic() - started
+        completed = sum(result['completed'] for result in results.values())
+        report = {
+            'settings': vars(args),
+            'wallSeconds': round(wall_seconds, 3),
+            'units': results,
+            'callsPerMinute': round(completed / wall_seconds * 60, 2),
+            'recordsStored': stored,
+            'commandRouting': routing,
+            'server': process_usage(server.pid) or peak,
+            'errors': errors
+        }
+        succeeded = True
+    finally:
+        if observer:
+            observer.close()
+        server.terminate()
+        server.wait()
+        log.close()
+        # The working directory is kept on failure so the log can be inspected
+        if succeeded and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        elif not succeeded:
+            print(f"Simulation failed, logs are kept in {workdir}", file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if report['errors']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
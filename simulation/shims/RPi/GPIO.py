@@ -0,0 +1,117 @@
+# Fake RPi.GPIO backend for the simulation
+# It implements the subset of the RPi.GPIO API used by the server and the interface.
+# Input levels are set by the simulation through set_input, edge callbacks are dispatched
+# from a single thread, just like RPi.GPIO does it.
+import queue
+import threading
+import time
+
+BCM = 11
+BOARD = 10
+IN = 1
+OUT = 0
+HIGH = 1
+LOW = 0
+RISING = 31
+FALLING = 32
+BOTH = 33
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+
+# Current level of every pin, inputs default to HIGH which equals an on-hook phone line
+levels = {}
+# Direction of every configured pin
+directions = {}
+# Registered edge callbacks per pin as (edge, callback)
+callbacks = {}
+# Log of all output changes as (monotonic timestamp, pin, level)
+output_log = []
+
+lock = threading.Lock()
+events = queue.Queue()
+dispatcher = None
+
+def setmode(mode):
+    pass
+
+def setwarnings(flag):
+    pass
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=LOW):
+    with lock:
+        directions[channel] = direction
+        if direction == OUT:
+            levels[channel] = initial
+        else:
+            levels.setdefault(channel, HIGH)
+
+def input(channel):
+    with lock:
+        return levels.get(channel, HIGH)
+
+def output(channel, value):
+    with lock:
+        levels[channel] = HIGH if value else LOW
+        output_log.append((time.monotonic(), channel, levels[channel]))
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    global dispatcher
+    with lock:
+        callbacks[channel] = (edge, callback)
+        if dispatcher is None:
+            dispatcher = threading.Thread(target=dispatch_events, daemon=True)
+            dispatcher.start()
+
+def remove_event_detect(channel):
+    with lock:
+        callbacks.pop(channel, None)
+
+def cleanup(channel=None):
+    with lock:
+        if channel is None:
+            callbacks.clear()
+        else:
+            callbacks.pop(channel, None)
+
+# Run the edge callbacks one after another, a slow callback delays the following ones
+def dispatch_events():
+    while True:
+        channel, callback = events.get()
+        try:
+            callback(channel)
+        except Exception as e:
+            print(f"Fake GPIO callback for channel {channel} failed: {e}")
+
+# Set the level of an input pin from the simulation
+# A callback is queued if the level changed and matches the registered edge
+def set_input(channel, value):
+    value = HIGH if value else LOW
+    with lock:
+        previous = levels.get(channel, HIGH)
+        levels[channel] = value
+        registration = callbacks.get(channel)
+    if registration is None or previous == value:
+        return
+    edge, callback = registration
+    if edge == BOTH or (edge == RISING and value == HIGH) or (edge == FALLING and value == LOW):
+        events.put((channel, callback))
+
+# Software PWM, the duty cycle is only recorded since there is no LED to drive
+class PWM:
+    def __init__(self, channel, frequency):
+        self.channel = channel
+        self.frequency = frequency
+        self.duty_cycle = 0
+
+    def start(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+    def stop(self):
+        self.duty_cycle = 0
@@ -0,0 +1 @@
+# Fake RPi package used by the simulation, see GPIO.py
@@ -0,0 +1,90 @@
+# Runs one simulated phone unit
+# The real PhoneStateMachine of the interface runs on top of the fake GPIO backend and is driven
+# through pick up, talk and hang up cycles. The result is written as JSON to the --result file.
+# The runner starts this module with the shims, the interface and the fake binaries on the path.
+import argparse
+import asyncio
+import json
+import random
+import resource
+import time
+
+import app as interface
+from latency import LatencyTracker
+from simulation.hook import HookScript
+
+# Wait until a condition is met or the timeout expires
+async def wait_for(condition, timeout, interval=0.01):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(interval)
+    return True
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    phone = interface.PhoneStateMachine(loop)
+    # Keep every sample of the run instead of only the latest ones
+    phone.latency = LatencyTracker(size=max(256, args.cycles))
+    connection = asyncio.create_task(phone.connect_to_websocket(interface.SOCKET_URL))
+    if not await wait_for(lambda: phone.websocket is not None, 30):
+        raise RuntimeError("Could not connect to the server")
+
+    hook = HookScript(jitter=args.jitter, bounces=args.bounces, seed=args.seed)
+    jitter = random.Random(args.seed)
+    completed = 0
+    failed = 0
+    start = time.monotonic()
+    for _ in range(args.cycles):
+        await hook.pick_up()
+        if not await wait_for(lambda: phone.state == 'offHook', 5):
+            failed += 1
+            await hook.hang_up()
+            await wait_for(lambda: phone.state == 'onHook', 5)
+            continue
+        await asyncio.sleep(args.talk * jitter.uniform(0.8, 1.2))
+        await hook.hang_up()
+        if not await wait_for(lambda: phone.state == 'onHook', 5):
+            failed += 1
+            continue
+        completed += 1
+        await asyncio.sleep(args.idle * jitter.uniform(0.8, 1.2))
+    elapsed = time.monotonic() - start
+
+    # Wait for the last uploads to be acknowledged
+    uploaded = lambda: len(phone.latency.samples['hangUp.upload_acknowledged'])
+    await wait_for(lambda: uploaded() >= completed, 60, interval=0.1)
+    connection.cancel()
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'cycles': args.cycles,
+        'completed': completed,
+        'failed': failed,
+        'uploaded': uploaded(),
+        'elapsedSeconds': round(elapsed, 3),
+        'callsPerMinute': round(completed / elapsed * 60, 2) if elapsed else 0,
+        'latencyMs': phone.latency.summary(),
+        'resources': {
+            'cpuSeconds': round(own.ru_utime + own.ru_stime, 3),
+            'maxRssKb': own.ru_maxrss,
+            'childCpuSeconds': round(children.ru_utime + children.ru_stime, 3),
+            'childMaxRssKb': children.ru_maxrss
+        }
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run one simulated phone unit')
+    parser.add_argument('--cycles', type=int, default=100)
+    parser.add_argument('--talk', type=float, default=1.0, help='Seconds the handset stays off-hook')
+    parser.add_argument('--idle', type=float, default=0.5, help='Seconds between two calls')
+    parser.add_argument('--jitter', type=float, default=0.005, help='Maximum bounce duration of a hook edge in seconds')
+    parser.add_argument('--bounces', type=int, default=2, help='Maximum number of bounces per hook edge')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--result', required=True, help='File the JSON result is written to')
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    with open(args.result, 'w') as f:
+        json.dump(result, f)
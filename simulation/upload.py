@@ -0,0 +1,140 @@
+# Uploads of the recordings when the server does not store them
+# Runs the real PhoneStateMachine of the interface against a port nobody listens on, against a server that answers
+# every POST with 503 and finally against the real server. Checks that a failed upload keeps the recording and queues
+# it, that it is not retried before its backoff delay or after the last attempt, that a recording the server refuses
+# is moved aside instead of being retried, that a recording left by an earlier run is queued at the start and that
+# the queued recordings are stored once and deleted after the server is reachable again, without another call.
+# Usage (from the repository root): python3 -m simulation.upload
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from simulation import SHIMS_DIR, INTERFACE_DIR
+from simulation.runner import start_server, wait_for_server, request_json
+from simulation.wav import build_wav
+
+# Answers every request with 503, like a server that is restarting
+class UnavailableHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+# A port nobody listens on
+def closed_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+# Upload a recording in the I/O executor of the interface and wait for it
+async def upload(phone, file_path):
+    await asyncio.wrap_future(phone.executor.submit(phone.upload_recording, file_path))
+
+async def run(interface, server_port):
+    errors = []
+    interface.UPLOAD_RETRY_DELAY = 2
+    # A recording of an earlier run that was never uploaded
+    with open('recorded_1.wav', 'wb') as f:
+        f.write(build_wav(1, frequency=310))
+    phone = interface.PhoneStateMachine(asyncio.get_running_loop())
+    if 'recorded_1.wav' not in phone.pending_uploads:
+        errors.append(f"The recording of an earlier run was not queued: {phone.pending_uploads}")
+
+    with open('recorded_2.wav', 'wb') as f:
+        f.write(build_wav(1, frequency=320))
+    interface.SERVER = f'localhost:{closed_port()}'
+    await upload(phone, 'recorded_2.wav')
+    if not os.path.exists('recorded_2.wav') or 'recorded_2.wav' not in phone.pending_uploads:
+        errors.append("An upload to an unreachable server did not keep the recording")
+
+    unavailable = ThreadingHTTPServer(('localhost', 0), UnavailableHandler)
+    threading.Thread(target=unavailable.serve_forever, daemon=True).start()
+    interface.SERVER = f'localhost:{unavailable.server_address[1]}'
+    try:
+        # Taken off the queue, the failed upload has to queue it again
+        phone.pending_uploads.pop('recorded_2.wav', None)
+        await upload(phone, 'recorded_2.wav')
+        if not os.path.exists('recorded_2.wav') or 'recorded_2.wav' not in phone.pending_uploads:
+            errors.append("An upload answered with 503 did not keep the recording")
+        phone.retry_uploads()
+        if 'recorded_2.wav' not in phone.pending_uploads:
+            errors.append("A failed upload was retried before its backoff delay")
+    finally:
+        interface.SERVER = f'localhost:{server_port}'
+        unavailable.shutdown()
+
+    # 16-bit/44.1kHz does not meet the requirements of the server, it answers 400
+    with open('recorded_3.wav', 'wb') as f:
+        f.write(build_wav(1, rate=44100, sample_width=2))
+    await upload(phone, 'recorded_3.wav')
+    if not os.path.exists(os.path.join(interface.REJECTED_FOLDER, 'recorded_3.wav')) or 'recorded_3.wav' in phone.pending_uploads:
+        errors.append("A recording the server refused was not moved to the rejected folder")
+
+    with open('recorded_4.wav', 'wb') as f:
+        f.write(build_wav(1, frequency=340))
+    interface.SERVER = f'localhost:{closed_port()}'
+    await asyncio.wrap_future(phone.executor.submit(phone.upload_recording, 'recorded_4.wav', None, None, interface.UPLOAD_MAX_ATTEMPTS - 1))
+    interface.SERVER = f'localhost:{server_port}'
+    if not os.path.exists('recorded_4.wav') or 'recorded_4.wav' in phone.pending_uploads:
+        errors.append("The last failed attempt did not keep the recording out of the queue")
+    os.remove('recorded_4.wav')
+
+    # The delays of the failed uploads retry them, no call or reconnect is needed
+    recordings = lambda: sorted(name for name in os.listdir('.') if name.startswith('recorded_'))
+    for _ in range(300):
+        if not recordings():
+            break
+        await asyncio.sleep(0.1)
+    left = recordings()
+    if left or phone.pending_uploads:
+        errors.append(f"Recordings were not uploaded again: files {left}, queued {list(phone.pending_uploads)}")
+    stored = len(request_json(f'http://localhost:{server_port}/records'))
+    if stored != 2:
+        errors.append(f"Expected the 2 recordings to be stored once, the server has {stored}")
+    phone.executor.shutdown()
+    return {'stored': stored, 'left': left}, errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that recordings are kept and uploaded again when an upload fails')
+    parser.add_argument('--port', type=int, default=8099)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='weddingring-upload-')
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    server = start_server(workdir, args.port, log)
+    interface_dir = os.path.join(workdir, 'interface')
+    os.makedirs(interface_dir)
+    cwd = os.getcwd()
+    try:
+        wait_for_server(args.port)
+        # The interface imports RPi.GPIO, the shims stand in for it
+        sys.path[:0] = [SHIMS_DIR, INTERFACE_DIR]
+        os.chdir(interface_dir)
+        import app as interface
+        result, errors = asyncio.run(run(interface, args.port))
+    finally:
+        os.chdir(cwd)
+        server.terminate()
+        server.wait()
+        log.close()
+    if not errors:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps({'result': result, 'errors': errors}, indent=2))
+    if errors:
+        print(f"Working directory kept: {workdir}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import array
+import math
+import struct
+
+# Format required by the server: 32-bit, 96kHz, stereo
+RATE = 96000
+CHANNELS = 2
+SAMPLE_WIDTH = 4
+
+# Build the header of a PCM wav file
+def wav_header(data_size, rate=RATE, channels=CHANNELS, sample_width=SAMPLE_WIDTH):
+    block_align = channels * sample_width
+    return b'RIFF' + struct.pack('<I', data_size + 36) + b'WAVE' + \
+        b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, rate, rate * block_align, block_align, sample_width * 8) + \
+        b'data' + struct.pack('<I', data_size)
+
+# Build a wav file in memory containing a quiet tone
+# The default format matches the one required by the server
+def build_wav(seconds, rate=RATE, channels=CHANNELS, sample_width=SAMPLE_WIDTH, frequency=440, level=0.1):
+    amplitude = level * (2 ** (sample_width * 8 - 1) - 1)
+    one_second = array.array('i' if sample_width == 4 else 'h')
+    for i in range(rate):
+        sample = int(amplitude * math.sin(2 * math.pi * frequency * i / rate))
+        one_second.extend([sample] * channels)
+    data = one_second.tobytes()
+    data = data * int(seconds) + data[:int((seconds % 1) * rate) * channels * sample_width]
+    return wav_header(len(data), rate, channels, sample_width) + data
@@ -4,8 +4,15 @@
 CHECK_INTERVAL=10  # Check interval in seconds
 DEVICE="/dev/sda1"
 MOUNT_POINT="/mnt/usb"
-SOURCE_DIR="/home/pi/weddingRingManager/server/recordings"
-DEST_DIR="$MOUNT_POINT/recordings"
+SERVER_URL="http://localhost:8080"
+
+# Filesystem UUID of the stick that was checked and mounted, empty while no stick is mounted
+CURRENT_UUID=""
+
+# Function to get the filesystem UUID of the device
+device_uuid() {
+    blkid -s UUID -o value "$DEVICE"
+}
 
 # Function to check if the device is mounted
 is_mounted() {
@@ -75,33 +82,39 @@ unmount_device() {
     return 0
 }
 
-# Function to perform the rsync job
-sync_files() {
-    echo "Syncing files from $SOURCE_DIR to $DEST_DIR..."
-    mkdir -p "$DEST_DIR"
-    rsync -av --delete "$SOURCE_DIR/" "$DEST_DIR/"
-    if [ $? -eq 0 ]; then
-        echo "Files synced successfully"
-    else
-        echo "Failed to sync files"
-    fi
+# Function to start the export of new recordings on the server
+# The server keeps a journal per stick and only copies recordings that are not on it yet,
+# so this is cheap when nothing changed. It answers 409 while an export is still running.
+export_files() {
+    echo "Requesting export of new recordings to $CURRENT_UUID..."
+    curl -s -X POST -H "Content-Type: application/json" \
+        -d "{\"mountPoint\": \"$MOUNT_POINT\", \"volume\": \"$CURRENT_UUID\"}" \
+        "$SERVER_URL/export"
+    echo
 }
 
 # Main loop
 while true; do
     if [ -e "$DEVICE" ]; then
         echo "$DEVICE exists"
-        check_filesystem
-        if [ $? -eq 0 ]; then
-            mount_device
-            if [ $? -eq 0 ]; then
-                sync_files
-            fi
+        uuid=$(device_uuid)
+        if [ -z "$uuid" ]; then
+            echo "Could not read the filesystem UUID of $DEVICE"
+        elif [ "$uuid" != "$CURRENT_UUID" ]; then
+            # A new stick was inserted, check it once before it is mounted
+            # A stick swapped between two checks is still mounted and has to be unmounted first
+            CURRENT_UUID=""
+            unmount_device
+            check_filesystem && mount_device && CURRENT_UUID="$uuid"
+        fi
+        if [ -n "$CURRENT_UUID" ]; then
+            export_files
         fi
     else
         echo "$DEVICE does not exist"
+        CURRENT_UUID=""
         unmount_device
     fi
     echo "Sleeping for $CHECK_INTERVAL seconds..."
     sleep "$CHECK_INTERVAL"
-done
\ No newline at end of file
+done
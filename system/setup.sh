@@ -11,7 +11,7 @@ help() {
 install() {
     echo "Installing system dependencies..."
     sudo apt-get update
-    sudo apt-get install -y vim git bc libncurses5-dev bison flex libssl-dev raspberrypi-kernel-headers ffmpeg nginx python3 python3-dev python3-pip python3-venv
+    sudo apt-get install -y vim git bc libncurses5-dev bison flex libssl-dev raspberrypi-kernel-headers ffmpeg nginx libnginx-mod-http-brotli-static python3 python3-dev python3-pip python3-venv
     sudo mount -t debugfs debugs /sys/kernel/debug
     git clone https://github.com/PaulCreaser/rpi-i2s-audio
     cd rpi-i2s-audio